@@ -0,0 +1,114 @@
+import threading
+import time
+
+# Chat-Nachrichten pro Sekunde und Client, kurzfristig bis zu CLIENT_MESSAGE_BURST; 0 = unbegrenzt
+CLIENT_MESSAGE_RATE = 100
+CLIENT_MESSAGE_BURST = 200
+# Obergrenze für Bytes, die über alle Empfänger hinweg in der Fan-out-Engine auf das Senden warten.
+# Ist sie erreicht, werden Chat-Nachrichten abgewiesen, bis die Warteschlangen wieder abgebaut sind.
+INFLIGHT_BYTES = 8 * 1024 * 1024
+# Ab diesem Anteil des Budgets gilt ein Server als überlastet: Clients werden gebremst, neue Clients umgeleitet
+OVERLOAD_THRESHOLD = 0.5
+# Pause für einen Client, wenn die Last des Servers und nicht sein eigener Token-Bucket der Grund ist
+BACKPRESSURE_DELAY = 0.1
+# Die wartenden Bytes werden höchstens so oft neu summiert
+LOAD_CHECK_INTERVAL = 0.01
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    # Wartezeit, bis wieder ein Token verfügbar ist
+    def delay(self):
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+# Zustand eines Clients: Token-Bucket, abgewiesene Client-Sequenznummer und Ende der zuletzt signalisierten Pause
+class ClientAdmission:
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.rejected_seq = None
+        self.paused_until = 0
+
+
+# Entscheidet über jede Chat-Nachricht, die ein Client über seine Sitzung schickt. inflight_bytes() liefert die
+# wartenden Bytes der Fan-out-Engine. Nach einer abgewiesenen Nachricht werden während der Pause auch alle späteren
+# desselben Clients abgewiesen, bis sie erneut eintrifft, so bleibt die Reihenfolge pro Client erhalten. Kommt nach
+# der Pause zuerst eine spätere Nachricht (der Client hat die abgewiesene verworfen), wird nicht länger gewartet.
+class AdmissionControl:
+    def __init__(self, inflight_bytes, rate=CLIENT_MESSAGE_RATE, burst=CLIENT_MESSAGE_BURST, budget=INFLIGHT_BYTES,
+                 threshold=OVERLOAD_THRESHOLD, delay=BACKPRESSURE_DELAY):
+        self.inflight_bytes = inflight_bytes
+        self.rate = rate
+        self.burst = burst
+        self.budget = budget
+        self.threshold = threshold
+        self.delay = delay
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.rejected = {'rate': 0, 'budget': 0}
+        self.signals = 0
+        self.local_load = 0.0
+        self.load_checked = None
+        # Last, die der Führer im Heartbeat meldet; bremst auch die Clients der übrigen Server
+        self.remote_load = 0.0
+
+    # Anteil des Budgets, der belegt ist; mit remote=True zählt auch die gemeldete Last des Führers
+    def load(self, remote=True, now=None):
+        now = time.monotonic() if now is None else now
+        if self.load_checked is None or now - self.load_checked >= LOAD_CHECK_INTERVAL:
+            self.load_checked = now
+            self.local_load = self.inflight_bytes() / self.budget if self.budget > 0 else 0.0
+        return max(self.local_load, self.remote_load) if remote else self.local_load
+
+    def overloaded(self, remote=True):
+        return self.load(remote) >= self.threshold
+
+    # Liefert (zugelassen, Pause in Sekunden); die Pause ist None, wenn der Client kein Signal braucht
+    def admit(self, client_id, client_seq):
+        now = time.monotonic()
+        load = self.load(now=now)
+        with self.lock:
+            client = self.clients.get(client_id)
+            if client is None:
+                client = self.clients[client_id] = ClientAdmission(TokenBucket(self.rate, self.burst, now))
+            if client.rejected_seq is not None and client_seq > client.rejected_seq:
+                if now < client.paused_until:
+                    # Der Client kennt die Pause bereits und sendet diese Nachricht danach erneut
+                    return False, None
+                client.rejected_seq = None
+            if load >= 1:
+                reason, delay = 'budget', self.delay
+            elif self.rate > 0 and not client.bucket.take(now):
+                reason, delay = 'rate', client.bucket.delay()
+            else:
+                if client.rejected_seq is not None and client_seq >= client.rejected_seq:
+                    client.rejected_seq = None
+                if load < self.threshold or now < client.paused_until:
+                    return True, None
+                # Zugelassen, aber der Client soll langsamer senden
+                client.paused_until = now + self.delay
+                self.signals += 1
+                return True, self.delay
+            self.rejected[reason] += 1
+            self.signals += 1
+            client.rejected_seq = client_seq
+            client.paused_until = now + delay
+            return False, delay
+
+    # Die Sitzung des Clients ist beendet
+    def forget(self, client_id):
+        with self.lock:
+            self.clients.pop(client_id, None)
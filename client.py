@@ -1,195 +1,503 @@
+import argparse
+import asyncio
+import random
 import socket
 import threading
 import uuid
 import json
 
+from codec import CODECS, decode_auto, get_codec, negotiate_codec
+from discovery import CACHE_DIR, MULTICAST_GROUP, PROBE_TIMEOUT, DiscoveryCache, cache_path, detect_local_ip, enable_multicast
+from log import configure_logging, logger
+from message_log import DEFAULT_ROOM, REORDER_TIMEOUT, ReorderBuffer
+from tracing import TRACE_SAMPLE_RATE, TraceCollector, last_stamp, new_trace, trace_of
+from transport import FRAME_HEADER, encode_frame, split_batch
+
 # Konstanten Definition
 BROADCAST_IP = '192.168.178.255'
 BROADCAST_PORT = 10010
-NEW_LEADER_PORT = 10020
-SERVER_ELECTION_PORT = 10030
-HEARTBEAT_SEND_PORT = 10040
-HEARTBEAT_LISTEN_PORT = 10050
+# Eigene IP-Adresse (None = automatisch ermitteln), z.B. 127.0.0.1 für Tests auf einem Rechner
+LOCAL_IP = None
 
 # Identifier für Broadcast-Nachrichten
 BROADCAST_SEND_ID = '8c2d6619-6b05-4567-aca9-9ddd4ee76876'
 BROADCAST_RESPONSE_ID = 'df147dc4-f2b0-4df7-84c8-967f46d4377c'
 
-BUFFER_SIZE = 4096
-
-# Anzahl der Versuche, die ein Server beim Start unternimmt, um andere Server zu entdecken
-SERVER_DISCOVERY_ATTEMPTS = 5
-# Anzahl der Herzschlag-Versuche, bevor ein Server eine Wahl startet
-HEARTBEAT_ATTEMPTS = 3
-HEARTBEAT_PRINT_INTERVAL = 10
-HEARTBEAT_MISSES_MAX = 3
+# Obergrenze für eine einzelne Chat-Nachricht; Nachrichten werden in Frames beliebiger Länge übertragen
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+# Wartezeit auf eine Antwort der Servererkennung bzw. auf den Verbindungsaufbau in Sekunden
+DISCOVERY_TIMEOUT = 2
+# Multicast-Gruppe der Servererkennung (None = nur Broadcast) und Verzeichnis für die zuletzt bekannten Server
+# des Kommandozeilen-Clients (None = nur im Speicher, siehe discovery.py)
+DISCOVERY_GROUP = MULTICAST_GROUP
+DISCOVERY_CACHE_DIR = CACHE_DIR
+# Wiederverbinden mit exponentiellem Backoff: die Wartezeit verdoppelt sich bis BACKOFF_MAX und wird zufällig
+# auf die Hälfte bis zum Ganzen gekürzt, damit viele Clients nach einem Ausfall nicht gleichzeitig anklopfen
+BACKOFF_INITIAL = 0.1
+BACKOFF_MAX = 10
+# TCP-Keepalive der Sitzung: ein Server, der ohne Verbindungsabbau verschwindet, fällt nach etwa
+# KEEPALIVE_IDLE + KEEPALIVE_COUNT * KEEPALIVE_INTERVAL Sekunden auf
+KEEPALIVE_IDLE = 1
+KEEPALIVE_INTERVAL = 1
+KEEPALIVE_COUNT = 3
+
+# Codecs, die der Client anbietet (in Reihenfolge der Präferenz). Zum Debuggen kann hier ['json'] eingetragen werden.
+# Mit --compression werden die komprimierenden Varianten ('binary+zlib') bevorzugt.
+PREFERRED_CODECS = list(CODECS)
+
+# Verfolgung eigener Nachrichten für die Kommandozeile (siehe tracing.py)
+TRACE_RATE = TRACE_SAMPLE_RATE
+TRACE_FILE = None
 
 # Hilfsfunktionen
+# Die eigene Adresse wird nur einmal ermittelt
+local_ip = None
+
 def get_local_ip():
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        s.connect(('10.255.255.255', 1))
-        IP = s.getsockname()[0]
-    except Exception:
-        IP = '127.0.0.1'
-    finally:
-        s.close()
-    return IP
-
-def create_broadcast_socket(timeout=None):
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    s.bind((get_local_ip(), 0))
-    if timeout:
-        s.settimeout(timeout)
-    return s
-
-def create_heartbeat_send_socket(timeout=None):
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind((get_local_ip(), 0))
-    if timeout:
-        s.settimeout(timeout)
-    return s
-
-def create_heartbeat_listen_socket(port, timeout=None):
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind(('', port))
-    if timeout:
-        s.settimeout(timeout)
-    return s
-
-def create_tcp_socket():
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind((get_local_ip(), 0))
-    s.listen()
-    return s
-
-def create_tcp_socket_with_port(port):
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind((get_local_ip(), port))
-    s.listen()
-    return s
-
-def send_tcp_message(address, message):
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(1)
-    s.connect(address)
-    s.send(message)
-    s.close()
-
-def encode_message(node_type, sender_address, content):
-    message_dict = {'node_type': node_type, 'sender': sender_address, 'content': content}
-    return json.dumps(message_dict).encode()
-
-def encode_heartbeat_message(node_type, sender_address, content, server_list, client_list):
-    message_dict = {'node_type': node_type, 'sender': sender_address, 'content': content, 'server_list': server_list, 'client_list': client_list}
-    return json.dumps(message_dict).encode()
+    global local_ip
+    if local_ip is None:
+        local_ip = LOCAL_IP or detect_local_ip()
+    return local_ip
 
-def decode_message(message):
-    return json.loads(message.decode())
+def default_discovery_addresses():
+    addresses = [(BROADCAST_IP, BROADCAST_PORT)]
+    if DISCOVERY_GROUP:
+        addresses.insert(0, (DISCOVERY_GROUP, BROADCAST_PORT))
+    return addresses
 
-# Variablen zur Speicherung der Serveradresse und des Client-Namens
-server_address = None
+def decode_message(message):
+    return decode_auto(message)
 
-# Variable, um dem Client zu ermöglichen, den Chatraum zu verlassen
-is_active = True
+def enable_keepalive(sock):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE), ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL), ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
 
-# Variable, um die Suche nach einem Server zu stoppen
-is_searching = True
+def backoff_delay(attempt, initial=BACKOFF_INITIAL, maximum=BACKOFF_MAX):
+    delay = min(maximum, initial * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
 
-# Erstelle TCP-Sockets
-client_socket = create_tcp_socket()
-client_address = client_socket.getsockname()
 
-# Definiere Client-ID und -Informationen
-client_id = str(uuid.uuid4())
-client_info = {'client_id': client_id, 'client_address': client_address}
+# Antwort auf die Servererkennung; die erste gültige Antwort gewinnt
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.response = asyncio.get_running_loop().create_future()
 
-def main():
-    discover_server()
-    threading.Thread(target=chat).start()
-    threading.Thread(target=tcp_listener).start()
-
-# Broadcast für dynamische Entdeckung
-def discover_server():
-    broadcast_socket = create_broadcast_socket(timeout=2)
-
-    while is_searching:
-        message = {'sending_id': BROADCAST_SEND_ID, 'node_type': 'client', 'sender': client_info}
-        broadcast_socket.sendto(json.dumps(message).encode(), (BROADCAST_IP, BROADCAST_PORT))
-        print("Versuche, eine Verbindung zum Server herzustellen...")
+    def datagram_received(self, data, address):
+        try:
+            message = decode_message(data)
+        except ValueError:
+            return
+        if message.get('response_id') == BROADCAST_RESPONSE_ID and not self.response.done():
+            self.response.set_result(message)
+
+
+# Client ohne Ein- und Ausgabe für Skripte, Bots, Brücken und Lasttests. Alles läuft auf der asyncio-Ereignisschleife,
+# viele Instanzen teilen sich eine Schleife. Der Client baut beim Beitritt eine Verbindung auf, über die er sendet
+# und der Server ihm alle Nachrichten schickt (Sitzung); er hört auf keinem eigenen Port.
+# Die Servererkennung fragt zuerst die zuletzt bekannten Server direkt an (beim Wiederverbinden alle Server des
+# Clusters, mit cache_file auch nach einem Neustart) und erst danach Multicast-Gruppe und Broadcast.
+# Empfangene Chat-Nachrichten liefern receive() und async for, alternativ ruft der Client on_message direkt auf.
+# Nachrichten ohne Raum erhalten alle Clients, Nachrichten in einem Raum nur dessen Mitglieder.
+#
+#     async with ChatClient() as chat_client:
+#         await chat_client.send('Hallo')
+#         await chat_client.join_room('technik')
+#         await chat_client.send('Hallo Technik', room='technik')
+#         async for message in chat_client:
+#             ...
+class ChatClient:
+    def __init__(self, discovery_addresses=None, local_ip=None, codecs=None, client_id=None, on_message=None,
+                 discovery_timeout=DISCOVERY_TIMEOUT, backoff_initial=BACKOFF_INITIAL, backoff_max=BACKOFF_MAX, cache_file=None,
+                 trace_rate=TRACE_SAMPLE_RATE, tracer=None):
+        # Ziele der Servererkennung: Multicast-Gruppe, Broadcast-Adressen oder direkt die Adressen bekannter Server
+        self.discovery_addresses = [tuple(address) for address in discovery_addresses or default_discovery_addresses()]
+        self.discovery_cache = DiscoveryCache(cache_file)
+        self.local_ip = local_ip or get_local_ip()
+        self.codecs = list(codecs or PREFERRED_CODECS)
+        self.client_id = client_id or str(uuid.uuid4())
+        self.on_message = on_message
+        self.discovery_timeout = discovery_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.info = None
+        self.server = None
+        self.codec = get_codec('json')
+        self.writer = None
+        self.connect_lock = asyncio.Lock()
+        self.reconnects = 0
+        self.closed = False
+        # Eigene Nachrichten werden fortlaufend nummeriert und bis zur Rückmeldung über den Server vorgehalten,
+        # damit sie nach einem Verbindungsabbruch erneut gesendet werden können (der Führer verwirft Duplikate)
+        self.client_seq = 0
+        self.pending = {}
+        # Der Server bremst mit #Backpressure#: bis paused_until (Zeit der Ereignisschleife) wird nichts Neues gesendet
+        self.paused_until = 0
+        self.backpressure_signals = 0
+        self.resend_handle = None
+        # Vom Server abgewiesene Client-Sequenznummer, ab der nach der Pause erneut gesendet wird
+        self.rejected_seq = None
+        # Empfangene Nachrichten werden pro Raum in der Reihenfolge der globalen Sequenznummern zugestellt
+        self.reorder_buffers = {DEFAULT_ROOM: ReorderBuffer()}
+        self.messages = asyncio.Queue()
+        # Anteil der eigenen Chat-Nachrichten, die mit 'trace' verfolgt werden; tracer schreibt die Spans
+        self.trace_rate = trace_rate
+        self.tracer = tracer
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.receive()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        await self.connect()
+
+    # Sucht den Server und tritt bei; wiederholt mit exponentiellem Backoff, bis es gelingt
+    async def connect(self):
+        attempt = 0
+        while not self.closed:
+            try:
+                response = await self.discover()
+                if 'server' not in response:
+                    # Alle infrage kommenden Server sind überlastet
+                    logger.warning('Server überlastet, neuer Versuch in %s s', response.get('retry_after'))
+                    await asyncio.sleep(max(response.get('retry_after', 0), backoff_delay(attempt, self.backoff_initial, self.backoff_max)))
+                    attempt += 1
+                    continue
+                await self.join(response)
+                return
+            except (OSError, asyncio.TimeoutError):
+                await asyncio.sleep(backoff_delay(attempt, self.backoff_initial, self.backoff_max))
+                attempt += 1
+
+    async def discover(self):
+        message = json.dumps({'sending_id': BROADCAST_SEND_ID, 'node_type': 'client', 'sender': {'client_id': self.client_id}}).encode()
+        transport, protocol = await self.loop.create_datagram_endpoint(DiscoveryProtocol, local_addr=(self.local_ip, 0), allow_broadcast=True)
+        enable_multicast(transport.get_extra_info('socket'), self.local_ip)
+        logger.info('Versuche, eine Verbindung zum Server herzustellen...')
+        deadline = self.loop.time() + self.discovery_timeout
+        # Zuerst nur die zuletzt bekannten Server (es antwortet nur der Führer, auf seinem UDP-Port, der dem TCP-Port
+        # entspricht), danach zusätzlich Gruppe und Broadcast. Die Anfrage wird mit wachsendem Abstand wiederholt,
+        # damit ein gerade erst gewählter Führer nicht erst nach discovery_timeout gefunden wird.
+        targets = self.discovery_cache.addresses() or self.discovery_addresses
+        interval = PROBE_TIMEOUT
+        try:
+            while True:
+                for address in targets:
+                    transport.sendto(message, address)
+                remaining = deadline - self.loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                try:
+                    return await asyncio.wait_for(asyncio.shield(protocol.response), min(interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+                targets = self.discovery_cache.addresses() + self.discovery_addresses
+                interval *= 2
+        finally:
+            transport.close()
+
+    async def join(self, response):
+        async with self.connect_lock:
+            self.codec = get_codec(negotiate_codec([name for name in self.codecs if name in response.get('codecs', [])]))
+            await self.attach(response['server'])
+        self.discovery_cache.remember(response['server']['server_address'], [server['server_address'] for server in response.get('server_list', [])])
+        logger.info('Chat beigetreten bei %s:%s', *self.server['server_address'])
+
+    # Baut die Sitzung zum Server auf. Die Adresse des Clients ist die seines Verbindungsendes und ändert sich
+    # mit jeder Verbindung, deshalb meldet er sich bei jeder neuen Sitzung mit #Joining# an.
+    async def attach(self, server):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*server['server_address']), self.discovery_timeout)
+        enable_keepalive(writer.get_extra_info('socket'))
+        if self.writer is not None:
+            self.writer.close()
+        self.server = server
+        self.writer = writer
+        self.info = {'client_id': self.client_id, 'client_address': writer.get_extra_info('sockname')[:2], 'session': True}
+        self.loop.create_task(self.read_messages(reader, writer))
+        extra = {'codecs': self.codecs, 'session': True}
+        if len(self.reorder_buffers) > 1:
+            extra['rooms'] = self.rooms()
+        # Beim Wiederverbinden nur die verpassten Nachrichten nachliefern lassen
+        extra.update(self.replay_position())
+        self.send_message('#Joining#', extra)
+        self.resend_pending_messages()
+
+    # Der Server schickt alle Nachrichten über die Sitzung. Fällt er aus (auch der Führer), endet die Sitzung
+    # und der Client sucht per Servererkennung den nun zuständigen Server.
+    async def read_messages(self, reader, writer):
         try:
-            data, address = broadcast_socket.recvfrom(BUFFER_SIZE)
-        except TimeoutError:
+            while writer is self.writer:
+                (length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                frame = await reader.readexactly(length)
+                # Der Server fasst Nachrichten, die kurz nacheinander eintreffen, zu einem Frame zusammen
+                for payload in split_batch(frame):
+                    self.handle_server_message(decode_message(payload))
+        except (asyncio.IncompleteReadError, OSError):
             pass
-        else:
-            response = decode_message(data)
-            if 'response_id' in response and response['response_id'] == BROADCAST_RESPONSE_ID:
-                set_server = response
-                set_server_address(response.get('server'))
-                print(f'Server gefunden bei {server_address["server_address"][0]}:{server_address["server_address"][1]}')
-                break
-
-    broadcast_socket.close()
-    try:
-        send_message_to_server('#Joining#')
-    except (ConnectionRefusedError, TimeoutError):
-        print('Fehler beim Beitreten zum Chat! \r Erneuter Versuch...')
-    else:
-        print('Chat beigetreten!')
-
-# Funktion zum Empfangen von TCP-Nachrichten vom Server
-def tcp_listener():
-    client_socket.settimeout(2)
-    while is_active:
+        except (ValueError, KeyError, TypeError, AttributeError):
+            # Eine unlesbare Nachricht beendet die Sitzung wie ein Verbindungsabbruch
+            logger.warning('Ungültige Nachricht vom Server')
+        if writer is not self.writer or self.closed:
+            return
+        writer.close()
+        self.writer = None
+        self.reconnects += 1
+        logger.warning('Verbindung zum Server verloren, erneuter Verbindungsversuch...')
+        await asyncio.sleep(backoff_delay(0, self.backoff_initial, self.backoff_max))
+        await self.connect()
+
+    def send_message(self, message_content, extra=None):
+        if self.writer is None or self.writer.is_closing():
+            return False
+        message = {'node_type': 'client', 'sender': self.info, 'content': message_content}
+        if extra:
+            message.update(extra)
+        self.writer.write(encode_frame(self.codec.encode(message)))
+        return True
+
+    # Sendet eine Chat-Nachricht und liefert ihre Client-Sequenznummer. Ist der Server gerade nicht erreichbar,
+    # bleibt die Nachricht vorgehalten und wird nach dem Wiederverbinden gesendet.
+    async def send(self, message_content, room=DEFAULT_ROOM):
+        if len(message_content.encode()) > MAX_MESSAGE_SIZE:
+            raise ValueError('Nachricht ist zu lang')
+        if room not in self.reorder_buffers:
+            raise ValueError(f'Nicht im Raum {room}')
+        delay = self.paused_until - self.loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.client_seq += 1
+        seq = self.client_seq
+        self.pending[seq] = (message_content, room)
+        extra = self.message_extra(seq, room)
+        if self.trace_rate and random.random() < self.trace_rate:
+            # Nur der erste Versand wird verfolgt
+            extra['trace'] = new_trace('client.send')
+        if self.send_message(message_content, extra):
+            await self.drain()
+        return seq
+
+    async def join_room(self, room):
+        if not isinstance(room, str) or room == DEFAULT_ROOM:
+            raise ValueError('Ungültiger Raumname')
+        if room in self.reorder_buffers:
+            return
+        self.reorder_buffers[room] = ReorderBuffer()
+        if self.send_message('#Joining#', {'room': room}):
+            await self.drain()
+
+    # Nachrichten, die noch in den Raum unterwegs sind, werden nicht mehr wiederholt. Ausgenommen sind die vom Server
+    # abgewiesenen: er wartet auf sie, bevor er weitere Nachrichten des Clients annimmt.
+    async def leave_room(self, room):
+        if room == DEFAULT_ROOM or self.reorder_buffers.pop(room, None) is None:
+            return
+        for seq, (_, message_room) in list(self.pending.items()):
+            if message_room == room and (self.rejected_seq is None or seq < self.rejected_seq):
+                del self.pending[seq]
+        if self.send_message('#Leaving#', {'room': room}):
+            await self.drain()
+
+    def rooms(self):
+        return [room for room in self.reorder_buffers if room != DEFAULT_ROOM]
+
+    async def drain(self):
         try:
-            client, address = client_socket.accept()
-            if client:
-                message = decode_message(client.recv(BUFFER_SIZE))
-                sender = tuple(message.get('content').get('sender').get('client_address'))
-                content = message.get('content').get('content')
-                print(f'\r{sender[0]}: {content}')
-        except TimeoutError:
-            continue
-
-    client_socket.close()
-
-# Setzt die Serveradresse, an die Nachrichten gesendet werden
-def set_server_address(address: tuple):
-    global server_address
-    server_address = address
-
-# Chat-Nachrichten an den Server senden
-def chat():
-    while is_active:
-        message_content = input('\r')
-
-        print("\033[A\033[A")
-
-        if len(message_content) > BUFFER_SIZE / 10:
-            print('Nachricht ist zu lang')
-        elif len(message_content) == 0:
-            continue
-        elif '/leave' in message_content:
-            set_is_active(False)
-            send_message_to_server('#Leaving#')
+            await self.writer.drain()
+        except (OSError, AttributeError):
+            pass
+
+    def message_extra(self, seq, room):
+        if room == DEFAULT_ROOM:
+            return {'client_seq': seq}
+        return {'client_seq': seq, 'room': room}
+
+    # Höchste bekannte Sequenznummer und, falls kleiner, die Nummer, ab der in einem der Räume Nachrichten fehlen
+    def replay_position(self):
+        seqs = [buffer.last_seq for buffer in self.reorder_buffers.values() if buffer.last_seq is not None]
+        if not seqs:
+            return {}
+        position = {'last_seq': max(seqs)}
+        if min(seqs) < max(seqs):
+            position['since_seq'] = min(seqs)
+        return position
+
+    # Nächste Chat-Nachricht; None, sobald der Client geschlossen wurde
+    async def receive(self):
+        return await self.messages.get()
+
+    def resume(self):
+        position = self.replay_position()
+        if position:
+            self.send_message('#Resume#', position)
+        self.resend_pending_messages()
+
+    def resend_pending_messages(self, since_seq=0):
+        for seq, (message_content, room) in list(self.pending.items()):
+            if seq >= since_seq:
+                self.send_message(message_content, self.message_extra(seq, room))
+
+    # Der Server ist überlastet oder der Client sendet zu schnell. Hat der Server eine Nachricht abgewiesen (client_seq),
+    # hat er auch alle späteren verworfen; sie werden nach der Pause der Reihe nach erneut gesendet.
+    def handle_backpressure(self, message):
+        self.backpressure_signals += 1
+        self.paused_until = max(self.paused_until, self.loop.time() + message['retry_after'])
+        if 'client_seq' in message:
+            if self.resend_handle is not None:
+                self.resend_handle.cancel()
+            self.rejected_seq = message['client_seq']
+            self.resend_handle = self.loop.call_at(self.paused_until, self.resend_rejected_messages)
+
+    def resend_rejected_messages(self):
+        self.resend_handle = None
+        self.resend_pending_messages(self.rejected_seq)
+        self.rejected_seq = None
+        # Nachrichten in inzwischen verlassene Räume erreichen den Client nicht mehr und blieben sonst für immer vorgehalten
+        for seq, (_, room) in list(self.pending.items()):
+            if room not in self.reorder_buffers:
+                del self.pending[seq]
+
+    def handle_server_message(self, message):
+        content = message['content']
+        if content == '#Backpressure#':
+            self.handle_backpressure(message)
+            return
+        if 'seq' not in message:
+            self.deliver(content)
+            return
+        trace_of(content, 'client.receive')
+        room = content.get('room', DEFAULT_ROOM)
+        reorder_buffer = self.reorder_buffers.get(room)
+        if reorder_buffer is None:
+            # Raum bereits verlassen
+            return
+        delivered, gap = reorder_buffer.receive(message['seq'], content, content.get('prev'))
+        for content in delivered:
+            self.deliver(content)
+        if gap:
+            self.resume()
+            self.loop.call_later(REORDER_TIMEOUT, self.skip_missing_messages, room)
+
+    # Fehlende Nachrichten sind nicht mehr verfügbar, mit den zurückgehaltenen fortfahren
+    def skip_missing_messages(self, room=DEFAULT_ROOM):
+        reorder_buffer = self.reorder_buffers.get(room)
+        if reorder_buffer is None:
+            return
+        for content in reorder_buffer.skip():
+            self.deliver(content)
+
+    def deliver(self, message):
+        own = message['sender'].get('client_id') == self.client_id
+        if own:
+            self.pending.pop(message.get('client_seq'), None)
+        trace = trace_of(message, 'client.deliver')
+        if trace is not None and self.tracer is not None:
+            # Der Absender schreibt den ganzen Weg, die übrigen Empfänger nur den Abschnitt ab der Verteilung
+            self.tracer.hops(trace, 0 if own else last_stamp(trace, 'server.fanout'), f'Client {self.client_id[:8]}')
+        if self.on_message is not None:
+            self.on_message(message)
         else:
-            send_message_to_server(message_content)
+            self.messages.put_nowait(message)
+
+    async def leave(self):
+        self.send_message('#Leaving#')
+        await self.close()
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.writer is not None:
+            self.writer.close()
+        self.messages.put_nowait(None)
 
-def send_message_to_server(message_content):
-    try:
-        send_tcp_message(tuple(server_address['server_address']), encode_message('client', client_info, message_content))
-    except (ConnectionRefusedError, TimeoutError):
-        print('\rFehler beim Senden der Nachricht, erneuter Verbindungsversuch zum Server...')
-        discover_server()
 
-def set_is_active(active):
-    global is_active
-    is_active = active
+# Kommandozeilen-Client: liest Chat-Nachrichten von der Tastatur und gibt empfangene Nachrichten aus
+def main():
+    configure_logging('info')
+    asyncio.run(chat())
+
+async def chat():
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue()
+    threading.Thread(target=read_input, args=(loop, lines), daemon=True).start()
+    # '/join <Raum>' betritt einen Raum und schreibt fortan dorthin, '/leave <Raum>' verlässt ihn, '/leave' beendet den Chat
+    room = DEFAULT_ROOM
+    tracer = TraceCollector(TRACE_FILE, 'Client') if TRACE_FILE else None
+    async with ChatClient(cache_file=cache_path(DISCOVERY_CACHE_DIR, 'client', BROADCAST_PORT), trace_rate=TRACE_RATE, tracer=tracer) as chat_client:
+        printer = loop.create_task(print_messages(chat_client))
+        while True:
+            message_content = await lines.get()
+
+            print("\033[A\033[A")
+
+            command, _, argument = message_content.partition(' ')
+            if len(message_content.encode()) > MAX_MESSAGE_SIZE:
+                print('Nachricht ist zu lang')
+            elif len(message_content) == 0:
+                continue
+            elif command == '/join' and argument:
+                await chat_client.join_room(argument)
+                room = argument
+            elif command == '/leave' and argument:
+                await chat_client.leave_room(argument)
+                if room == argument:
+                    room = DEFAULT_ROOM
+            elif '/leave' in message_content:
+                await chat_client.leave()
+                break
+            else:
+                await chat_client.send(message_content, room)
+        printer.cancel()
+
+# input() blockiert und läuft deshalb in einem eigenen Thread
+def read_input(loop, lines):
+    while True:
+        try:
+            line = input('\r')
+        except EOFError:
+            line = '/leave'
+        loop.call_soon_threadsafe(lines.put_nowait, line)
+        if line == '/leave':
+            return
+
+async def print_messages(chat_client):
+    async for message in chat_client:
+        sender = tuple(message.get('sender').get('client_address'))
+        room = f'[{message["room"]}] ' if message.get('room') else ''
+        print(f'\r{room}{sender[0]}: {message.get("content")}')
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--local-ip', default=LOCAL_IP, help='Eigene IP-Adresse, z.B. 127.0.0.1 für Tests auf einem Rechner')
+    parser.add_argument('--broadcast-ip', default=BROADCAST_IP)
+    parser.add_argument('--broadcast-port', type=int, default=BROADCAST_PORT)
+    parser.add_argument('--discovery-group', default=DISCOVERY_GROUP, help='Multicast-Gruppe der Servererkennung, leer = nur Broadcast')
+    parser.add_argument('--discovery-cache-dir', default=DISCOVERY_CACHE_DIR, help='Verzeichnis für die zuletzt bekannten Server, leer = aus')
+    parser.add_argument('--compression', action='store_true', help='Große Nachrichten komprimiert empfangen und senden')
+    parser.add_argument('--trace-rate', type=float, default=TRACE_RATE, help='Anteil der eigenen Nachrichten, die verfolgt werden')
+    parser.add_argument('--trace-file', default=TRACE_FILE, help='Spans verfolgter Nachrichten im Chrome-Trace-Format hier anhängen')
+    args = parser.parse_args()
+    LOCAL_IP = args.local_ip
+    BROADCAST_IP = args.broadcast_ip
+    BROADCAST_PORT = args.broadcast_port
+    DISCOVERY_GROUP = args.discovery_group or None
+    DISCOVERY_CACHE_DIR = args.discovery_cache_dir or None
+    TRACE_RATE = args.trace_rate
+    TRACE_FILE = args.trace_file
+    if args.compression:
+        PREFERRED_CODECS = sorted(CODECS, key=lambda name: not name.endswith('+zlib'))
     main()
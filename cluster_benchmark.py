@@ -0,0 +1,411 @@
+import argparse
+import asyncio
+import collections
+import datetime
+import functools
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from client import ChatClient
+from codec import decode_auto
+from message_log import DEFAULT_ROOM
+from tracing import TraceCollector, summarize
+from transport import MAX_DATAGRAM_SIZE, DatagramAssembler
+
+# End-to-End-Benchmark auf Loopback: startet N Server als eigene Prozesse und M synthetische Clients
+# (verteilt auf einen oder mehrere Prozesse), erzeugt eine feste Nachrichtenrate und misst Durchsatz,
+# Zustelllatenz, CPU und Speicher. Im Szenario 'failover' wird der Führer während der Messung beendet.
+# Mit --rooms R verteilen sich die Clients reihum auf R Räume und schreiben nur in ihren Raum.
+# Zeitstempel stammen aus time.perf_counter_ns(), das unter Linux prozessübergreifend vergleichbar ist.
+# Mit --trace-file verfolgen Clients und Server einen Anteil der Nachrichten (--trace-rate) über alle Stationen;
+# der Bericht zeigt, welcher Abschnitt die Latenz bestimmt, die Datei lässt sich in ui.perfetto.dev öffnen.
+
+LOCAL_IP = '127.0.0.1'
+BROADCAST_IP = '127.255.255.255'
+# Broadcast-Port = BASE_PORT, Heartbeat-Port = BASE_PORT + 1, Server-Ports ab BASE_PORT + 10
+BASE_PORT = 20010
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+STARTUP_TIMEOUT = 30
+# Der Führer gilt als stabil, wenn er so lange unverändert bleibt
+LEADER_STABLE_TIME = 1.0
+DISCOVERY_TIMEOUT = 0.5
+BENCHMARK_PREFIX = 'bench:'
+
+
+# Hilfsfunktionen für Messwerte
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def process_cpu_seconds(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def process_rss_mb(pid='self'):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(SERVER_SCRIPT),
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# Liest die Heartbeats mit und erkennt so den aktuellen Führer und den Stand der Mitgliedschaft
+class HeartbeatMonitor:
+    def __init__(self, port):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', port))
+        self.sock.settimeout(0.1)
+        self.assembler = DatagramAssembler()
+        self.leader = None
+        self.leader_port = None
+        self.version = 0
+        # Führungswechsel: (Zeitpunkt, Server-ID, Port)
+        self.changes = []
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            try:
+                data, address = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+            except TimeoutError:
+                continue
+            data = self.assembler.feed(data, address)
+            if not data:
+                continue
+            message = decode_auto(data)
+            sender = message['sender']
+            if sender['server_id'] != self.leader:
+                self.changes.append((time.perf_counter(), sender['server_id'], sender['server_address'][1]))
+            self.leader = sender['server_id']
+            self.leader_port = sender['server_address'][1]
+            self.version = message['version']
+
+    def wait_for(self, condition, timeout=STARTUP_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                raise TimeoutError('Cluster hat den erwarteten Zustand nicht erreicht')
+            time.sleep(0.05)
+
+    def wait_for_stable_leader(self, timeout=STARTUP_TIMEOUT):
+        self.wait_for(lambda: self.changes and time.perf_counter() - self.changes[-1][0] > LEADER_STABLE_TIME, timeout)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+# Raum des Clients mit dieser Nummer; die Nachrichten-ID endet mit der Nummer des Raums
+def room_index(config, index):
+    return index % config['rooms'] if config['rooms'] else 0
+
+def room_name(config, index):
+    return f'bench-{room_index(config, index)}' if config['rooms'] else DEFAULT_ROOM
+
+# So viele Clients müssen eine Nachricht erhalten
+def expected_deliveries(config, message_id):
+    if not config['rooms']:
+        return config['clients']
+    return len(range(int(message_id.rsplit('-', 1)[1]), config['clients'], config['rooms']))
+
+
+# Zählt nur die Nachrichten des Benchmarks, der Text enthält ID und Sendezeitpunkt
+def record_delivery(stats, receiver, message):
+    text = message.get('content')
+    if isinstance(text, str) and text.startswith(BENCHMARK_PREFIX):
+        message_id, sent_ns = text[len(BENCHMARK_PREFIX):].rsplit(':', 1)
+        stats.record(receiver, message_id, int(sent_ns))
+
+
+# Messwerte eines Client-Prozesses
+class ClientStats:
+    def __init__(self):
+        self.sent = 0
+        self.expected = 0
+        self.measure_from_ns = None
+        self.latencies_us = []
+        self.deliveries = collections.Counter()
+        self.seen = set()
+
+    def record(self, receiver, message_id, sent_ns):
+        key = (receiver, message_id)
+        if key in self.seen:
+            return
+        self.seen.add(key)
+        self.deliveries[message_id] += 1
+        now = time.perf_counter_ns()
+        if self.measure_from_ns is not None and sent_ns >= self.measure_from_ns:
+            self.latencies_us.append((now - sent_ns) // 1000)
+
+
+async def run_clients(config, indices, worker_id, ready_queue, control_queue):
+    loop = asyncio.get_running_loop()
+    stats = ClientStats()
+    tracer = TraceCollector(config['trace_file'], f'Clients {worker_id}') if config['trace_file'] else None
+    clients = [ChatClient([(BROADCAST_IP, config['base_port'])], LOCAL_IP, [config['codec']], on_message=functools.partial(record_delivery, stats, index),
+                          discovery_timeout=DISCOVERY_TIMEOUT, trace_rate=config['trace_rate'] if tracer else 0, tracer=tracer)
+               for index in indices]
+    await asyncio.gather(*(client.start() for client in clients))
+    if config['rooms']:
+        await asyncio.gather(*(client.join_room(room_name(config, index)) for client, index in zip(clients, indices)))
+    ready_queue.put(('ready', worker_id))
+    start = await loop.run_in_executor(None, control_queue.get)
+
+    # Erst die Aufwärmphase, danach zählen die Latenzen
+    stats.measure_from_ns = int((start + config['warmup']) * 1e9)
+    rate = config['rate'] / config['workers']
+    end = start + config['warmup'] + config['duration']
+    cpu_before = resource.getrusage(resource.RUSAGE_SELF)
+    count = 0
+    while True:
+        now = time.perf_counter()
+        if now >= end:
+            break
+        due = int((now - start) * rate) + 1
+        while count < due:
+            index = indices[count % len(clients)]
+            message_id = f'{worker_id}-{count}-{room_index(config, index)}'
+            await clients[count % len(clients)].send(f'{BENCHMARK_PREFIX}{message_id}:{time.perf_counter_ns()}', room_name(config, index))
+            stats.sent += 1
+            stats.expected += expected_deliveries(config, message_id)
+            count += 1
+        await asyncio.sleep(min(1 / rate, end - now))
+    await asyncio.sleep(config['drain'])
+    cpu_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    ready_queue.put(('result', worker_id, {
+        'sent': stats.sent,
+        'expected_deliveries': stats.expected,
+        'reconnects': sum(client.reconnects for client in clients),
+        'backpressure': sum(client.backpressure_signals for client in clients),
+        'latencies_us': stats.latencies_us,
+        'deliveries': dict(stats.deliveries),
+        'pending': sum(len(client.pending) for client in clients),
+        'cpu_seconds': (cpu_after.ru_utime + cpu_after.ru_stime) - (cpu_before.ru_utime + cpu_before.ru_stime),
+        'rss_mb': process_rss_mb(),
+    }))
+
+def client_worker(config, indices, worker_id, ready_queue, control_queue):
+    asyncio.run(run_clients(config, indices, worker_id, ready_queue, control_queue))
+
+
+def start_server(config, index, log_dir):
+    command = [sys.executable, SERVER_SCRIPT, '--mode', config['mode'], '--local-ip', LOCAL_IP,
+               '--port', str(config['base_port'] + 10 + index), '--broadcast-ip', BROADCAST_IP,
+               '--broadcast-port', str(config['base_port']), '--heartbeat-port', str(config['base_port'] + 1),
+               '--discovery-attempts', '1', '--client-placement', config['client_placement']] + config['server_args']
+    if config['journal_dir']:
+        # Jeder Server journalisiert in ein eigenes, anfangs leeres Verzeichnis
+        journal_dir = os.path.join(config['journal_dir'], f'server-{index}')
+        shutil.rmtree(journal_dir, ignore_errors=True)
+        command += ['--journal-dir', journal_dir]
+    if config['trace_file']:
+        command += ['--trace-file', config['trace_file']]
+    output = subprocess.DEVNULL
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+        output = open(os.path.join(log_dir, f'server-{index}.log'), 'w')
+    return subprocess.Popen(command, stdout=output, stderr=subprocess.STDOUT, cwd=os.path.dirname(SERVER_SCRIPT))
+
+def run(config):
+    if config['trace_file'] and os.path.exists(config['trace_file']):
+        # Jeder Lauf beginnt eine neue Datei, in die alle Prozesse anhängen
+        os.remove(config['trace_file'])
+    monitor = HeartbeatMonitor(config['base_port'] + 1)
+    servers = {}
+    workers = []
+    try:
+        # Der erste Server wird Führer, die weiteren treten nacheinander bei
+        for index in range(config['servers']):
+            servers[config['base_port'] + 10 + index] = start_server(config, index, config['server_log_dir'])
+            if index == 0:
+                monitor.wait_for(lambda: monitor.leader is not None)
+            else:
+                time.sleep(0.2)
+        # Jeder Beitritt kann eine Wahl auslösen; die Version zählt der jeweilige Führer weiter
+        monitor.wait_for_stable_leader()
+        base_version = monitor.version
+
+        context = multiprocessing.get_context('spawn')
+        ready_queue = context.Queue()
+        control_queues = []
+        for worker_id in range(config['workers']):
+            control_queue = context.Queue()
+            indices = list(range(worker_id, config['clients'], config['workers']))
+            process = context.Process(target=client_worker, args=(config, indices, worker_id, ready_queue, control_queue), daemon=True)
+            process.start()
+            workers.append(process)
+            control_queues.append(control_queue)
+        for _ in workers:
+            ready_queue.get(timeout=STARTUP_TIMEOUT)
+        # Ein Beitritt pro Client, mit Räumen zusätzlich ein Raumwechsel
+        monitor.wait_for(lambda: monitor.version >= base_version + config['clients'] * (2 if config['rooms'] else 1))
+
+        start = time.perf_counter() + 0.2
+        for control_queue in control_queues:
+            control_queue.put(start)
+        measure_start = start + config['warmup']
+        time.sleep(max(0.0, measure_start - time.perf_counter()))
+        cpu_before = {port: process_cpu_seconds(process.pid) for port, process in servers.items()}
+
+        failover = None
+        if config['scenario'] == 'failover':
+            time.sleep(config['duration'] / 2)
+            leader_port = monitor.leader_port
+            killed_at = time.perf_counter()
+            servers[leader_port].kill()
+            servers[leader_port].wait()
+            cpu_before.pop(leader_port, None)
+            monitor.wait_for(lambda: monitor.changes[-1][0] > killed_at, config['duration'] / 2 + config['drain'])
+            new_leader = monitor.changes[-1]
+            failover = {'killed_port': leader_port, 'new_leader_port': new_leader[2],
+                        'time_to_new_leader_ms': (new_leader[0] - killed_at) * 1000}
+
+        time.sleep(max(0.0, measure_start + config['duration'] - time.perf_counter()))
+        cpu_after = {port: process_cpu_seconds(process.pid) for port, process in servers.items() if process.poll() is None}
+        rss = {port: process_rss_mb(process.pid) for port, process in servers.items() if process.poll() is None}
+
+        worker_results = []
+        for _ in workers:
+            message = ready_queue.get(timeout=config['duration'] + config['warmup'] + config['drain'] + STARTUP_TIMEOUT)
+            worker_results.append(message[2])
+    finally:
+        for process in workers:
+            process.join(timeout=5)
+        for process in servers.values():
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
+        monitor.close()
+
+    latencies = sorted(latency for result in worker_results for latency in result['latencies_us'])
+    deliveries = collections.Counter()
+    for result in worker_results:
+        deliveries.update(result['deliveries'])
+    sent = sum(result['sent'] for result in worker_results)
+    # Eine Nachricht gilt als verloren, wenn sie nicht alle Clients (ihres Raums) erreicht hat
+    lost = sent - sum(1 for message_id, count in deliveries.items() if count >= expected_deliveries(config, message_id))
+    server_cpu = {port: (cpu_after[port] - cpu_before[port]) / config['duration']
+                  for port in cpu_after if cpu_before.get(port) is not None and cpu_after[port] is not None}
+
+    def milliseconds(value):
+        return None if value is None else value / 1000
+
+    results = {
+        'messages_sent': sent,
+        'messages_per_s': sent / (config['warmup'] + config['duration']),
+        'deliveries_per_s': len(latencies) / config['duration'],
+        'latency_ms': {
+            'p50': milliseconds(percentile(latencies, 0.5)),
+            'p99': milliseconds(percentile(latencies, 0.99)),
+            'p999': milliseconds(percentile(latencies, 0.999)),
+            'max': milliseconds(latencies[-1] if latencies else None),
+        },
+        'messages_lost': lost,
+        'missing_deliveries': sum(result['expected_deliveries'] for result in worker_results) - sum(deliveries.values()),
+        'client_reconnects': sum(result['reconnects'] for result in worker_results),
+        'backpressure_signals': sum(result['backpressure'] for result in worker_results),
+        'server_cpu_cores': server_cpu,
+        'server_rss_mb': rss,
+        'client_cpu_cores': sum(result['cpu_seconds'] for result in worker_results) / (config['warmup'] + config['duration'] + config['drain']),
+        'client_rss_mb': sum(result['rss_mb'] or 0 for result in worker_results),
+    }
+    if failover is not None:
+        results['failover'] = failover
+    if config['trace_file'] and os.path.exists(config['trace_file']):
+        results['trace_ms'] = {name: dict(zip(('count', 'p50', 'p99', 'max'), values)) for name, values in summarize(config['trace_file']).items()}
+    return {
+        'version': git_version(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'config': config,
+        'results': results,
+    }
+
+def print_report(report):
+    config = report['config']
+    results = report['results']
+    latency = results['latency_ms']
+    rooms = f' in {config["rooms"]} Räumen' if config.get('rooms') else ''
+    print(f'Version {report["version"]}, {config["servers"]} Server ({config["mode"]}, {config["client_placement"]}), '
+          f'{config["clients"]} Clients{rooms}, {config["rate"]} Nachrichten/s, Szenario {config["scenario"]}')
+    print(f'Gesendet:        {results["messages_sent"]} ({results["messages_per_s"]:.0f}/s)')
+    print(f'Zustellungen/s:  {results["deliveries_per_s"]:.0f}')
+    print('Latenz ms:       ' + ', '.join(f'{name} {value:.2f}' if value is not None else f'{name} -' for name, value in latency.items()))
+    print(f'Verloren:        {results["messages_lost"]} Nachrichten, {results["missing_deliveries"]} Zustellungen')
+    print(f'Server CPU:      {", ".join(f"{port}: {cores:.2f}" for port, cores in results["server_cpu_cores"].items())} Kerne')
+    print(f'Server RSS:      {", ".join(f"{port}: {mb:.1f}" for port, mb in results["server_rss_mb"].items() if mb is not None)} MB')
+    print(f'Clients:         {results["client_cpu_cores"]:.2f} Kerne, {results["client_rss_mb"]:.1f} MB, {results["client_reconnects"]} Wiederverbindungen, '
+          f'{results["backpressure_signals"]} Bremssignale')
+    if 'failover' in results:
+        failover = results['failover']
+        print(f'Failover:        Führer auf Port {failover["killed_port"]} beendet, neuer Führer auf Port '
+              f'{failover["new_leader_port"]} nach {failover["time_to_new_leader_ms"]:.0f} ms')
+    if 'trace_ms' in results:
+        print(f'Abschnitte ms ({config["trace_file"]}):')
+        for name, span in results['trace_ms'].items():
+            print(f'  {name:<36} {span["count"]:>6}x  p50 {span["p50"]:.2f}, p99 {span["p99"]:.2f}, max {span["max"]:.2f}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--servers', type=int, default=3)
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--rooms', type=int, default=0, help='Anzahl der Räume (0 = alle Clients im gemeinsamen Chat)')
+    parser.add_argument('--workers', type=int, default=1, help='Anzahl der Prozesse für die synthetischen Clients')
+    parser.add_argument('--rate', type=float, default=200, help='Chat-Nachrichten pro Sekunde insgesamt')
+    parser.add_argument('--duration', type=float, default=10, help='Messdauer in Sekunden')
+    parser.add_argument('--warmup', type=float, default=1)
+    parser.add_argument('--drain', type=float, default=2, help='Wartezeit auf ausstehende Zustellungen nach dem Ende der Last')
+    parser.add_argument('--scenario', choices=('steady', 'failover'), default='steady')
+    parser.add_argument('--mode', choices=('threads', 'asyncio'), default='threads')
+    parser.add_argument('--client-placement', choices=('leader', 'hash'), default='leader')
+    parser.add_argument('--codec', default='binary', help='Codec, den die Clients anbieten')
+    parser.add_argument('--base-port', type=int, default=BASE_PORT)
+    parser.add_argument('--journal-dir', help='Server journalisieren in Unterverzeichnisse dieses Verzeichnisses')
+    parser.add_argument('--trace-file', help='Verfolgte Nachrichten im Chrome-Trace-Format in diese Datei schreiben')
+    parser.add_argument('--trace-rate', type=float, default=0.01, help='Anteil der verfolgten Nachrichten mit --trace-file')
+    parser.add_argument('--server-log-dir', help='Ausgaben der Server in dieses Verzeichnis schreiben')
+    parser.add_argument('--output', help='Ergebnis als JSON in diese Datei schreiben')
+    parser.add_argument('--json', action='store_true', help='Ergebnis als JSON ausgeben')
+    parser.add_argument('server_args', nargs=argparse.REMAINDER, help='weitere Argumente für server.py nach --')
+    args = parser.parse_args()
+    config = vars(args).copy()
+    config['server_args'] = [arg for arg in args.server_args if arg != '--']
+    for key in ('output', 'json'):
+        config.pop(key)
+    report = run(config)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
@@ -0,0 +1,358 @@
+import functools
+import json
+import socket
+import struct
+import uuid
+import zlib
+
+# Kompaktes Binärformat: fester Header (Magic, Formatversion, Nachrichtentyp), danach typabhängige Felder.
+# Knoten werden als 16-Byte-UUID plus gepackte IPv4-Adresse und Port übertragen, Raumwechsel als Raumname plus UUID.
+# Felder, die das Format nicht kennt, werden als kompaktes JSON angehängt, damit das Protokoll erweiterbar bleibt.
+BINARY_MAGIC = 0xC5
+BINARY_VERSION = 1
+
+HEADER = struct.Struct('!BBB')
+NODE = struct.Struct('!B16s4sH')
+LENGTH = struct.Struct('!I')
+VERSION = struct.Struct('!Q')
+FLAG = struct.Struct('!B')
+NODE_ID = struct.Struct('!16s')
+
+# Nachrichtentypen
+TYPE_JSON = 0
+TYPE_CHAT = 1
+TYPE_FORWARD = 2
+TYPE_HEARTBEAT = 3
+TYPE_ELECTION = 4
+TYPE_SNAPSHOT = 5
+TYPE_BULLY = 6
+
+NODE_TYPES = ('server', 'client')
+NODE_KEYS = (('server_id', 'server_address'), ('client_id', 'client_address'))
+# Art 2: Client, der seine Nachrichten über die Sitzung erhält ('session': True)
+SESSION_KIND = 2
+MEMBERSHIP_OPS = ('join', 'leave', 'subscribe', 'unsubscribe')
+ROOM_OPS = ('subscribe', 'unsubscribe')
+# Nachrichten der Bully-Wahl (siehe election.py): Art, Term und Absender
+BULLY_ELECTION = 'bully'
+BULLY_TYPES = ('election', 'answer', 'coordinator', 'ack')
+
+HEARTBEAT_CONTENT = 'for heartbeat'
+SNAPSHOT_CONTENT = '#SnapshotResponse#'
+
+# Komprimierte Nutzlast: Magic, Version des Wörterbuchs, Deflate-Datenstrom ohne zlib-Header.
+# Kleinere Nutzlasten als COMPRESSION_THRESHOLD bleiben unkomprimiert, ebenso solche, die nicht kleiner werden.
+COMPRESSED_MAGIC = 0xC6
+COMPRESSION_HEADER = struct.Struct('!BB')
+COMPRESSION_THRESHOLD = 512
+COMPRESSION_LEVEL = 6
+# 4 KB Fenster reichen für das Wörterbuch; der kleinere Zustand ist schneller kopiert
+COMPRESSION_WBITS = 12
+DICTIONARY_VERSION = 2
+# Schutz vor Nutzlasten, die sich beim Entpacken vervielfachen
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+
+class JsonCodec:
+    name = 'json'
+
+    def encode(self, message):
+        return json.dumps(message).encode()
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class BinaryCodec:
+    name = 'binary'
+
+    def encode(self, message):
+        try:
+            return bytes(self.pack_message(message))
+        except (KeyError, TypeError, ValueError, OSError, struct.error):
+            # Nachrichten, die nicht ins Binärformat passen (z.B. IPv6, keine UUID), gehen als JSON
+            return HEADER.pack(BINARY_MAGIC, BINARY_VERSION, TYPE_JSON) + json.dumps(message).encode()
+
+    def decode(self, data):
+        message, _ = self.unpack_message(memoryview(data), 0)
+        return message
+
+    # Kodierung
+    def pack_message(self, message):
+        if 'mid' in message and 'isLeader' in message:
+            out = bytearray(HEADER.pack(BINARY_MAGIC, BINARY_VERSION, TYPE_ELECTION))
+            out += pack_node(message['mid'])
+            out += FLAG.pack(bool(message['isLeader']))
+            return pack_extras(out, message, ('mid', 'isLeader'))
+        if message.get('election') == BULLY_ELECTION:
+            out = bytearray(HEADER.pack(BINARY_MAGIC, BINARY_VERSION, TYPE_BULLY))
+            out += FLAG.pack(BULLY_TYPES.index(message['type'])) + VERSION.pack(message['term'])
+            out += pack_node(message['sender'])
+            return pack_extras(out, message, ('election', 'type', 'term', 'sender'))
+
+        node_type = NODE_TYPES.index(message['node_type'])
+        content = message['content']
+        if content == HEARTBEAT_CONTENT and 'deltas' in message:
+            out = bytearray(HEADER.pack(BINARY_MAGIC, BINARY_VERSION, TYPE_HEARTBEAT))
+            out += pack_node(message['sender'])
+            out += VERSION.pack(message['version']) + VERSION.pack(message['base_version'])
+            out += LENGTH.pack(len(message['deltas']))
+            for change_version, op, kind, node in message['deltas']:
+                out += VERSION.pack(change_version) + FLAG.pack(MEMBERSHIP_OPS.index(op))
+                out += pack_subscription(node) if op in ROOM_OPS else pack_node(node)
+            return pack_extras(out, message, ('node_type', 'sender', 'content', 'version', 'base_version', 'deltas'))
+        if content == SNAPSHOT_CONTENT:
+            out = bytearray(HEADER.pack(BINARY_MAGIC, BINARY_VERSION, TYPE_SNAPSHOT))
+            out += pack_node(message['sender']) + VERSION.pack(message['version'])
+            for node_list in (message['server_list'], message['client_list']):
+                out += LENGTH.pack(len(node_list))
+                for node in node_list:
+                    out += pack_node(node)
+            return pack_extras(out, message, ('node_type', 'sender', 'content', 'version', 'server_list', 'client_list'))
+        if isinstance(content, dict):
+            out = bytearray(HEADER.pack(BINARY_MAGIC, BINARY_VERSION, TYPE_FORWARD))
+            out += FLAG.pack(node_type) + pack_node(message['sender'])
+            inner = self.pack_message(content)
+            out += LENGTH.pack(len(inner)) + inner
+            return pack_extras(out, message, ('node_type', 'sender', 'content'))
+        if isinstance(content, str):
+            out = bytearray(HEADER.pack(BINARY_MAGIC, BINARY_VERSION, TYPE_CHAT))
+            out += FLAG.pack(node_type) + pack_node(message['sender'])
+            out += pack_string(content)
+            return pack_extras(out, message, ('node_type', 'sender', 'content'))
+        raise ValueError('Nachrichtentyp wird im Binärformat nicht unterstützt')
+
+    # Dekodierung
+    def unpack_message(self, view, offset):
+        magic, version, message_type = HEADER.unpack_from(view, offset)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError('Kein gültiges Binärformat')
+        offset += HEADER.size
+        if message_type == TYPE_JSON:
+            return json.loads(bytes(view[offset:]).decode()), len(view)
+        if message_type == TYPE_ELECTION:
+            mid, offset = unpack_node(view, offset)
+            (is_leader,) = FLAG.unpack_from(view, offset)
+            message = {'mid': mid, 'isLeader': bool(is_leader)}
+            return unpack_extras(view, offset + FLAG.size, message)
+        if message_type == TYPE_BULLY:
+            (bully_type,) = FLAG.unpack_from(view, offset)
+            (term,) = VERSION.unpack_from(view, offset + FLAG.size)
+            sender, offset = unpack_node(view, offset + FLAG.size + VERSION.size)
+            message = {'election': BULLY_ELECTION, 'type': BULLY_TYPES[bully_type], 'term': term, 'sender': sender}
+            return unpack_extras(view, offset, message)
+        if message_type == TYPE_HEARTBEAT:
+            sender, offset = unpack_node(view, offset)
+            (version,) = VERSION.unpack_from(view, offset)
+            (base_version,) = VERSION.unpack_from(view, offset + VERSION.size)
+            (count,) = LENGTH.unpack_from(view, offset + 2 * VERSION.size)
+            offset += 2 * VERSION.size + LENGTH.size
+            deltas = []
+            for _ in range(count):
+                (change_version,) = VERSION.unpack_from(view, offset)
+                (op,) = FLAG.unpack_from(view, offset + VERSION.size)
+                op = MEMBERSHIP_OPS[op]
+                if op in ROOM_OPS:
+                    node, offset = unpack_subscription(view, offset + VERSION.size + FLAG.size)
+                    deltas.append([change_version, op, 'room', node])
+                else:
+                    node, offset = unpack_node(view, offset + VERSION.size + FLAG.size)
+                    deltas.append([change_version, op, NODE_TYPES[node_kind(node)], node])
+            message = {'node_type': 'server', 'sender': sender, 'content': HEARTBEAT_CONTENT,
+                       'version': version, 'base_version': base_version, 'deltas': deltas}
+            return unpack_extras(view, offset, message)
+        if message_type == TYPE_SNAPSHOT:
+            sender, offset = unpack_node(view, offset)
+            (version,) = VERSION.unpack_from(view, offset)
+            offset += VERSION.size
+            node_lists = []
+            for _ in range(2):
+                (count,) = LENGTH.unpack_from(view, offset)
+                offset += LENGTH.size
+                nodes = []
+                for _ in range(count):
+                    node, offset = unpack_node(view, offset)
+                    nodes.append(node)
+                node_lists.append(nodes)
+            message = {'node_type': 'server', 'sender': sender, 'content': SNAPSHOT_CONTENT,
+                       'version': version, 'server_list': node_lists[0], 'client_list': node_lists[1]}
+            return unpack_extras(view, offset, message)
+        if message_type in (TYPE_CHAT, TYPE_FORWARD):
+            (node_type,) = FLAG.unpack_from(view, offset)
+            sender, offset = unpack_node(view, offset + FLAG.size)
+            if message_type == TYPE_CHAT:
+                content, offset = unpack_string(view, offset)
+            else:
+                (length,) = LENGTH.unpack_from(view, offset)
+                offset += LENGTH.size
+                content, _ = self.unpack_message(view[offset:offset + length], 0)
+                offset += length
+            message = {'node_type': NODE_TYPES[node_type], 'sender': sender, 'content': content}
+            return unpack_extras(view, offset, message)
+        raise ValueError(f'Unbekannter Nachrichtentyp {message_type}')
+
+
+# Hilfsfunktionen für das Binärformat
+def pack_node(node):
+    for kind, (id_key, address_key) in enumerate(NODE_KEYS):
+        if id_key in node:
+            fields = 2
+            if kind == 1 and node.get('session') is True:
+                kind, fields = SESSION_KIND, 3
+            if len(node) != fields:
+                raise ValueError('Knoten mit zusätzlichen Feldern')
+            ip, port = node[address_key]
+            return pack_node_fields(kind, node[id_key], ip, port)
+    raise ValueError('Unbekannter Knotentyp')
+
+# Dieselben Knoten (Absender, Mitglieder) kommen ständig wieder vor, das Umwandeln der UUID ist teuer
+@functools.lru_cache(maxsize=4096)
+def pack_node_fields(kind, node_id, ip, port):
+    return NODE.pack(kind, uuid.UUID(node_id).bytes, socket.inet_pton(socket.AF_INET, ip), port)
+
+def unpack_node(view, offset):
+    kind, node_id, address, port = unpack_node_fields(bytes(view[offset:offset + NODE.size]))
+    if kind == SESSION_KIND:
+        id_key, address_key = NODE_KEYS[1]
+        return {id_key: node_id, address_key: [address, port], 'session': True}, offset + NODE.size
+    id_key, address_key = NODE_KEYS[kind]
+    return {id_key: node_id, address_key: [address, port]}, offset + NODE.size
+
+@functools.lru_cache(maxsize=4096)
+def unpack_node_fields(data):
+    kind, node_id, ip, port = NODE.unpack(data)
+    return kind, str(uuid.UUID(bytes=node_id)), socket.inet_ntoa(ip), port
+
+def node_kind(node):
+    return 0 if 'server_id' in node else 1
+
+def pack_subscription(subscription):
+    room, client_id = subscription
+    return pack_string(room) + NODE_ID.pack(uuid.UUID(client_id).bytes)
+
+def unpack_subscription(view, offset):
+    room, offset = unpack_string(view, offset)
+    (client_id,) = NODE_ID.unpack_from(view, offset)
+    return [room, str(uuid.UUID(bytes=client_id))], offset + NODE_ID.size
+
+def pack_string(text):
+    data = text.encode()
+    return LENGTH.pack(len(data)) + data
+
+def unpack_string(view, offset):
+    (length,) = LENGTH.unpack_from(view, offset)
+    start = offset + LENGTH.size
+    return bytes(view[start:start + length]).decode(), start + length
+
+def pack_extras(out, message, known_keys):
+    extras = {key: value for key, value in message.items() if key not in known_keys}
+    if extras:
+        out += pack_string(json.dumps(extras, separators=(',', ':')))
+    else:
+        out += LENGTH.pack(0)
+    return out
+
+def unpack_extras(view, offset, message):
+    text, offset = unpack_string(view, offset)
+    if text:
+        message.update(json.loads(text))
+    return message, offset
+
+
+# Voreingestelltes Wörterbuch aus typischen Nachrichten des Protokolls, damit schon eine einzelne Nachricht von den
+# immer gleichen Schlüsseln profitiert. Die häufigsten Formen stehen am Ende (kürzeste Distanzen).
+# Alle Knoten müssen dasselbe Wörterbuch verwenden; jede Änderung erhöht DICTIONARY_VERSION.
+def build_dictionary():
+    server = {'server_id': '8c2d6619-6b05-4567-aca9-9ddd4ee76876', 'server_address': ['192.168.178.20', 40000]}
+    client = {'client_id': 'df147dc4-f2b0-4df7-84c8-967f46d4377c', 'client_address': ['192.168.178.21', 50000]}
+    session = client | {'session': True}
+    chat = {'node_type': 'client', 'sender': session, 'content': 'Hallo', 'client_seq': 1, 'room': 'lobby'}
+    samples = [
+        {'mid': server, 'isLeader': False},
+        {'node_type': 'server', 'sender': server, 'content': SNAPSHOT_CONTENT, 'version': 1,
+         'server_list': [server, server], 'client_list': [client, session], 'rooms': {'lobby': [client['client_id']]}},
+        {'node_type': 'client', 'sender': session, 'content': '#Joining#', 'codecs': ['binary', 'json'], 'session': True,
+         'rooms': ['lobby'], 'last_seq': 0},
+        {'node_type': 'server', 'sender': server, 'content': HEARTBEAT_CONTENT, 'version': 2, 'base_version': 1,
+         'deltas': [[1, 'join', 'client', session], [2, 'leave', 'client', client], [3, 'subscribe', 'room', ['lobby', client['client_id']]],
+                    [4, 'join', 'server', server]], 'seq': 1, 'load': 0.0},
+        {'node_type': 'server', 'sender': server, 'content': '#Backpressure#', 'retry_after': 0.1, 'client_seq': 1},
+        chat,
+        {'node_type': 'server', 'sender': server, 'content': chat, 'seq': 1},
+    ]
+    return ''.join(json.dumps(sample) for sample in samples).encode()
+
+PRESET_DICTIONARY = build_dictionary()
+
+# Vorbereiteter Kompressor pro Stufe; das Wörterbuch einmal zu laden ist teurer als den Zustand zu kopieren
+@functools.lru_cache(maxsize=None)
+def base_compressor(level):
+    return zlib.compressobj(level, zlib.DEFLATED, -COMPRESSION_WBITS, zdict=PRESET_DICTIONARY)
+
+def compress_payload(payload, threshold=COMPRESSION_THRESHOLD, level=COMPRESSION_LEVEL):
+    if len(payload) < threshold:
+        return payload
+    compressor = base_compressor(level).copy()
+    data = compressor.compress(payload) + compressor.flush()
+    if COMPRESSION_HEADER.size + len(data) >= len(payload):
+        return payload
+    return COMPRESSION_HEADER.pack(COMPRESSED_MAGIC, DICTIONARY_VERSION) + data
+
+def decompress_payload(data):
+    magic, version = COMPRESSION_HEADER.unpack_from(data)
+    if version != DICTIONARY_VERSION:
+        raise ValueError(f'Unbekannte Version des Wörterbuchs: {version}')
+    decompressor = zlib.decompressobj(-COMPRESSION_WBITS, zdict=PRESET_DICTIONARY)
+    try:
+        payload = decompressor.decompress(memoryview(data)[COMPRESSION_HEADER.size:], MAX_DECOMPRESSED_SIZE)
+    except zlib.error as e:
+        raise ValueError(f'Beschädigte komprimierte Nutzlast: {e}')
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError('Komprimierte Nutzlast unvollständig oder zu groß')
+    return payload
+
+
+# Komprimiert die Ausgabe eines anderen Codecs ab threshold Bytes. Wird wie ein eigener Codec ausgehandelt
+# ('binary+zlib'), sodass nur Clients komprimierte Nachrichten erhalten, die sie angeboten haben.
+class CompressedCodec:
+    def __init__(self, codec, threshold=COMPRESSION_THRESHOLD, level=COMPRESSION_LEVEL):
+        self.codec = codec
+        self.name = f'{codec.name}+zlib'
+        self.threshold = threshold
+        self.level = level
+
+    def encode(self, message):
+        return compress_payload(self.codec.encode(message), self.threshold, self.level)
+
+    def decode(self, data):
+        return decode_auto(data)
+
+
+# Verfügbare Codecs in der Reihenfolge der Präferenz
+CODECS = {'binary': BinaryCodec(), 'json': JsonCodec()}
+CODECS.update({f'{name}+zlib': CompressedCodec(codec) for name, codec in list(CODECS.items())})
+
+def get_codec(name):
+    return CODECS[name]
+
+# Schwelle und Stufe aller komprimierenden Codecs, z.B. aus der Kommandozeile
+def configure_compression(threshold=COMPRESSION_THRESHOLD, level=COMPRESSION_LEVEL):
+    for codec in CODECS.values():
+        if isinstance(codec, CompressedCodec):
+            codec.threshold = threshold
+            codec.level = level
+
+# Wählt beim Beitritt den ersten Codec aus der Liste der Gegenseite, den wir ebenfalls beherrschen
+def negotiate_codec(offered):
+    for name in offered or ():
+        if name in CODECS:
+            return name
+    return 'json'
+
+# Erkennt das Format am ersten Byte, JSON bleibt damit jederzeit (z.B. zum Debuggen) lesbar
+def decode_auto(data):
+    if data and data[0] == COMPRESSED_MAGIC:
+        data = decompress_payload(data)
+    if data and data[0] == BINARY_MAGIC:
+        return CODECS['binary'].decode(data)
+    return CODECS['json'].decode(data)
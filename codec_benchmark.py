@@ -0,0 +1,103 @@
+import argparse
+import json
+import random
+import time
+import uuid
+
+from codec import CODECS, COMPRESSION_THRESHOLD, configure_compression
+
+# Mikro-Benchmark für die Codecs: Durchsatz beim Kodieren/Dekodieren und Bytes auf der Leitung.
+# Die komprimierenden Codecs ('+zlib') zeigen, wie viel CPU die eingesparten Bytes kosten.
+
+WORDS = ('Hallo', 'zusammen', 'wie', 'läuft', 'es', 'heute', 'mit', 'dem', 'Server', 'Cluster', 'Nachricht',
+         'Raum', 'Führer', 'Wahl', 'und', 'der', 'die', 'das', 'ist', 'noch', 'nicht', 'schon', 'gleich')
+
+
+def make_server(i):
+    return {'server_id': str(uuid.uuid4()), 'server_address': [f'192.168.178.{i % 250 + 2}', 40000 + i]}
+
+def make_client(i):
+    return {'client_id': str(uuid.uuid4()), 'client_address': [f'192.168.178.{i % 250 + 2}', 50000 + i]}
+
+def make_text(size):
+    generator = random.Random(size)
+    words = []
+    while sum(len(word) + 1 for word in words) < size:
+        words.append(generator.choice(WORDS))
+    return ' '.join(words)
+
+def chat_messages():
+    server = make_server(0)
+    client = make_client(0)
+    chat = {'node_type': 'client', 'sender': client, 'content': 'Hallo zusammen, wie läuft es?'}
+    messages = {
+        'chat': chat,
+        'chat (weitergeleitet)': {'node_type': 'server', 'sender': server, 'content': chat},
+        'election (ring)': {'mid': server, 'isLeader': False},
+        'election (bully)': {'election': 'bully', 'type': 'coordinator', 'term': 3, 'sender': server},
+    }
+    for size in (1024, 16 * 1024):
+        messages[f'chat ({size // 1024} KB)'] = {'node_type': 'server', 'sender': server, 'seq': 1,
+                                                 'content': {'node_type': 'client', 'sender': client, 'content': make_text(size)}}
+    return messages
+
+def membership_messages(members):
+    server = make_server(0)
+    clients = [make_client(i) | {'session': True} for i in range(members)]
+    deltas = [[i + 1, 'join', 'client', client] for i, client in enumerate(clients)]
+    return {
+        f'heartbeat ({members} Deltas)': {'node_type': 'server', 'sender': server, 'content': 'for heartbeat',
+                                          'version': members, 'base_version': 0, 'deltas': deltas},
+        f'snapshot ({members} Clients)': {'node_type': 'server', 'sender': server, 'content': '#SnapshotResponse#', 'version': members,
+                                          'server_list': [make_server(i) for i in range(3)], 'client_list': clients},
+    }
+
+def measure(function, argument, duration):
+    count = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            function(argument)
+        count += 100
+    return count / (time.perf_counter() - start)
+
+def run(member_counts, duration):
+    messages = chat_messages()
+    for members in member_counts:
+        messages.update(membership_messages(members))
+    results = []
+    for message_name, message in messages.items():
+        for codec_name, codec in CODECS.items():
+            data = codec.encode(message)
+            # Verhältnis zur unkomprimierten Kodierung desselben Formats
+            plain = len(CODECS[codec_name.split('+')[0]].encode(message))
+            results.append({
+                'message': message_name,
+                'codec': codec_name,
+                'bytes': len(data),
+                'ratio': len(data) / plain,
+                'encode_per_s': measure(codec.encode, message, duration),
+                'decode_per_s': measure(codec.decode, data, duration),
+            })
+    return results
+
+def print_table(results):
+    print(f'{"Nachricht":<26} {"Codec":<12} {"Bytes":>8} {"Anteil":>7} {"Kodieren/s":>12} {"Dekodieren/s":>13}')
+    for result in results:
+        print(f'{result["message"]:<26} {result["codec"]:<12} {result["bytes"]:>8} {result["ratio"]:>7.2f} '
+              f'{result["encode_per_s"]:>12.0f} {result["decode_per_s"]:>13.0f}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--members', type=int, nargs='+', default=[20, 200, 2000], help='Mitgliedschaftsgrößen für Heartbeat und Snapshot')
+    parser.add_argument('--threshold', type=int, default=COMPRESSION_THRESHOLD, help='Komprimierende Codecs packen erst ab so vielen Bytes')
+    parser.add_argument('--duration', type=float, default=0.5, help='Messdauer je Fall in Sekunden')
+    parser.add_argument('--json', action='store_true', help='Ergebnisse maschinenlesbar ausgeben')
+    args = parser.parse_args()
+    configure_compression(args.threshold)
+    results = run(args.members, args.duration)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
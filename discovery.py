@@ -0,0 +1,115 @@
+import json
+import os
+import socket
+import tempfile
+import time
+
+from log import logger
+from transport import MAX_DATAGRAM_SIZE
+
+# Multicast-Gruppe der Servererkennung (None = nur Broadcast). Die Server treten ihr auf dem Erkennungsport bei;
+# Anfragen gehen an die Gruppe und zusätzlich an die Broadcast-Adresse, falls das Netz Multicast nicht weiterleitet.
+MULTICAST_GROUP = '239.255.42.99'
+MULTICAST_TTL = 1
+# Wartezeit auf die Antwort der zuletzt bekannten Server, die vor Gruppe und Broadcast direkt angefragt werden
+PROBE_TIMEOUT = 0.05
+# Verzeichnis für den zuletzt bekannten Führer und die übrigen Server (None = nur im Speicher)
+CACHE_DIR = tempfile.gettempdir()
+
+
+def detect_local_ip():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(('10.255.255.255', 1))
+        IP = s.getsockname()[0]
+    except Exception:
+        IP = '127.0.0.1'
+    finally:
+        s.close()
+    return IP
+
+# Ein Cluster wird über seinen Erkennungsport unterschieden, daher eine Datei pro Rolle und Port
+def cache_path(directory, role, port):
+    return os.path.join(directory, f'chat_discovery_{role}_{port}.json') if directory else None
+
+def enable_multicast(sock, interface_ip, ttl=MULTICAST_TTL):
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface_ip))
+    except OSError:
+        logger.warning('Multicast auf %s nicht verfügbar', interface_ip)
+
+def join_multicast_group(sock, group, interface_ip):
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(group) + socket.inet_aton(interface_ip))
+    except OSError:
+        logger.warning('Kann der Multicast-Gruppe %s auf %s nicht beitreten, nur Broadcast', group, interface_ip)
+        return False
+    return True
+
+# Sendet die Anfrage an alle Ziele und liefert die erste Antwort mit response_id, die accept() annimmt,
+# oder None nach timeout Sekunden
+def request_discovery(sock, message, targets, timeout, response_id, accept=None):
+    for target in targets:
+        try:
+            sock.sendto(message, tuple(target))
+        except OSError:
+            # z.B. keine Route für die Multicast-Gruppe
+            pass
+    deadline = time.monotonic() + timeout
+    while (remaining := deadline - time.monotonic()) > 0:
+        sock.settimeout(remaining)
+        try:
+            data, _ = sock.recvfrom(MAX_DATAGRAM_SIZE)
+        except TimeoutError:
+            return None
+        try:
+            response = json.loads(data)
+        except ValueError:
+            continue
+        if response.get('response_id') == response_id and (accept is None or accept(response)):
+            return response
+    return None
+
+
+# Zuletzt bekannter Führer und Server, auf der Platte gesichert, damit ein Neustart sie direkt anfragen kann,
+# statt auf Antworten über Multicast oder Broadcast zu warten
+class DiscoveryCache:
+    def __init__(self, path=None):
+        self.path = path
+        self.leader = None
+        self.peers = []
+        if path is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            self.leader = tuple(state['leader']) if state.get('leader') else None
+            self.peers = [tuple(peer) for peer in state.get('peers', [])]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    # Ziele für die direkte Anfrage, der Führer zuerst
+    def addresses(self, exclude=None):
+        candidates = ([self.leader] if self.leader else []) + self.peers
+        return [address for address in dict.fromkeys(candidates) if address != exclude]
+
+    def remember(self, leader, peers):
+        leader = tuple(leader) if leader else None
+        peers = sorted(tuple(peer) for peer in peers)
+        if leader == self.leader and peers == self.peers:
+            return
+        self.leader = leader
+        self.peers = peers
+        if self.path is None:
+            return
+        # Mehrere Prozesse können dieselbe Datei schreiben, deshalb erst vollständig schreiben und dann ersetzen
+        temporary_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(temporary_path, 'w') as f:
+                json.dump({'leader': leader, 'peers': peers}, f)
+            os.replace(temporary_path, self.path)
+        except OSError:
+            logger.warning('Kann %s nicht schreiben', self.path)
@@ -0,0 +1,198 @@
+import threading
+import time
+
+from log import logger
+
+# Zeitgrenzen der Bully-Wahl in Sekunden
+RETRANSMIT_INTERVAL = 0.05
+MAX_RETRANSMITS = 3
+ANSWER_TIMEOUT = 0.25
+COORDINATOR_TIMEOUT = 0.5
+
+
+# Ringwahl nach LeLann-Chang-Roberts: ein Token umrundet den Ring, danach eine zweite Runde für die Ankündigung.
+# Benötigt O(n) Schritte und hängt, wenn ein Datagramm verloren geht.
+class RingElection:
+    name = 'ring'
+
+    def __init__(self, node_info, registry, send, on_leader, address_of):
+        self.node_info = node_info
+        self.node_id = node_info['server_id']
+        self.registry = registry
+        self.send = send
+        self.on_leader = on_leader
+        self.address_of = address_of
+        self.is_participant = False
+        self.lock = threading.Lock()
+
+    def neighbour_address(self):
+        return self.address_of(self.registry.neighbour(self.node_id, 'left'))
+
+    def start(self):
+        with self.lock:
+            election_message = {"mid": self.node_info, "isLeader": False}
+            self.send(election_message, self.neighbour_address())
+            self.is_participant = True
+        logger.info('%s ist der Führer', self.node_info)
+
+    def handle(self, election_message):
+        if 'mid' not in election_message:
+            return
+        with self.lock:
+            neighbour = self.neighbour_address()
+            mid = election_message['mid'].get('server_id')
+
+            if mid > self.node_id:
+                self.send(election_message, neighbour)
+            elif mid == self.node_id and self.is_participant:
+                new_election_message = {"mid": self.node_info, "isLeader": True}
+                self.send(new_election_message, neighbour)
+            elif mid < self.node_id and not self.is_participant:
+                new_election_message = {"mid": self.node_info, "isLeader": False}
+                self.send(new_election_message, neighbour)
+            self.is_participant = True
+
+            if election_message['isLeader']:
+                if mid != self.node_id:
+                    self.send(election_message, neighbour)
+                self.is_participant = False
+                leader = election_message['mid']
+            else:
+                leader = None
+        if leader is not None:
+            self.on_leader(leader)
+
+    def tick(self, now=None):
+        pass
+
+
+# Bully-Wahl mit Wahlperioden (Terms): der Knoten mit der höchsten ID gewinnt nach einer Runde,
+# unabhängig von der Größe des Clusters. Verlorene Datagramme werden wiederholt, Nachrichten aus
+# veralteten Terms werden ignoriert, sodass sich gleichzeitig gestartete Wahlen nicht stören.
+class BullyElection:
+    name = 'bully'
+
+    def __init__(self, node_info, registry, send, on_leader, address_of):
+        self.node_info = node_info
+        self.node_id = node_info['server_id']
+        self.registry = registry
+        self.send = send
+        self.on_leader = on_leader
+        self.address_of = address_of
+        self.term = 0
+        # 'idle', 'electing' (wartet auf Antworten höherer Knoten) oder 'waiting' (wartet auf den Koordinator)
+        self.state = 'idle'
+        self.deadline = None
+        # Unbestätigte Nachrichten: (Typ, Ziel-ID) -> [Nachricht, Adresse, nächster Versand, verbleibende Wiederholungen]
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def message(self, message_type):
+        return {'election': self.name, 'type': message_type, 'term': self.term, 'sender': self.node_info}
+
+    def send_reliable(self, message_type, target, now):
+        message = self.message(message_type)
+        address = self.address_of(target)
+        self.pending[(message_type, target['server_id'])] = [message, address, now + RETRANSMIT_INTERVAL, MAX_RETRANSMITS]
+        self.send(message, address)
+
+    def start(self):
+        with self.lock:
+            self.term += 1
+            leader = self.begin(time.monotonic())
+        if leader is not None:
+            self.on_leader(leader)
+
+    # Fragt alle Knoten mit höherer ID an; gibt den eigenen Knoten zurück, falls es keinen gibt
+    def begin(self, now):
+        self.pending = {key: entry for key, entry in self.pending.items() if key[0] != 'election'}
+        higher = [server for server in self.registry.server_list() if server['server_id'] > self.node_id]
+        if not higher:
+            return self.become_leader(now)
+        self.state = 'electing'
+        self.deadline = now + ANSWER_TIMEOUT
+        for server in higher:
+            self.send_reliable('election', server, now)
+        return None
+
+    def become_leader(self, now):
+        self.state = 'idle'
+        self.deadline = None
+        self.pending.clear()
+        for server in self.registry.server_list():
+            if server['server_id'] != self.node_id:
+                self.send_reliable('coordinator', server, now)
+        return self.node_info
+
+    def handle(self, message):
+        if message.get('election') != self.name:
+            return
+        now = time.monotonic()
+        message_type = message['type']
+        sender = message['sender']
+        term = message['term']
+        leader = None
+        with self.lock:
+            if message_type == 'election':
+                # Ein niedrigerer Knoten wählt: antworten und die Wahl selbst weiterführen
+                self.send(self.message('answer') | {'term': max(term, self.term)}, self.address_of(sender))
+                if term > self.term or self.state == 'idle':
+                    self.term = max(term, self.term)
+                    leader = self.begin(now)
+            elif message_type == 'answer':
+                self.pending.pop(('election', sender['server_id']), None)
+                if term >= self.term and self.state == 'electing':
+                    self.term = term
+                    self.state = 'waiting'
+                    self.deadline = now + COORDINATOR_TIMEOUT
+            elif message_type == 'coordinator':
+                self.send(self.message('ack') | {'term': term}, self.address_of(sender))
+                if term < self.term:
+                    pass
+                elif sender['server_id'] < self.node_id:
+                    # Ein niedrigerer Knoten hat sich zum Führer erklärt, während wir erreichbar sind
+                    self.term = term + 1
+                    leader = self.begin(now)
+                else:
+                    self.term = term
+                    self.state = 'idle'
+                    self.deadline = None
+                    self.pending = {key: entry for key, entry in self.pending.items() if key[0] != 'election'}
+                    leader = sender
+            elif message_type == 'ack':
+                if term == self.term:
+                    self.pending.pop(('coordinator', sender['server_id']), None)
+        if leader is not None:
+            self.on_leader(leader)
+
+    # Wird regelmäßig aufgerufen: Wiederholungen senden und abgelaufene Wartezeiten behandeln
+    def tick(self, now=None):
+        now = time.monotonic() if now is None else now
+        leader = None
+        with self.lock:
+            for key, entry in list(self.pending.items()):
+                message, address, next_send, retries = entry
+                if next_send > now:
+                    continue
+                if retries == 0:
+                    del self.pending[key]
+                    continue
+                entry[2] = now + RETRANSMIT_INTERVAL
+                entry[3] = retries - 1
+                self.send(message, address)
+            if self.deadline is not None and now >= self.deadline:
+                if self.state == 'electing':
+                    # Kein höherer Knoten hat geantwortet
+                    leader = self.become_leader(now)
+                elif self.state == 'waiting':
+                    # Der höhere Knoten hat sich nicht als Koordinator gemeldet, neue Wahl
+                    self.term += 1
+                    leader = self.begin(now)
+        if leader is not None:
+            self.on_leader(leader)
+
+
+ELECTION_ALGORITHMS = {'ring': RingElection, 'bully': BullyElection}
+
+def create_election(algorithm, node_info, registry, send, on_leader, address_of):
+    return ELECTION_ALGORITHMS[algorithm](node_info, registry, send, on_leader, address_of)
@@ -0,0 +1,129 @@
+import argparse
+import json
+import random
+import selectors
+import socket
+import statistics
+import time
+import uuid
+
+from codec import decode_auto, get_codec
+from election import ELECTION_ALGORITHMS, create_election
+from membership import MembershipRegistry
+
+# Simulation über Loopback: misst die Wahldauer nach dem Ausfall des Führers in Abhängigkeit von
+# Clustergröße und Paketverlust. Jeder simulierte Server hat einen eigenen UDP-Socket.
+
+SELECT_TIMEOUT = 0.01
+
+
+class SimulatedServer:
+    def __init__(self, sock):
+        self.sock = sock
+        self.info = {'server_id': str(uuid.uuid4()), 'server_address': list(sock.getsockname())}
+        self.registry = MembershipRegistry()
+        self.leader = None
+        self.engine = None
+
+    def set_leader(self, leader):
+        self.leader = leader['server_id']
+
+
+def run_election(algorithm, size, loss, starters, deadline, rng, codec):
+    sockets = []
+    for _ in range(size + 1):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.bind(('127.0.0.1', 0))
+        s.setblocking(False)
+        sockets.append(s)
+    servers = [SimulatedServer(s) for s in sockets]
+    # Der Server mit der höchsten ID war Führer und ist ausgefallen
+    servers.sort(key=lambda server: server.info['server_id'])
+    crashed = servers.pop()
+    crashed.sock.close()
+    expected = servers[-1].info['server_id']
+
+    for server in servers:
+        for other in servers:
+            server.registry.join('server', other.info)
+
+        def send(message, address, server=server):
+            if rng.random() >= loss:
+                server.sock.sendto(codec.encode(message), address)
+
+        server.engine = create_election(algorithm, server.info, server.registry, send, server.set_leader,
+                                        lambda info: tuple(info['server_address']))
+
+    selector = selectors.DefaultSelector()
+    for server in servers:
+        selector.register(server.sock, selectors.EVENT_READ, server)
+
+    start = time.perf_counter()
+    # Mehrere Follower bemerken den Ausfall gleichzeitig und starten jeweils eine Wahl
+    for server in rng.sample(servers, min(starters, len(servers))):
+        server.engine.start()
+    elapsed = None
+    while time.perf_counter() - start < deadline:
+        for key, _ in selector.select(SELECT_TIMEOUT):
+            server = key.data
+            try:
+                data, _ = server.sock.recvfrom(65507)
+            except BlockingIOError:
+                continue
+            server.engine.handle(decode_auto(data))
+        for server in servers:
+            server.engine.tick()
+        if all(server.leader == expected for server in servers):
+            elapsed = time.perf_counter() - start
+            break
+
+    selector.close()
+    for server in servers:
+        server.sock.close()
+    return elapsed
+
+def run(algorithms, sizes, losses, runs, starters, deadline, seed, codec_name):
+    rng = random.Random(seed)
+    codec = get_codec(codec_name)
+    results = []
+    for algorithm in algorithms:
+        for size in sizes:
+            for loss in losses:
+                times = [run_election(algorithm, size, loss, starters, deadline, rng, codec) for _ in range(runs)]
+                finished = [t for t in times if t is not None]
+                results.append({
+                    'algorithm': algorithm,
+                    'servers': size,
+                    'loss': loss,
+                    'runs': runs,
+                    'hung': runs - len(finished),
+                    'median_ms': statistics.median(finished) * 1000 if finished else None,
+                    'max_ms': max(finished) * 1000 if finished else None,
+                })
+    return results
+
+def print_table(results):
+    print(f'{"Verfahren":<8} {"Server":>6} {"Verlust":>8} {"hängt":>6} {"Median ms":>10} {"Max ms":>10}')
+    for result in results:
+        median = f'{result["median_ms"]:.1f}' if result['median_ms'] is not None else '-'
+        maximum = f'{result["max_ms"]:.1f}' if result['max_ms'] is not None else '-'
+        print(f'{result["algorithm"]:<8} {result["servers"]:>6} {result["loss"]:>8.2f} '
+              f'{result["hung"]:>3}/{result["runs"]:<2} {median:>10} {maximum:>10}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--algorithms', nargs='+', choices=list(ELECTION_ALGORITHMS), default=list(ELECTION_ALGORITHMS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[3, 5, 9, 17, 33])
+    parser.add_argument('--losses', nargs='+', type=float, default=[0.0, 0.05, 0.2])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--starters', type=int, default=1, help='Anzahl der Server, die gleichzeitig eine Wahl starten')
+    parser.add_argument('--deadline', type=float, default=3.0, help='Wahl gilt nach dieser Zeit in Sekunden als hängend')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--codec', default='binary')
+    parser.add_argument('--json', action='store_true', help='Ergebnisse maschinenlesbar ausgeben')
+    args = parser.parse_args()
+    results = run(args.algorithms, args.sizes, args.losses, args.runs, args.starters, args.deadline, args.seed, args.codec)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
@@ -0,0 +1,67 @@
+import collections
+import math
+import time
+
+# Anzahl der Heartbeat-Abstände, aus denen Mittelwert und Streuung geschätzt werden
+FAILURE_DETECTOR_WINDOW = 100
+PHI_THRESHOLD = 8.0
+
+
+# Phi-Accrual-Fehlerdetektor (Hayashibara et al.): statt einer festen Anzahl verpasster Heartbeats
+# wird aus der Verteilung der bisherigen Abstände berechnet, wie unwahrscheinlich die aktuelle Pause ist.
+# phi = 8 bedeutet, dass die Pause mit Wahrscheinlichkeit 1e-8 noch normal wäre.
+class PhiAccrualDetector:
+    def __init__(self, expected_interval, window=FAILURE_DETECTOR_WINDOW, min_std=None, acceptable_pause=0.0):
+        self.window = window
+        self.min_std = min_std if min_std is not None else expected_interval / 2
+        self.acceptable_pause = acceptable_pause
+        self.intervals = collections.deque()
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.last_heartbeat = None
+        # Start mit zwei geschätzten Abständen, damit phi schon nach dem ersten Heartbeat definiert ist
+        deviation = expected_interval / 4
+        self.add_interval(expected_interval - deviation)
+        self.add_interval(expected_interval + deviation)
+
+    def add_interval(self, interval):
+        if len(self.intervals) == self.window:
+            removed = self.intervals.popleft()
+            self.total -= removed
+            self.total_squares -= removed * removed
+        self.intervals.append(interval)
+        self.total += interval
+        self.total_squares += interval * interval
+
+    def heartbeat(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self.last_heartbeat is not None:
+            self.add_interval(now - self.last_heartbeat)
+        self.last_heartbeat = now
+
+    def has_heartbeat(self):
+        return self.last_heartbeat is not None
+
+    def mean(self):
+        return self.total / len(self.intervals)
+
+    def std(self):
+        mean = self.mean()
+        variance = max(self.total_squares / len(self.intervals) - mean * mean, 0.0)
+        return max(math.sqrt(variance), self.min_std)
+
+    def phi(self, now=None):
+        if self.last_heartbeat is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.last_heartbeat
+        mean = self.mean() + self.acceptable_pause
+        # Logistische Näherung der Normalverteilung, begrenzt gegen Überläufe
+        y = max(min((elapsed - mean) / self.std(), 8.0), -8.0)
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        if elapsed > mean:
+            return -math.log10(e / (1.0 + e))
+        return -math.log10(1.0 - 1.0 / (1.0 + e))
+
+    def is_available(self, threshold=PHI_THRESHOLD, now=None):
+        return self.phi(now) < threshold
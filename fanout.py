@@ -0,0 +1,277 @@
+import collections
+import queue
+import threading
+import time
+
+from log import logger
+from transport import encode_batch, encode_frame
+
+# Verhalten, wenn die Warteschlange eines Empfängers voll ist:
+# 'drop'       - neue Nachrichten für diesen Empfänger werden verworfen
+# 'disconnect' - der Empfänger wird sofort getrennt
+# 'buffer'     - es wird bis zu buffer_bytes weiter gepuffert, erst danach wird getrennt
+SLOW_CONSUMER_POLICIES = ('drop', 'disconnect', 'buffer')
+
+FANOUT_WORKERS = 16
+OUTBOUND_QUEUE_BYTES = 64 * 1024
+SLOW_CONSUMER_BUFFER_BYTES = 1024 * 1024
+
+# Nachrichten, die innerhalb von BATCH_DELAY Sekunden veröffentlicht werden (höchstens BATCH_MAX_MESSAGES),
+# erhält jeder Empfänger gesammelt in einem Frame. Ein längeres Fenster spart Schreibvorgänge und Header
+# bei hoher Last, verzögert aber jede Nachricht um bis zu BATCH_DELAY. 0 schaltet das Sammeln ab.
+BATCH_DELAY = 0.002
+BATCH_MAX_MESSAGES = 64
+
+
+# Ausgehende Nachrichten eines einzelnen Empfängers
+class OutboundQueue:
+    def __init__(self, address):
+        self.address = address
+        self.messages = collections.deque()
+        self.size = 0
+        self.scheduled = False
+        # Veröffentlichungszeitpunkt der ältesten wartenden Nachricht
+        self.since = None
+
+
+# Fasst die gesammelten Nachrichten pro Empfänger zusammen. Empfänger, die dieselbe Folge von Nachrichten
+# erhalten (der Normalfall beim Broadcast), teilen sich einen einzigen Puffer.
+def build_batches(pending):
+    indices_by_recipient = collections.defaultdict(list)
+    for index, (addresses, _) in enumerate(pending):
+        for address in addresses:
+            indices_by_recipient[address].append(index)
+    recipients = collections.defaultdict(list)
+    for address, indices in indices_by_recipient.items():
+        recipients[tuple(indices)].append(address)
+    return [(addresses, encode_batch([pending[index][1] for index in indices])) for indices, addresses in recipients.items()]
+
+
+# Verteilt Nachrichten über begrenzte Warteschlangen pro Empfänger an einen Pool von Schreib-Threads.
+# on_sent erhält nach jedem Schreibvorgang die Zeit seit der Veröffentlichung der ältesten enthaltenen Nachricht.
+class FanoutEngine:
+    def __init__(self, pool, policy='drop', workers=FANOUT_WORKERS, queue_bytes=OUTBOUND_QUEUE_BYTES,
+                 buffer_bytes=SLOW_CONSUMER_BUFFER_BYTES, on_failure=None,
+                 batch_delay=BATCH_DELAY, batch_messages=BATCH_MAX_MESSAGES, on_sent=None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f'Unbekannte Richtlinie für langsame Empfänger: {policy}')
+        self.pool = pool
+        self.policy = policy
+        self.queue_bytes = queue_bytes
+        self.buffer_bytes = buffer_bytes
+        self.on_failure = on_failure
+        self.on_sent = on_sent
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.ready = queue.SimpleQueue()
+        self.dropped = 0
+        # Wartende Bytes über alle Empfänger
+        self.queued = 0
+        self.batch_delay = batch_delay
+        self.batch_messages = batch_messages
+        self.batch = []
+        self.batch_started = None
+        self.batch_ready = threading.Condition()
+        for _ in range(workers):
+            threading.Thread(target=self.worker, daemon=True).start()
+        if self.batching():
+            threading.Thread(target=self.batch_flusher, daemon=True).start()
+
+    def limit(self):
+        return self.buffer_bytes if self.policy == 'buffer' else self.queue_bytes
+
+    def batching(self):
+        return self.batch_delay > 0 and self.batch_messages > 1
+
+    def publish(self, addresses, payload):
+        if not self.batching():
+            self.deliver(addresses, payload)
+            return
+        with self.batch_ready:
+            if not self.batch:
+                self.batch_started = time.monotonic()
+            self.batch.append(([tuple(address) for address in addresses], payload))
+            if len(self.batch) == 1 or len(self.batch) >= self.batch_messages:
+                self.batch_ready.notify()
+
+    # Rahmt die Nachricht einmal; alle Empfänger erhalten denselben Puffer
+    def deliver(self, addresses, payload, published=None):
+        frame = encode_frame(payload)
+        published = published or time.monotonic()
+        for address in addresses:
+            self.enqueue(tuple(address), frame, published)
+
+    def batch_flusher(self):
+        while True:
+            with self.batch_ready:
+                while not self.batch:
+                    self.batch_ready.wait()
+                deadline = time.monotonic() + self.batch_delay
+                while len(self.batch) < self.batch_messages:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.batch_ready.wait(remaining)
+                pending, self.batch = self.batch, []
+                published = self.batch_started
+            for addresses, payload in build_batches(pending):
+                self.deliver(addresses, payload, published)
+
+    def enqueue(self, address, frame, published=None):
+        with self.lock:
+            outbound = self.queues.get(address)
+            if outbound is None:
+                outbound = self.queues[address] = OutboundQueue(address)
+            if outbound.size + len(frame) > self.limit() and outbound.messages:
+                if self.policy == 'drop':
+                    self.dropped += 1
+                    return
+                overloaded = True
+            else:
+                overloaded = False
+                if not outbound.messages:
+                    outbound.since = published or time.monotonic()
+                outbound.messages.append(frame)
+                outbound.size += len(frame)
+                self.queued += len(frame)
+                if not outbound.scheduled:
+                    outbound.scheduled = True
+                    self.ready.put(outbound)
+        if overloaded:
+            logger.warning('Empfänger %s ist zu langsam und wird getrennt', address)
+            self.disconnect(address)
+
+    # Ein Empfänger wird immer nur von einem Worker gleichzeitig bedient, damit die Reihenfolge erhalten bleibt.
+    # Alle bis dahin aufgelaufenen Frames gehen mit einem Schreibvorgang hinaus.
+    def worker(self):
+        while True:
+            outbound = self.ready.get()
+            while True:
+                with self.lock:
+                    if not outbound.messages or self.queues.get(outbound.address) is not outbound:
+                        outbound.scheduled = False
+                        break
+                    frames = list(outbound.messages)
+                    since = outbound.since
+                    outbound.messages.clear()
+                    self.queued -= outbound.size
+                    outbound.size = 0
+                try:
+                    self.pool.send_frames(outbound.address, frames)
+                except OSError:
+                    logger.warning('Kann nicht an %s senden', outbound.address)
+                    self.disconnect(outbound.address)
+                    break
+                if self.on_sent is not None:
+                    self.on_sent(time.monotonic() - since)
+
+    def queue_depths(self):
+        with self.lock:
+            return {address: outbound.size for address, outbound in self.queues.items()}
+
+    def queued_bytes(self):
+        return self.queued
+
+    # Der Empfänger ist gegangen: seine Warteschlange wird verworfen, ohne die Verbindung anzufassen
+    def forget(self, address):
+        with self.lock:
+            outbound = self.queues.pop(tuple(address), None)
+            if outbound is not None:
+                self.queued -= outbound.size
+
+    def disconnect(self, address):
+        with self.lock:
+            outbound = self.queues.pop(address, None)
+            if outbound is not None:
+                self.queued -= outbound.size
+        if outbound is None:
+            return
+        self.pool.discard(address)
+        if self.on_failure is not None:
+            self.on_failure(address)
+
+
+# Variante für den asyncio-Modus: der Sendepuffer des Transports ist die Warteschlange des Empfängers.
+# on_sent misst hier bis zur Übergabe an den Transport.
+class AsyncFanoutEngine:
+    def __init__(self, pool, policy='drop', queue_bytes=OUTBOUND_QUEUE_BYTES,
+                 buffer_bytes=SLOW_CONSUMER_BUFFER_BYTES, on_failure=None,
+                 batch_delay=BATCH_DELAY, batch_messages=BATCH_MAX_MESSAGES, on_sent=None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f'Unbekannte Richtlinie für langsame Empfänger: {policy}')
+        self.pool = pool
+        self.policy = policy
+        self.queue_bytes = queue_bytes
+        self.buffer_bytes = buffer_bytes
+        self.on_failure = on_failure
+        self.on_sent = on_sent
+        self.dropped = 0
+        self.batch_delay = batch_delay
+        self.batch_messages = batch_messages
+        self.batch = []
+        self.batch_started = None
+        self.flush_handle = None
+
+    def limit(self):
+        return self.buffer_bytes if self.policy == 'buffer' else self.queue_bytes
+
+    def batching(self):
+        return self.batch_delay > 0 and self.batch_messages > 1
+
+    def publish(self, addresses, payload):
+        if not self.batching():
+            self.deliver(addresses, payload)
+            return
+        if threading.get_ident() != self.pool.thread_id:
+            self.pool.loop.call_soon_threadsafe(self.publish, addresses, payload)
+            return
+        if not self.batch:
+            self.batch_started = time.monotonic()
+        self.batch.append(([tuple(address) for address in addresses], payload))
+        if len(self.batch) >= self.batch_messages:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = self.pool.loop.call_later(self.batch_delay, self.flush)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        pending, self.batch = self.batch, []
+        for addresses, payload in build_batches(pending):
+            self.deliver(addresses, payload, self.batch_started)
+
+    def deliver(self, addresses, payload, published=None):
+        frame = encode_frame(payload)
+        for address in addresses:
+            self.enqueue(tuple(address), frame)
+        if self.on_sent is not None and addresses:
+            self.on_sent(time.monotonic() - (published or time.monotonic()))
+
+    def enqueue(self, address, frame):
+        buffered = self.pool.buffered_bytes(address)
+        if buffered and buffered + len(frame) > self.limit():
+            if self.policy == 'drop':
+                self.dropped += 1
+                return
+            logger.warning('Empfänger %s ist zu langsam und wird getrennt', address)
+            self.disconnect(address)
+            return
+        self.pool.send_frame(address, frame)
+
+    def queue_depths(self):
+        return {address: self.pool.buffered_bytes(address) for address in self.pool.connections}
+
+    def queued_bytes(self):
+        return sum(connection.buffered_bytes() for connection in list(self.pool.connections.values()))
+
+    # Die Warteschlange ist der Sendepuffer der Verbindung und verschwindet mit ihr
+    def forget(self, address):
+        pass
+
+    def disconnect(self, address):
+        if address not in self.pool.connections:
+            return
+        self.pool.discard(address)
+        if self.on_failure is not None:
+            self.on_failure(address)
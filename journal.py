@@ -0,0 +1,191 @@
+import heapq
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from log import logger
+
+# Segmente werden ab dieser Größe abgeschlossen, ältere als die letzten JOURNAL_MAX_SEGMENTS gelöscht
+JOURNAL_SEGMENT_BYTES = 8 * 1024 * 1024
+JOURNAL_MAX_SEGMENTS = 32
+# Gruppen-Commit: alle Einträge innerhalb dieses Fensters werden mit einem fsync gesichert.
+# Ein Absturz des Rechners kostet höchstens die Einträge des letzten Fensters; 0 = fsync nach jedem Eintrag.
+JOURNAL_SYNC_DELAY = 0.005
+
+# Länge der Nutzdaten, CRC32 über Typ, Index und Nutzdaten, Typ, Index (Sequenznummer)
+RECORD = struct.Struct('!IIBQ')
+RECORD_ENTRY = 0
+
+SEGMENT_SUFFIX = '.seg'
+
+
+def record_crc(record_type, index, payload):
+    return zlib.crc32(payload, zlib.crc32(struct.pack('!BQ', record_type, index)))
+
+# Liest die gültigen Einträge einer Segmentdatei über mmap: (Ende, Typ, Index, Nutzdaten).
+# Der Lauf endet am ersten unvollständigen oder beschädigten Eintrag.
+def scan_segment(path):
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as view:
+            offset = 0
+            while offset + RECORD.size <= size:
+                length, crc, record_type, index = RECORD.unpack_from(view, offset)
+                end = offset + RECORD.size + length
+                if end > size:
+                    return
+                payload = view[offset + RECORD.size:end]
+                if record_crc(record_type, index, payload) != crc:
+                    return
+                yield end, record_type, index, payload
+                offset = end
+
+
+# Eine Segmentdatei mit kleinstem und größtem Index ihrer Einträge, damit Leser Segmente überspringen können
+class Segment:
+    def __init__(self, path, number):
+        self.path = path
+        self.number = number
+        self.size = 0
+        self.min_index = None
+        self.max_index = None
+
+    def add(self, index):
+        self.min_index = index if self.min_index is None else min(self.min_index, index)
+        self.max_index = index if self.max_index is None else max(self.max_index, index)
+
+
+# Journal aus Segmentdateien, in die nur angehängt wird. Einträge tragen einen Index, müssen aber nicht
+# geordnet eintreffen (Follower füllen Lücken nachträglich).
+class Journal:
+    def __init__(self, directory, segment_bytes=JOURNAL_SEGMENT_BYTES, max_segments=JOURNAL_MAX_SEGMENTS,
+                 sync_delay=JOURNAL_SYNC_DELAY):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.sync_delay = sync_delay
+        self.segments = []
+        self.active = None
+        self.fd = None
+        self.lock = threading.Lock()
+        self.commit_ready = threading.Condition(self.lock)
+        self.unsynced = False
+        self.syncs = 0
+        self.bytes_written = 0
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+        if sync_delay > 0:
+            threading.Thread(target=self.committer, daemon=True).start()
+
+    # Bestehende Segmente einlesen; ein beim Absturz halb geschriebener Eintrag am Ende wird abgeschnitten
+    def load(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            segment = Segment(os.path.join(self.directory, name), int(name[:-len(SEGMENT_SUFFIX)]))
+            for end, record_type, index, _ in scan_segment(segment.path):
+                segment.size = end
+                if record_type == RECORD_ENTRY:
+                    segment.add(index)
+            if segment.size < os.path.getsize(segment.path):
+                logger.warning('Journal %s: unvollständiges Ende abgeschnitten', segment.path)
+                os.truncate(segment.path, segment.size)
+            self.segments.append(segment)
+
+    @property
+    def last_index(self):
+        with self.lock:
+            return max((segment.max_index for segment in self.segments if segment.max_index is not None), default=0)
+
+    def append(self, index, payload, record_type=RECORD_ENTRY):
+        with self.lock:
+            if self.active is None or self.active.size >= self.segment_bytes:
+                self.open_segment()
+            self.write(index, payload, record_type)
+            if self.sync_delay <= 0:
+                os.fsync(self.fd)
+                self.syncs += 1
+            elif not self.unsynced:
+                self.unsynced = True
+                self.commit_ready.notify()
+
+    # Muss unter self.lock aufgerufen werden
+    def write(self, index, payload, record_type):
+        payload = bytes(payload)
+        data = RECORD.pack(len(payload), record_crc(record_type, index, payload), record_type, index) + payload
+        os.write(self.fd, data)
+        self.active.size += len(data)
+        self.bytes_written += len(data)
+        if record_type == RECORD_ENTRY:
+            self.active.add(index)
+
+    # Muss unter self.lock aufgerufen werden
+    def open_segment(self):
+        self.close_segment()
+        number = self.segments[-1].number + 1 if self.segments else 1
+        segment = Segment(os.path.join(self.directory, f'{number:010d}{SEGMENT_SUFFIX}'), number)
+        self.fd = os.open(segment.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.active = segment
+        self.segments.append(segment)
+        while len(self.segments) > self.max_segments:
+            os.unlink(self.segments.pop(0).path)
+
+    # Muss unter self.lock aufgerufen werden
+    def close_segment(self):
+        if self.fd is not None:
+            os.fsync(self.fd)
+            os.close(self.fd)
+            self.fd = None
+            self.active = None
+            self.unsynced = False
+
+    # Sammelt Einträge für sync_delay und sichert sie dann gemeinsam. Das fsync läuft auf einer Kopie des
+    # Dateideskriptors außerhalb der Sperre, damit Schreiber währenddessen weiter anhängen können.
+    def committer(self):
+        while True:
+            with self.lock:
+                while not self.unsynced:
+                    self.commit_ready.wait()
+            time.sleep(self.sync_delay)
+            with self.lock:
+                fd = os.dup(self.fd) if self.fd is not None and self.unsynced else None
+                self.unsynced = False
+            if fd is not None:
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                self.syncs += 1
+
+    # Einträge mit Index > since in aufsteigender Reihenfolge, höchstens limit Stück. Die Segmente werden nach
+    # ihrem kleinsten Index gelesen; sobald limit Einträge vor dem Beginn des nächsten Segments liegen, endet der Lauf.
+    def read(self, since=0, limit=None):
+        with self.lock:
+            segments = sorted((segment for segment in self.segments if segment.max_index is not None and segment.max_index > since),
+                              key=lambda segment: segment.min_index)
+        entries = []
+        for position, segment in enumerate(segments):
+            try:
+                entries.extend((index, payload) for _, record_type, index, payload in scan_segment(segment.path)
+                               if record_type == RECORD_ENTRY and index > since)
+            except FileNotFoundError:
+                # Zwischenzeitlich wegen der Aufbewahrungsgrenze gelöscht
+                continue
+            if limit is not None and len(entries) >= limit:
+                entries = heapq.nsmallest(limit, entries, key=lambda entry: entry[0])
+                if position + 1 == len(segments) or entries[-1][0] < segments[position + 1].min_index:
+                    return entries
+        entries.sort(key=lambda entry: entry[0])
+        return entries[:limit] if limit is not None else entries
+
+    def size(self):
+        with self.lock:
+            return sum(segment.size for segment in self.segments)
+
+    def close(self):
+        with self.lock:
+            self.close_segment()
@@ -0,0 +1,55 @@
+import logging
+import sys
+import threading
+
+# Stufen für --log-level; 'off' schaltet alle Ausgaben ab
+LOG_LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warning': logging.WARNING, 'error': logging.ERROR, 'off': logging.CRITICAL + 1}
+# Höchstens LOG_RATE Meldungen pro Sekunde und Aufrufstelle, kurzfristig bis zu LOG_BURST; 0 = unbegrenzt
+LOG_RATE = 10
+LOG_BURST = 20
+
+logger = logging.getLogger('chat')
+
+
+# Drosselt jede Aufrufstelle mit einem eigenen Token-Bucket. Die Anzahl der unterdrückten Meldungen
+# wird an die nächste durchgelassene Meldung derselben Stelle angehängt.
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate=LOG_RATE, burst=LOG_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, record.created, 0]
+            bucket[0] = min(self.burst, bucket[0] + (record.created - bucket[1]) * self.rate)
+            bucket[1] = record.created
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.msg = f'{record.getMessage()} ({suppressed} weitere Meldungen unterdrückt)'
+            record.args = ()
+        return True
+
+
+def configure_logging(level='info', rate=LOG_RATE, burst=LOG_BURST, stream=None):
+    logger.setLevel(LOG_LEVELS[level])
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    for log_filter in list(logger.filters):
+        logger.removeFilter(log_filter)
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.addFilter(RateLimitFilter(rate, burst))
+    logger.propagate = False
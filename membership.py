@@ -0,0 +1,247 @@
+import bisect
+import collections
+import threading
+
+# Anzahl der Änderungen, die der Führer für Deltas vorhält
+MEMBERSHIP_HISTORY = 1024
+
+
+# Versionierte Liste aller Beitritte und Austritte. Jede Änderung erhöht die Version um eins,
+# Heartbeats übertragen nur die Änderungen seit einer Basisversion.
+# Raumwechsel stehen als ('subscribe' | 'unsubscribe', 'room', [Raum, Client-ID]) in derselben Liste.
+class MembershipLog:
+    def __init__(self, history=MEMBERSHIP_HISTORY):
+        self.version = 0
+        self.changes = collections.deque(maxlen=history)
+        self.lock = threading.Lock()
+
+    def record(self, op, kind, node):
+        with self.lock:
+            self.version += 1
+            change = [self.version, op, kind, node]
+            self.changes.append(change)
+            return self.version
+
+    # Änderungen mit base_version < Version <= version, in aufsteigender Reihenfolge;
+    # None, wenn die Historie nicht mehr bis base_version zurückreicht
+    def deltas_between(self, base_version, version):
+        with self.lock:
+            if base_version < version and (not self.changes or self.changes[0][0] > base_version + 1):
+                return None
+            deltas = []
+            for change in reversed(self.changes):
+                if change[0] <= base_version:
+                    break
+                if change[0] <= version:
+                    deltas.append(change)
+            deltas.reverse()
+            return deltas
+
+    def set_version(self, version):
+        with self.lock:
+            self.version = version
+
+
+# Ein Mitglied des Clusters (Server oder Client)
+class Member:
+    __slots__ = ('node_id', 'address', 'info', 'codec', 'rooms')
+
+    def __init__(self, node_id, address, info):
+        self.node_id = node_id
+        self.address = address
+        self.info = info
+        self.codec = None
+        # Räume, die ein Client abonniert hat
+        self.rooms = set()
+
+
+# Feldnamen der Knoten-Dictionaries je Art
+NODE_KEYS = {'server': ('server_id', 'server_address'), 'client': ('client_id', 'client_address')}
+
+
+# Mitgliederverzeichnis mit Index nach UUID und Adresse. Die Server bilden einen nach ID sortierten Ring,
+# damit alle Server unabhängig von der Beitrittsreihenfolge dieselben Nachbarn bestimmen.
+# Der Raumindex liefert die Mitglieder eines Raums, ohne alle Clients durchzugehen.
+class MembershipRegistry:
+    def __init__(self, log=None):
+        self.log = log or MembershipLog()
+        self.lock = threading.RLock()
+        self.members = {'server': {}, 'client': {}}
+        self.addresses = {'server': {}, 'client': {}}
+        self.ring = []
+        # Raum -> Client-IDs
+        self.rooms = {}
+
+    def join(self, kind, info, record=True):
+        id_key, address_key = NODE_KEYS[kind]
+        node_id = info[id_key]
+        address = tuple(info[address_key])
+        with self.lock:
+            existing = self.members[kind].get(node_id)
+            if existing is not None and existing.address == address:
+                return False
+            if existing is not None:
+                del self.addresses[kind][existing.address]
+            else:
+                if kind == 'server':
+                    bisect.insort(self.ring, node_id)
+            member = Member(node_id, address, info)
+            if existing is not None:
+                member.codec = existing.codec
+                member.rooms = existing.rooms
+            self.members[kind][node_id] = member
+            self.addresses[kind][address] = node_id
+            if record:
+                self.log.record('join', kind, info)
+            return True
+
+    def leave(self, kind, node_id, record=True):
+        with self.lock:
+            member = self.members[kind].pop(node_id, None)
+            if member is None:
+                return None
+            del self.addresses[kind][member.address]
+            if kind == 'server':
+                index = bisect.bisect_left(self.ring, node_id)
+                del self.ring[index]
+            # Abonnements verfallen mit dem Client, ohne eigene Einträge in der Historie
+            for room in member.rooms:
+                self.remove_subscriber(room, node_id)
+            if record:
+                self.log.record('leave', kind, member.info)
+            return member.info
+
+    def leave_address(self, kind, address, record=True):
+        with self.lock:
+            node_id = self.addresses[kind].get(tuple(address))
+            if node_id is None:
+                return None
+            return self.leave(kind, node_id, record)
+
+    def subscribe(self, room, client_id, record=True):
+        with self.lock:
+            member = self.members['client'].get(client_id)
+            if member is None or room in member.rooms:
+                return False
+            member.rooms.add(room)
+            self.rooms.setdefault(room, set()).add(client_id)
+            if record:
+                self.log.record('subscribe', 'room', [room, client_id])
+            return True
+
+    def unsubscribe(self, room, client_id, record=True):
+        with self.lock:
+            member = self.members['client'].get(client_id)
+            if member is None or room not in member.rooms:
+                return False
+            member.rooms.discard(room)
+            self.remove_subscriber(room, client_id)
+            if record:
+                self.log.record('unsubscribe', 'room', [room, client_id])
+            return True
+
+    def remove_subscriber(self, room, client_id):
+        subscribers = self.rooms.get(room)
+        if subscribers is not None:
+            subscribers.discard(client_id)
+            if not subscribers:
+                del self.rooms[room]
+
+    # Änderung aus einem Heartbeat des Führers übernehmen (ohne eigene Versionierung)
+    def apply(self, op, kind, info):
+        if op == 'join':
+            self.join(kind, info, record=False)
+        elif op == 'leave':
+            self.leave(kind, info[NODE_KEYS[kind][0]], record=False)
+        elif op == 'subscribe':
+            self.subscribe(*info, record=False)
+        else:
+            self.unsubscribe(*info, record=False)
+
+    def reset(self, server_list, client_list, version=None, room_list=None):
+        with self.lock:
+            self.members = {'server': {}, 'client': {}}
+            self.addresses = {'server': {}, 'client': {}}
+            self.ring = []
+            self.rooms = {}
+            for info in server_list:
+                self.join('server', info, record=False)
+            for info in client_list:
+                self.join('client', info, record=False)
+            for room, client_ids in (room_list or {}).items():
+                for client_id in client_ids:
+                    self.subscribe(room, client_id, record=False)
+            if version is not None:
+                self.log.set_version(version)
+
+    def get(self, kind, node_id):
+        with self.lock:
+            return self.members[kind].get(node_id)
+
+    def by_address(self, kind, address):
+        with self.lock:
+            node_id = self.addresses[kind].get(tuple(address))
+            return None if node_id is None else self.members[kind][node_id]
+
+    def contains(self, kind, node_id):
+        return node_id in self.members[kind]
+
+    def count(self, kind):
+        return len(self.members[kind])
+
+    def room_members(self, room):
+        with self.lock:
+            return [self.members['client'][client_id] for client_id in self.rooms.get(room, ())]
+
+    def is_subscribed(self, room, client_id):
+        with self.lock:
+            return client_id in self.rooms.get(room, ())
+
+    def room_count(self):
+        return len(self.rooms)
+
+    # Abonnements in kompakter Form: Raum -> Client-IDs
+    def room_list(self):
+        with self.lock:
+            return {room: list(client_ids) for room, client_ids in self.rooms.items()}
+
+    # Nachbar im Ring ('left' = nächstgrößere ID, 'right' = nächstkleinere ID)
+    def neighbour(self, node_id, direction='left'):
+        with self.lock:
+            if not self.ring:
+                return None
+            index = bisect.bisect_left(self.ring, node_id)
+            if direction == 'left':
+                if index < len(self.ring) and self.ring[index] == node_id:
+                    index += 1
+                neighbour_id = self.ring[index % len(self.ring)]
+            else:
+                neighbour_id = self.ring[index - 1]
+            return self.members['server'][neighbour_id].info
+
+    def set_codec(self, kind, node_id, codec):
+        with self.lock:
+            member = self.members[kind].get(node_id)
+            if member is not None:
+                member.codec = codec
+
+    def member_list(self, kind):
+        with self.lock:
+            return list(self.members[kind].values())
+
+    def server_list(self):
+        with self.lock:
+            return [self.members['server'][node_id].info for node_id in self.ring]
+
+    def server_ids(self):
+        with self.lock:
+            return tuple(self.ring)
+
+    def client_list(self):
+        with self.lock:
+            return [member.info for member in self.members['client'].values()]
+
+    # Version und Listen in einem konsistenten Zustand, z.B. für Snapshots
+    def snapshot(self):
+        with self.lock:
+            return self.log.version, self.server_list(), self.client_list(), self.room_list()
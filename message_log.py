@@ -0,0 +1,154 @@
+import threading
+
+# Anzahl der Chat-Nachrichten, die Führer und Follower für Wiederholungen vorhalten
+MESSAGE_LOG_SIZE = 1024
+# So lange wartet ein Client auf fehlende Sequenznummern, bevor er die Lücke überspringt
+REORDER_TIMEOUT = 1.0
+# Raum, in dem alle Clients sind; Nachrichten ohne Raum gehen an alle
+DEFAULT_ROOM = ''
+
+
+# Ringpuffer der zuletzt verteilten Chat-Nachrichten, indiziert nach globaler Sequenznummer.
+# Der Führer vergibt die Nummern, die Follower übernehmen die replizierten Einträge.
+# Pro Client werden die Client-Sequenznummern im Fenster gemerkt, damit wiederholt gesendete Nachrichten
+# nach einem Wiederverbinden oder Führungswechsel nicht doppelt verteilt werden. Nach einem Führungswechsel
+# können ältere Nachrichten eines Clients nach neueren eintreffen, deshalb genügt die höchste Nummer nicht.
+# Jeder Eintrag verweist mit 'prev' auf die vorherige Nummer desselben Raums, damit Clients, die nur einen Teil
+# der Räume sehen, Lücken in ihren Räumen erkennen.
+class MessageLog:
+    def __init__(self, size=MESSAGE_LOG_SIZE):
+        self.size = size
+        self.entries = {}
+        self.last_seq = 0
+        # Höchste Sequenznummer, bis zu der keine Einträge fehlen
+        self.contiguous_seq = 0
+        # (Client-ID, Client-Sequenznummer) -> Sequenznummer der Einträge im Fenster
+        self.client_seqs = {}
+        # Client-ID -> höchste Client-Sequenznummer der Einträge, die aus dem Fenster gefallen sind
+        self.evicted_client_seqs = {}
+        # Raum -> höchste Sequenznummer in diesem Raum
+        self.room_seqs = {}
+        self.lock = threading.Lock()
+
+    # Führer: vergibt die nächste Sequenznummer; None, wenn die Nachricht bereits verteilt wurde
+    def append(self, message):
+        with self.lock:
+            client_id = message['sender'].get('client_id')
+            client_seq = message.get('client_seq')
+            if client_seq is not None and self.sequenced(client_id, client_seq):
+                return None
+            seq = self.last_seq + 1
+            message['prev'] = self.room_seqs.get(message.get('room', DEFAULT_ROOM), 0)
+            self.store(seq, message)
+            return seq
+
+    # Follower: übernimmt einen replizierten Eintrag; False, wenn er bereits vorliegt oder zu alt ist
+    def add(self, seq, message):
+        with self.lock:
+            if seq in self.entries or seq <= self.last_seq - self.size:
+                return False
+            self.store(seq, message)
+            return True
+
+    # Follower: seq ist hier bereits mit einer anderen Nachricht belegt, z.B. weil ein neuer Führer eine Nummer
+    # erneut vergeben hat, die der alte nicht mehr an alle Follower repliziert hatte
+    def conflicts_with(self, seq, message):
+        with self.lock:
+            entry = self.entries.get(seq)
+            return entry is not None and message_key(entry) != message_key(message)
+
+    def store(self, seq, message):
+        # Einträge, die aus dem Fenster fallen, werden verworfen
+        if seq - self.last_seq >= self.size:
+            old_seqs = list(self.entries)
+        else:
+            old_seqs = range(self.last_seq - self.size + 1, seq - self.size + 1)
+        for old_seq in old_seqs:
+            self.evict(old_seq)
+        self.entries[seq] = message
+        self.last_seq = max(self.last_seq, seq)
+        self.contiguous_seq = max(self.contiguous_seq, self.last_seq - self.size)
+        while self.contiguous_seq + 1 in self.entries:
+            self.contiguous_seq += 1
+        client_id = message['sender'].get('client_id')
+        client_seq = message.get('client_seq')
+        if client_seq is not None:
+            self.client_seqs[(client_id, client_seq)] = seq
+        room = message.get('room', DEFAULT_ROOM)
+        if seq > self.room_seqs.get(room, 0):
+            self.room_seqs[room] = seq
+
+    def evict(self, seq):
+        message = self.entries.pop(seq, None)
+        if message is None or message.get('client_seq') is None:
+            return
+        client_id = message['sender'].get('client_id')
+        client_seq = message['client_seq']
+        self.client_seqs.pop((client_id, client_seq), None)
+        if client_seq > self.evicted_client_seqs.get(client_id, 0):
+            self.evicted_client_seqs[client_id] = client_seq
+
+    # Wurde die Nachricht des Clients bereits verteilt? Jenseits des Fensters gilt jede ältere Nummer als verteilt.
+    def sequenced(self, client_id, client_seq):
+        return (client_id, client_seq) in self.client_seqs or client_seq <= self.evicted_client_seqs.get(client_id, 0)
+
+    # Alle vorgehaltenen Einträge nach seq in aufsteigender Reihenfolge
+    def since(self, seq):
+        with self.lock:
+            start = max(seq, self.last_seq - self.size) + 1
+            return [(s, self.entries[s]) for s in range(start, self.last_seq + 1) if s in self.entries]
+
+    # Ein Client hat bereits höhere Nummern gesehen (z.B. vom alten Führer): neue Nummern schließen daran an
+    def skip_to(self, seq):
+        with self.lock:
+            if seq > self.last_seq:
+                self.last_seq = seq
+                self.contiguous_seq = max(self.contiguous_seq, seq - self.size)
+
+
+# Vergleichsschlüssel einer Chat-Nachricht: Absender, Client-Sequenznummer und Inhalt
+def message_key(message):
+    return message['sender'].get('client_id'), message.get('client_seq'), message.get('content')
+
+
+# Clientseitige Zustellung in Reihenfolge der Sequenznummern: Duplikate werden verworfen,
+# vorgezogene Nachrichten zurückgehalten, bis die Lücke gefüllt ist oder übersprungen wird.
+# Eine Nachricht ist zustellbar, sobald ihr Vorgänger prev (ohne Angabe seq - 1) zugestellt ist.
+class ReorderBuffer:
+    def __init__(self):
+        self.last_seq = None
+        self.held_back = {}
+        self.lock = threading.Lock()
+
+    # Liefert die jetzt zustellbaren Nachrichten und ob eine Lücke entstanden ist
+    def receive(self, seq, message, prev=None):
+        if prev is None:
+            prev = seq - 1
+        with self.lock:
+            if self.last_seq is None:
+                self.last_seq = prev
+            if seq <= self.last_seq or seq in self.held_back:
+                return [], False
+            gap = not self.held_back and prev > self.last_seq
+            self.held_back[seq] = (prev, message)
+            return self.drain(), gap
+
+    # Gibt die fehlenden Nummern auf und stellt ab der kleinsten zurückgehaltenen Nachricht zu
+    def skip(self):
+        with self.lock:
+            if self.held_back:
+                self.last_seq = self.held_back[min(self.held_back)][0]
+            return self.drain()
+
+    def drain(self):
+        delivered = []
+        while self.held_back:
+            seq = min(self.held_back)
+            prev, message = self.held_back[seq]
+            # Ein Vorgänger, der älter als die zuletzt zugestellte Nachricht ist, fehlt endgültig (z.B. nach einem Führungswechsel)
+            if prev > self.last_seq:
+                break
+            del self.held_back[seq]
+            self.last_seq = seq
+            delivered.append(message)
+        return delivered
@@ -0,0 +1,137 @@
+import bisect
+import http.server
+import threading
+
+# Obergrenzen der Histogramm-Buckets in Sekunden
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+INTERVAL_BUCKETS = (0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 1, 2, 5)
+
+# Standardmäßig nur lokal erreichbar
+METRICS_HOST = '127.0.0.1'
+
+
+# Monoton steigender Zähler. Statt selbst zu zählen, kann er einen Wert lesen, den ein anderes Objekt führt.
+class Counter:
+    def __init__(self, function=None):
+        self.value = 0
+        self.function = function
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, self.function() if self.function else self.value)]
+
+
+# Momentaufnahme, z.B. Größe der Mitgliedschaft oder Füllstand von Warteschlangen
+class Gauge:
+    def __init__(self, function=None):
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labels):
+        return [(name, labels, self.function() if self.function else self.value)]
+
+
+# Verteilung mit festen Buckets; observe() kostet eine Binärsuche und eine Sperre
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            samples.append((f'{name}_bucket', labels + (('le', str(bound)),), cumulative))
+        samples.append((f'{name}_sum', labels, total))
+        samples.append((f'{name}_count', labels, cumulative))
+        return samples
+
+
+# Alle Metriken eines Prozesses, ausgegeben im Textformat von Prometheus
+class MetricsRegistry:
+    def __init__(self):
+        # name -> (Typ, Beschreibung, {Labels: Metrik})
+        self.families = {}
+        self.lock = threading.Lock()
+
+    def register(self, kind, name, help_text, metric, labels):
+        labels = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.families.setdefault(name, (kind, help_text, {}))
+            if family[0] != kind:
+                raise ValueError(f'Metrik {name} ist bereits als {family[0]} registriert')
+            return family[2].setdefault(labels, metric)
+
+    def counter(self, name, help_text, function=None, **labels):
+        return self.register('counter', name, help_text, Counter(function), labels)
+
+    def gauge(self, name, help_text, function=None, **labels):
+        return self.register('gauge', name, help_text, Gauge(function), labels)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, **labels):
+        return self.register('histogram', name, help_text, Histogram(buckets), labels)
+
+    def render(self):
+        with self.lock:
+            families = [(name, kind, help_text, list(series.items())) for name, (kind, help_text, series) in sorted(self.families.items())]
+        lines = []
+        for name, kind, help_text, series in families:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, metric in series:
+                for sample_name, sample_labels, value in metric.samples(name, labels):
+                    lines.append(f'{sample_name}{format_labels(sample_labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+
+# HTTP-Endpunkt: GET /metrics liefert alle Metriken als Text
+def start_metrics_server(registry, port, host=METRICS_HOST):
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
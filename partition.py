@@ -0,0 +1,54 @@
+import bisect
+import hashlib
+import threading
+
+# Virtuelle Knoten pro Server: glätten die Verteilung der Clients, auch wenn es nur wenige Server gibt
+PARTITION_VIRTUAL_NODES = 64
+# Obergrenze für zwischengespeicherte Zuordnungen, danach wird der Cache geleert
+PARTITION_CACHE_SIZE = 65536
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+# Konsistentes Hashing: kommt ein Server hinzu oder fällt einer weg, wechseln nur die Clients
+# seiner Abschnitte den Server, alle anderen Verbindungen bleiben, wo sie sind
+class HashRing:
+    def __init__(self, node_ids=(), virtual_nodes=PARTITION_VIRTUAL_NODES):
+        self.node_ids = tuple(node_ids)
+        points = sorted((ring_hash(f'{node_id}#{i}'), node_id) for node_id in self.node_ids for i in range(virtual_nodes))
+        self.hashes = [point for point, _ in points]
+        self.owners = [node_id for _, node_id in points]
+
+    def owner(self, key):
+        if not self.hashes:
+            return None
+        index = bisect.bisect(self.hashes, ring_hash(key)) % len(self.hashes)
+        return self.owners[index]
+
+
+# Zuordnung Client -> Server mit Cache, der bei jeder Änderung der Servermenge neu aufgebaut wird
+class ClientPartitioner:
+    def __init__(self, virtual_nodes=PARTITION_VIRTUAL_NODES):
+        self.virtual_nodes = virtual_nodes
+        self.ring = HashRing((), virtual_nodes)
+        self.owners = {}
+        self.lock = threading.Lock()
+
+    def update(self, server_ids):
+        server_ids = tuple(server_ids)
+        with self.lock:
+            if server_ids != self.ring.node_ids:
+                self.ring = HashRing(server_ids, self.virtual_nodes)
+                self.owners = {}
+
+    def owner(self, client_id):
+        owners = self.owners
+        owner = owners.get(client_id)
+        if owner is None:
+            owner = self.ring.owner(client_id)
+            if len(owners) >= PARTITION_CACHE_SIZE:
+                owners.clear()
+            owners[client_id] = owner
+        return owner
@@ -1,46 +1,130 @@
+import argparse
+import asyncio
+import collections
+import os
 import socket
+import struct
 import uuid
 import threading
 import json
 import time
 
+from admission import CLIENT_MESSAGE_BURST, CLIENT_MESSAGE_RATE, INFLIGHT_BYTES, AdmissionControl
+from codec import CODECS, COMPRESSION_THRESHOLD, configure_compression, decode_auto, get_codec, negotiate_codec
+from discovery import CACHE_DIR, MULTICAST_GROUP, PROBE_TIMEOUT, DiscoveryCache, cache_path, detect_local_ip, enable_multicast, join_multicast_group, request_discovery
+from election import ELECTION_ALGORITHMS, create_election
+from failure_detector import PHI_THRESHOLD, PhiAccrualDetector
+from membership import MembershipRegistry
+from message_log import DEFAULT_ROOM, MESSAGE_LOG_SIZE, MessageLog
+from partition import ClientPartitioner, HashRing
+from log import LOG_LEVELS, LOG_RATE, configure_logging, logger
+from metrics import INTERVAL_BUCKETS, MetricsRegistry, start_metrics_server
+from tracing import TraceCollector, timestamp, trace_of
+from journal import JOURNAL_SYNC_DELAY, Journal
+from fanout import BATCH_DELAY, BATCH_MAX_MESSAGES, SLOW_CONSUMER_BUFFER_BYTES, SLOW_CONSUMER_POLICIES, AsyncFanoutEngine, FanoutEngine
+from transport import MAX_DATAGRAM_SIZE, AsyncConnectionPool, ConnectionPool, DatagramAssembler, FrameBuffer, FrameReader, split_batch, split_datagram
+from workers import WorkerHub, WorkerTransport, create_shared_tcp_socket, worker_socket_path
+
 # Konstanten Definition
 BROADCAST_IP = '192.168.178.255'
 BROADCAST_PORT = 10010
-NEW_LEADER_PORT = 10020
-SERVER_ELECTION_PORT = 10030
-HEARTBEAT_SEND_PORT = 10040
 HEARTBEAT_LISTEN_PORT = 10050
+# Eigene IP-Adresse (None = automatisch ermitteln) und TCP-Port (0 = beliebig), z.B. für mehrere Server auf 127.0.0.1.
+# Der UDP-Socket für die Wahl verwendet dieselbe Portnummer wie der TCP-Socket.
+LOCAL_IP = None
+SERVER_PORT = 0
 
 # Identifier für Broadcast-Nachrichten
 BROADCAST_SEND_ID = '8c2d6619-6b05-4567-aca9-9ddd4ee76876'
 BROADCAST_RESPONSE_ID = 'df147dc4-f2b0-4df7-84c8-967f46d4377c'
 
-BUFFER_SIZE = 4096
-
-# Anzahl der Versuche, die ein Server beim Start unternimmt, um andere Server zu entdecken
+# Anzahl der Versuche, die ein Server beim Start unternimmt, um andere Server zu entdecken, und Wartezeit pro Versuch.
+# Vorher werden die zuletzt bekannten Server direkt angefragt (siehe discovery.py).
 SERVER_DISCOVERY_ATTEMPTS = 5
-# Anzahl der Herzschlag-Versuche, bevor ein Server eine Wahl startet
-HEARTBEAT_ATTEMPTS = 3
-HEARTBEAT_PRINT_INTERVAL = 10
-HEARTBEAT_MISSES_MAX = 3
+SERVER_DISCOVERY_TIMEOUT = 0.25
+# Multicast-Gruppe der Servererkennung (None = nur Broadcast) und Verzeichnis für den zuletzt bekannten Führer (None = aus)
+DISCOVERY_GROUP = MULTICAST_GROUP
+DISCOVERY_CACHE_DIR = CACHE_DIR
+# Abstand zwischen zwei Heartbeats des Führers in Sekunden
+HEARTBEAT_INTERVAL = 0.1
+HEARTBEAT_PRINT_INTERVAL = 100
+# Ausfall des Führers, sobald phi des Fehlerdetektors diese Schwelle überschreitet (siehe failure_detector.py)
+LEADER_PHI_THRESHOLD = PHI_THRESHOLD
+# Rückfallebene, solange noch kein Heartbeat des aktuellen Führers empfangen wurde
+HEARTBEAT_TIMEOUT = 3
+
+# Wahlverfahren ('bully' oder 'ring', siehe election.py) und Takt für Wiederholungen und Zeitüberschreitungen
+ELECTION_ALGORITHM = 'bully'
+ELECTION_TICK = 0.05
+# Ein Heartbeat enthält die Mitgliedschaftsänderungen der letzten HEARTBEAT_DELTA_WINDOW Heartbeats,
+# damit einzelne verlorene Datagramme keinen vollständigen Abgleich erfordern
+HEARTBEAT_DELTA_WINDOW = 3
+# Mindestabstand zwischen zwei Anfragen eines Followers nach fehlenden Chat-Nachrichten in Sekunden
+MESSAGE_REPLAY_INTERVAL = 1
+# So lange wartet ein neuer Führer höchstens auf den Stand der Follower, bevor er wieder Nummern vergibt
+LOG_SYNC_TIMEOUT = 1
+
+# Betriebsart des Servers: 'threads' (ein Thread pro Listener) oder 'asyncio' (eine Ereignisschleife)
+SERVER_MODES = ('threads', 'asyncio')
+
+# Verteilung der Clients: 'leader' (alle Clients beim Führer) oder 'hash' (konsistentes Hashing der
+# Client-ID über alle Server, jeder Server bedient nur seine Clients und leitet Chat-Nachrichten an den Führer weiter)
+CLIENT_PLACEMENTS = ('leader', 'hash')
+CLIENT_PLACEMENT = 'leader'
+
+# Codec für Nachrichten zwischen Servern; Clients handeln ihren Codec beim Beitritt aus (siehe codec.py)
+SERVER_CODEC = 'binary'
+# Komprimierende Codecs ('binary+zlib' als --codec bzw. vom Client ausgehandelt) packen erst ab dieser Größe
+COMPRESSION_MIN_BYTES = COMPRESSION_THRESHOLD
+
+# Umgang mit Clients, die Nachrichten nicht schnell genug abnehmen (siehe fanout.py)
+SLOW_CONSUMER_POLICY = 'drop'
+SLOW_CONSUMER_BUFFER = SLOW_CONSUMER_BUFFER_BYTES
+# Sammelfenster für die Verteilung an Clients: Latenz gegen Durchsatz (siehe fanout.py)
+BATCH_WINDOW = BATCH_DELAY
+BATCH_MESSAGES = BATCH_MAX_MESSAGES
+
+# Ausgaben: Stufe und Drosselung pro Aufrufstelle (siehe log.py); Nachrichten selbst werden nur mit 'debug' ausgegeben
+LOG_LEVEL = 'info'
+LOG_MAX_RATE = LOG_RATE
+# Port des HTTP-Endpunkts für Metriken auf 127.0.0.1 (None = aus)
+METRICS_PORT = None
+# Verzeichnis des Journals für Chat-Nachrichten (None = nur im Speicher, siehe journal.py). Die Mitgliedschaft
+# wird nicht journalisiert: nach einem Neustart baut der Server sie aus dem Snapshot des Führers neu auf.
+# Jeder Server braucht ein eigenes Verzeichnis. JOURNAL_SYNC ist das Fenster des Gruppen-Commits in Sekunden.
+JOURNAL_DIR = None
+JOURNAL_SYNC = JOURNAL_SYNC_DELAY
+
+# Spans verfolgter Chat-Nachrichten (von den Clients markiert, siehe tracing.py) in diese Datei schreiben
+TRACE_FILE = None
+# Zulassung von Chat-Nachrichten (siehe admission.py): Nachrichten pro Sekunde und Client (0 = unbegrenzt),
+# Spitze des Token-Buckets und Budget für Bytes, die auf die Verteilung an die Clients warten
+CLIENT_RATE = CLIENT_MESSAGE_RATE
+CLIENT_BURST = CLIENT_MESSAGE_BURST
+INFLIGHT_BUDGET = INFLIGHT_BYTES
+# Sind alle infrage kommenden Server überlastet, soll ein neuer Client so viele Sekunden später erneut anfragen
+JOIN_RETRY_AFTER = 1
+
+# Prozesse, die sich den TCP-Port teilen und Client-Sitzungen bedienen (nur asyncio, siehe workers.py).
+# Nach außen bleibt es ein Server: Wahl, Heartbeat und Sequenznummern übernimmt allein dieser Prozess.
+WORKERS = 1
 
 # Hilfsfunktionen
+# Die eigene Adresse wird nur einmal ermittelt
+local_ip = None
+
 def get_local_ip():
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        s.connect(('10.255.255.255', 1))
-        IP = s.getsockname()[0]
-    except Exception:
-        IP = '127.0.0.1'
-    finally:
-        s.close()
-    return IP
+    global local_ip
+    if local_ip is None:
+        local_ip = LOCAL_IP or detect_local_ip()
+    return local_ip
 
 def create_broadcast_socket(timeout=None):
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
     s.bind((get_local_ip(), 0))
+    if DISCOVERY_GROUP:
+        enable_multicast(s, get_local_ip())
     if timeout:
         s.settimeout(timeout)
     return s
@@ -48,65 +132,103 @@ def create_broadcast_socket(timeout=None):
 def create_heartbeat_send_socket(timeout=None):
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
     s.bind((get_local_ip(), 0))
     if timeout:
         s.settimeout(timeout)
     return s
 
-def create_heartbeat_listen_socket(port, timeout=None):
+def create_broadcast_listen_socket(timeout=None):
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Mehrere Server auf einem Rechner empfangen dieselben Broadcasts
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind(('', port))
+    s.bind(('', BROADCAST_PORT))
+    if DISCOVERY_GROUP:
+        join_multicast_group(s, DISCOVERY_GROUP, get_local_ip())
     if timeout:
         s.settimeout(timeout)
     return s
 
-def create_tcp_socket():
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+def create_heartbeat_listen_socket(port, timeout=None):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind((get_local_ip(), 0))
-    s.listen()
+    s.bind(('', port))
+    if timeout:
+        s.settimeout(timeout)
     return s
 
 def create_tcp_socket_with_port(port):
+    if WORKERS > 1:
+        return create_shared_tcp_socket((get_local_ip(), port))
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.bind((get_local_ip(), port))
     s.listen()
     return s
 
+# Nachrichten laufen über langlebige Verbindungen aus dem Pool statt über einen Verbindungsaufbau pro Nachricht
+connection_pool = ConnectionPool(timeout=1)
+# Verteilt Nachrichten an die Clients, wird in main() je nach Betriebsart erstellt
+fanout = None
+# Bremst einzelne Clients und den Server als Ganzes, wird in main() erstellt
+admission = None
+# Zuletzt bekannter Führer und Server, wird in main() geladen
+discovery_cache = DiscoveryCache()
+# Schreibt die Spans verfolgter Nachrichten, nur mit TRACE_FILE
+tracer = None
+
 def send_tcp_message(address, message):
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(1)
-    s.connect(address)
-    s.send(message)
-    s.close()
+    messages_sent['server'].inc()
+    connection_pool.send(address, message)
+
+def build_message(node_type, sender_address, content):
+    return {'node_type': node_type, 'sender': sender_address, 'content': content}
 
-def encode_message(node_type, sender_address, content):
-    message_dict = {'node_type': node_type, 'sender': sender_address, 'content': content}
-    return json.dumps(message_dict).encode()
+def encode_message(node_type, sender_address, content, codec_name=None, extra=None):
+    message_dict = build_message(node_type, sender_address, content)
+    if extra:
+        message_dict.update(extra)
+    return get_codec(codec_name or SERVER_CODEC).encode(message_dict)
 
-def encode_heartbeat_message(node_type, sender_address, content, server_list, client_list):
-    message_dict = {'node_type': node_type, 'sender': sender_address, 'content': content, 'server_list': server_list, 'client_list': client_list}
-    return json.dumps(message_dict).encode()
+def encode_heartbeat_message(node_type, sender_address, content, version, base_version, deltas, seq, load):
+    message_dict = {'node_type': node_type, 'sender': sender_address, 'content': content, 'version': version, 'base_version': base_version, 'deltas': deltas, 'seq': seq, 'load': load}
+    return get_codec(SERVER_CODEC).encode(message_dict)
+
+def encode_snapshot_message(node_type, sender_address, version, server_list, client_list, room_list):
+    message_dict = {'node_type': node_type, 'sender': sender_address, 'content': '#SnapshotResponse#', 'version': version, 'server_list': server_list, 'client_list': client_list, 'rooms': room_list}
+    return get_codec(SERVER_CODEC).encode(message_dict)
 
 def decode_message(message):
-    return json.loads(message.decode())
+    return decode_auto(message)
+
+# Fehler, die eine beschädigte oder unvollständige Nachricht beim Dekodieren oder Auswerten auslöst
+MALFORMED_MESSAGE_ERRORS = (KeyError, TypeError, ValueError, AttributeError, IndexError, struct.error)
 
-# Erstelle TCP-Kommunikationssockets
-server_socket = create_tcp_socket()
-server_address = server_socket.getsockname()
+# Eine fehlerhafte Nachricht wird verworfen, die Verbindung bleibt bestehen
+def handle_payload(payload, session):
+    try:
+        handle_message(decode_message(payload), session)
+    except MALFORMED_MESSAGE_ERRORS as e:
+        logger.warning('Fehlerhafte Nachricht von %s verworfen: %r', session.address, e)
 
-# Erstelle Wahl-Sockets
-election_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-election_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-election_socket.bind((get_local_ip(), SERVER_ELECTION_PORT))
+# Ein fehlerhaftes Datagramm wird verworfen, der Listener läuft weiter; liefert die Antwort des Handlers oder None
+def handle_datagram(handler, data, address):
+    try:
+        return handler(data, address)
+    except MALFORMED_MESSAGE_ERRORS as e:
+        logger.warning('Fehlerhaftes Datagramm von %s verworfen: %r', address, e)
+        return None
+
+# TCP- und Wahl-Socket, werden in create_server_sockets() erstellt, damit Adresse und Ports vorher einstellbar sind
+server_socket = None
+server_address = None
+election_socket = None
 
 # Variablen für Systemübersicht
 server_id = str(uuid.uuid4())
-server_info = {'server_id': server_id, 'server_address': server_address}
-clients = []
-servers = []
+server_info = None
+# Alle bekannten Server und Clients, indiziert nach UUID und Adresse (siehe membership.py)
+registry = MembershipRegistry()
 
 # Flag, um das Stoppen des Servers zu ermöglichen (um "while True" zu vermeiden)
 is_running = True
@@ -114,10 +236,122 @@ is_running = True
 # Globale Führungsvariablen
 is_leader = False
 leader_info = None
-is_participant = False
+# Führer und Server, die zuletzt im Cache der Servererkennung gespeichert wurden (siehe set_leader_info)
+remembered_servers = None
+# Wahlverfahren, wird in main() erstellt
+election = None
+
+# Zeitpunkt des letzten empfangenen Heartbeats und Anzahl der Heartbeats insgesamt
+last_heartbeat_time = time.monotonic()
+heartbeat_count = 0
+# Fehlerdetektor für den aktuellen Führer; wird bei jedem Führungswechsel neu angelegt
+leader_detector = None
+last_failover_time = time.monotonic()
+# Heartbeats, die nicht in ein Datagramm passen, kommen fragmentiert an
+heartbeat_assembler = DatagramAssembler()
+
+# Versionierte Mitgliedschaft: der Führer verschickt nur Änderungen, Follower holen bei Lücken einen Snapshot
+membership_log = registry.log
+# Versionen der zuletzt gesendeten Heartbeats (Führer) bzw. Server-ID des Führers, dessen Stand übernommen wurde (Follower)
+heartbeat_versions = collections.deque(maxlen=HEARTBEAT_DELTA_WINDOW)
+membership_source = None
+last_snapshot_request = 0
+
+# Chat-Nachrichten mit globaler Sequenznummer; Follower halten eine Kopie für den Fall eines Führungswechsels
+message_log = MessageLog()
+# Vergabe der Nummer und Übergabe an die Warteschlangen erfolgen gemeinsam, damit die Reihenfolge erhalten bleibt
+sequence_lock = threading.Lock()
+last_replay_request = 0
+# Modus 'hash': an den Führer weitergeleitete Chat-Nachrichten, bis sie repliziert zurückkommen; fällt der Führer
+# vorher aus, erhält sie der neu gewählte, (Client-ID, Client-Sequenznummer) -> Nachricht
+unsequenced_relays = {}
+# Neuer Führer: Server, deren Nachrichtenlog noch nicht abgeglichen ist, und die bis dahin zurückgehaltenen
+# Chat-Nachrichten. Der alte Führer kann einzelne Nummern nur an einen Teil der Follower repliziert haben.
+log_sync_pending = set()
+log_sync_deadline = None
+deferred_messages = []
+
+# Metriken im Textformat von Prometheus (siehe metrics.py); Zustandswerte werden erst beim Abruf gelesen
+metrics = MetricsRegistry()
+messages_received = {node_type: metrics.counter('chat_messages_received_total', 'Empfangene TCP-Nachrichten', node_type=node_type)
+                     for node_type in ('client', 'server')}
+messages_sent = {target: metrics.counter('chat_messages_sent_total', 'Gesendete Nachrichten, pro Empfänger gezählt', target=target)
+                 for target in ('client', 'server')}
+fanout_latency = metrics.histogram('chat_fanout_latency_seconds', 'Zeit von der Veröffentlichung bis zum Schreiben an den Client')
+heartbeat_interval = metrics.histogram('chat_heartbeat_interval_seconds', 'Abstand zwischen zwei Heartbeats des Führers', INTERVAL_BUCKETS)
+elections_started = metrics.counter('chat_elections_total', 'Von diesem Server gestartete Wahlen')
+election_duration = metrics.histogram('chat_election_duration_seconds', 'Dauer vom Start einer Wahl bis zum Ergebnis')
+election_started_at = None
+metrics.counter('chat_send_failures_total', 'Fehlgeschlagene Verbindungsaufbauten und Schreibvorgänge', lambda: connection_pool.failures)
+metrics.counter('chat_fanout_dropped_total', 'Wegen voller Warteschlange verworfene Nachrichten', lambda: fanout.dropped if fanout else 0)
+metrics.gauge('chat_fanout_queue_bytes', 'Wartende Bytes in den Warteschlangen aller Clients', lambda: fanout.queued_bytes() if fanout else 0)
+metrics.counter('chat_worker_messages_sent_total', 'Von den Worker-Prozessen an ihre Clients verteilte Nachrichten', lambda: worker_hub.sent if worker_hub else 0)
+metrics.gauge('chat_workers', 'Verbundene Worker-Prozesse', lambda: len(worker_hub.links) if worker_hub else 0)
+metrics.gauge('chat_fanout_batch_messages', 'Nachrichten im aktuellen Sammelfenster', lambda: len(fanout.batch) if fanout else 0)
+for kind in ('server', 'client'):
+    metrics.gauge('chat_members', 'Bekannte Mitglieder', lambda kind=kind: registry.count(kind), kind=kind)
+metrics.gauge('chat_rooms', 'Räume mit mindestens einem Mitglied', lambda: registry.room_count())
+metrics.gauge('chat_membership_version', 'Version der Mitgliedschaft', lambda: membership_log.version)
+metrics.gauge('chat_message_seq', 'Höchste Sequenznummer im Nachrichtenlog', lambda: message_log.last_seq)
+seq_conflicts = metrics.counter('chat_seq_conflicts_total', 'Replizierte Nachrichten, deren Sequenznummer hier bereits anders belegt ist')
+
+# Journal auf der Platte, wird in open_journal() erstellt
+message_journal = None
+metrics.counter('chat_journal_syncs_total', 'fsync-Aufrufe des Journals', lambda: journal_stat('syncs'), journal='messages')
+metrics.counter('chat_journal_written_bytes_total', 'In das Journal geschriebene Bytes', lambda: journal_stat('bytes_written'), journal='messages')
+metrics.counter('chat_trace_spans_total', 'Geschriebene Spans verfolgter Nachrichten', lambda: tracer.spans if tracer else 0)
+metrics.gauge('chat_is_leader', '1, wenn dieser Server der Führer ist', lambda: int(is_leader))
+for reason in ('rate', 'budget'):
+    metrics.counter('chat_admission_rejected_total', 'Abgewiesene Chat-Nachrichten', lambda reason=reason: admission.rejected[reason] if admission else 0, reason=reason)
+metrics.counter('chat_backpressure_signals_total', 'An Clients gesendete #Backpressure#-Signale', lambda: admission.signals if admission else 0)
+metrics.gauge('chat_load', 'Belegter Anteil des Budgets für wartende Bytes (ohne die Last des Führers)', lambda: admission.load(remote=False) if admission else 0.0)
+joins_redirected = metrics.counter('chat_joins_redirected_total', 'Neue Clients, die wegen Überlast an einen anderen Server verwiesen wurden')
+joins_shed = metrics.counter('chat_joins_shed_total', 'Neue Clients, die wegen Überlast abgewiesen wurden')
+
+# Führer: Server-ID -> True, wenn der Follower Überlast gemeldet hat. Follower: zuletzt gemeldeter Stand (Führer, Überlast).
+server_loads = {}
+last_load_report = None
 
-# Hauptfunktion zum Starten mehrerer Threads
-def main():
+# Zuordnung der Clients zu Servern im Modus 'hash'
+partitioner = ClientPartitioner()
+last_rejoin_request = 0
+
+# Nur im asyncio-Modus gesetzt
+event_loop = None
+election_transport = None
+# Verbindung zu den übrigen Prozessen dieses Servers, nur mit WORKERS > 1
+worker_hub = None
+
+def create_server_sockets():
+    global server_socket, server_address, election_socket, server_info
+    server_socket = create_tcp_socket_with_port(SERVER_PORT)
+    server_address = server_socket.getsockname()
+    election_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    election_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    election_socket.bind((server_address[0], server_address[1]))
+    server_info = {'server_id': server_id, 'server_address': server_address}
+
+# Hauptfunktion zum Starten mehrerer Threads bzw. der Ereignisschleife
+def main(mode='threads'):
+    global fanout, election, admission, discovery_cache, tracer
+    configure_logging(LOG_LEVEL, LOG_MAX_RATE)
+    configure_compression(COMPRESSION_MIN_BYTES)
+    discovery_cache = DiscoveryCache(cache_path(DISCOVERY_CACHE_DIR, 'server', BROADCAST_PORT))
+    admission = AdmissionControl(queued_bytes, CLIENT_RATE, CLIENT_BURST, INFLIGHT_BUDGET)
+    if METRICS_PORT is not None:
+        start_metrics_server(metrics, METRICS_PORT)
+    if JOURNAL_DIR is not None:
+        open_journal()
+    create_server_sockets()
+    if TRACE_FILE is not None:
+        tracer = TraceCollector(TRACE_FILE, f'Server {server_address[0]}:{server_address[1]}')
+    election = create_election(ELECTION_ALGORITHM, server_info, registry, send_election_message, handle_leader_elected, election_address)
+    if mode == 'asyncio':
+        asyncio.run(async_main())
+        return
+
+    fanout = FanoutEngine(connection_pool, policy=SLOW_CONSUMER_POLICY, buffer_bytes=SLOW_CONSUMER_BUFFER, on_failure=remove_node_with_address,
+                          batch_delay=BATCH_WINDOW, batch_messages=BATCH_MESSAGES, on_sent=fanout_latency.observe)
     start_thread(broadcast_listener, True)
     start_thread(tcp_listener, False)
     start_thread(leader_election, True)
@@ -127,256 +361,933 @@ def main():
     start_thread(heartbeat_listener, True)
     start_thread(heartbeat_sender, True)
 
-def start_thread(target, daemon):
-    t = threading.Thread(target=target)
+# Wartende Bytes dieses Prozesses und die zuletzt gemeldeten der Worker
+def queued_bytes():
+    queued = fanout.queued_bytes() if fanout else 0
+    return queued + worker_hub.queued_bytes() if worker_hub else queued
+
+def start_thread(target, daemon, args=()):
+    t = threading.Thread(target=target, args=args)
     t.daemon = daemon
     t.start()
 
+def discovery_targets():
+    targets = [(BROADCAST_IP, BROADCAST_PORT)]
+    if DISCOVERY_GROUP:
+        targets.insert(0, (DISCOVERY_GROUP, BROADCAST_PORT))
+    return targets
+
 def discover_servers():
-    broadcast_socket = create_broadcast_socket(timeout=1)
+    broadcast_socket = create_broadcast_socket()
     got_response = False
+    message = json.dumps({'sending_id': BROADCAST_SEND_ID, 'node_type': 'server', 'sender': server_info}).encode()
+    # Zuerst die zuletzt bekannten Server direkt, danach Multicast-Gruppe und Broadcast
+    attempts = [(discovery_cache.addresses(exclude=tuple(server_address)), PROBE_TIMEOUT)]
+    attempts += [(attempts[0][0] + discovery_targets(), SERVER_DISCOVERY_TIMEOUT)] * SERVER_DISCOVERY_ATTEMPTS
 
-    for _ in range(SERVER_DISCOVERY_ATTEMPTS):
-        message = {'sending_id': BROADCAST_SEND_ID, 'node_type': 'server', 'sender': server_info}
-        broadcast_socket.sendto(json.dumps(message).encode(), (BROADCAST_IP, BROADCAST_PORT))
-        print("Suche nach anderen Servern...")
-        try:
-            data, address = broadcast_socket.recvfrom(BUFFER_SIZE)
-            response = decode_message(data)
-        except TimeoutError:
-            pass
-        else:
-            if 'response_id' in response and address[0] != server_address[0] and response['response_id'] == BROADCAST_RESPONSE_ID:
-                print(f'Server gefunden bei {response["server"]["server_address"][0]}:{response["server"]["server_address"][1]}')
-                reset_server_list(response['server_list'])
-                print(f'Aktualisierte Serverliste: {servers}')
-                try:
-                    send_message_to_server('#Joining#', (response['server']['server_address'][0], response['server']['server_address'][1]))
-                except (ConnectionRefusedError, TimeoutError):
-                    print('Fehler beim Beitreten zu den Servern! \r')
-                else:
-                    print('Servern beigetreten!')
-                    neighbour = get_neighbour(servers, server_info, 'left')
-                    print('Neue Führungswahl gestartet')
-                    start_leader_election(server_info, neighbour)
-                    got_response = True
-                    break
+    for targets, timeout in attempts:
+        if not targets:
+            continue
+        logger.info('Suche nach anderen Servern...')
+        response = request_discovery(broadcast_socket, message, targets, timeout, BROADCAST_RESPONSE_ID,
+                                     lambda response: response['server']['server_id'] != server_id)
+        if response is not None:
+            logger.info('Server gefunden bei %s:%s', *response['server']['server_address'])
+            registry.reset(response['server_list'], registry.client_list(), room_list=registry.room_list())
+            logger.info('Aktualisierte Serverliste: %s', registry.server_list())
+            try:
+                send_message_to_server('#Joining#', (response['server']['server_address'][0], response['server']['server_address'][1]))
+            except OSError:
+                logger.error('Fehler beim Beitreten zu den Servern!')
+            else:
+                logger.info('Servern beigetreten!')
+                logger.info('Neue Führungswahl gestartet')
+                start_election()
+                got_response = True
+                break
     broadcast_socket.close()
     if not got_response:
-        print('Keine anderen Server gefunden, setze mich als Führer')
+        logger.info('Keine anderen Server gefunden, setze mich als Führer')
         set_as_leader(True)
         set_leader_info(server_info)
-        append_to_server_list(server_info)
+        registry.join('server', server_info)
 
 def broadcast_listener():
-    print(f'Server läuft bei {server_address} und hört auf Port {BROADCAST_PORT}')
+    logger.info('Server läuft bei %s und hört auf Port %s', server_address, BROADCAST_PORT)
 
-    listener_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    listener_socket.bind(('', BROADCAST_PORT))
-    listener_socket.settimeout(2)
+    listener_socket = create_broadcast_listen_socket(timeout=2)
 
     while is_running:
         try:
-            data, address = listener_socket.recvfrom(BUFFER_SIZE)
+            data, address = listener_socket.recvfrom(MAX_DATAGRAM_SIZE)
         except TimeoutError:
             pass
         else:
-            message = decode_message(data)
-            if is_leader and 'sending_id' in message and address != server_address and message['sending_id'] == BROADCAST_SEND_ID:
-                print(f'Broadcast von {address[0]} erhalten, antworte mit Antwort-ID, IP und Port')
-                if message['node_type'] == 'server':
-                    append_to_server_list(message['sender'])
-                response = {'response_id': BROADCAST_RESPONSE_ID, 'server': server_info, 'server_list': servers}
-                listener_socket.sendto(json.dumps(response).encode(), address)
-    print('Broadcast Listener schließt')
+            response = handle_datagram(handle_broadcast, data, address)
+            if response:
+                listener_socket.sendto(response, address)
+    logger.info('Broadcast Listener schließt')
     listener_socket.close()
 
+# Beantwortet eine Broadcast-Anfrage; liefert die Antwort oder None
+def handle_broadcast(data, address):
+    message = decode_message(data)
+    if is_leader and 'sending_id' in message and message['sender'].get('server_id') != server_id and message['sending_id'] == BROADCAST_SEND_ID:
+        logger.debug('Broadcast von %s erhalten, antworte mit Antwort-ID, IP und Port', address[0])
+        if message['node_type'] == 'server':
+            registry.join('server', message['sender'])
+        response = {'response_id': BROADCAST_RESPONSE_ID, 'server': server_info, 'server_list': registry.server_list(), 'codecs': list(CODECS)}
+        if message['node_type'] == 'client':
+            target = client_server(message['sender']['client_id'])
+            if target is None:
+                joins_shed.inc()
+                logger.warning('Überlastet, Client %s soll es in %s s erneut versuchen', message['sender']['client_id'], JOIN_RETRY_AFTER)
+                return json.dumps({'response_id': BROADCAST_RESPONSE_ID, 'retry_after': JOIN_RETRY_AFTER}).encode()
+            response['server'] = target
+        return json.dumps(response).encode()
+    return None
+
+# Server für einen neuen Client: der Führer bzw. im Modus 'hash' der Server, dem seine ID zugeordnet ist. Ist dieser
+# überlastet, übernimmt im Modus 'hash' der nach dem Hash-Ring zuständige unter den übrigen Servern (der Client hat eine
+# Sitzung und wird dort bedient, wo sie besteht). None, wenn kein Server infrage kommt.
+def client_server(client_id):
+    if CLIENT_PLACEMENT != 'hash':
+        return None if admission.overloaded() else server_info
+    owner = registry.get('server', client_owner(client_id))
+    if owner is None:
+        return server_info
+    if not server_overloaded(owner.node_id):
+        return owner.info
+    available = [node_id for node_id in registry.server_ids() if not server_overloaded(node_id)]
+    if not available:
+        return None
+    joins_redirected.inc()
+    return registry.get('server', HashRing(available).owner(client_id)).info
+
+def server_overloaded(node_id):
+    if node_id == server_id:
+        return admission.overloaded(remote=False)
+    return server_loads.get(node_id, False)
+
 def heartbeat_sender():
     i = 0
+    # Ein langlebiger Socket für alle Heartbeats
+    heartbeat_send_socket = create_heartbeat_send_socket()
+    heartbeat_target = (BROADCAST_IP, HEARTBEAT_LISTEN_PORT)
     while is_running:
-        heartbeat_send_socket = create_heartbeat_send_socket()
+        time.sleep(HEARTBEAT_INTERVAL)
         if is_leader:
-            message = encode_heartbeat_message('server', server_info, 'for heartbeat', servers, clients)
-            heartbeat_target = (BROADCAST_IP, HEARTBEAT_LISTEN_PORT)
+            check_log_sync()
             if i % HEARTBEAT_PRINT_INTERVAL == 0:
-                print(f'Heartbeat gesendet an {heartbeat_target} {i} Mal')
-            time.sleep(1)
-            heartbeat_send_socket.sendto(message, heartbeat_target)
+                logger.debug('Heartbeat gesendet an %s %s Mal', heartbeat_target, i)
+            for datagram in split_datagram(build_heartbeat_message()):
+                heartbeat_send_socket.sendto(datagram, heartbeat_target)
             i += 1
-        heartbeat_send_socket.close()
+    heartbeat_send_socket.close()
+
+def build_heartbeat_message():
+    version = membership_log.version
+    base_version = heartbeat_versions[0] if heartbeat_versions else version
+    deltas = membership_log.deltas_between(base_version, version)
+    if deltas is None:
+        # Historie reicht nicht zurück, Follower müssen einen Snapshot anfordern
+        base_version, deltas = version, []
+    heartbeat_versions.append(version)
+    return encode_heartbeat_message('server', server_info, 'for heartbeat', version, base_version, deltas, message_log.last_seq,
+                                    round(admission.load(remote=False), 3))
 
 def heartbeat_listener():
-    f = 0
+    # Der Socket bleibt über die gesamte Laufzeit gebunden, der Timeout bestimmt nur, wie oft geprüft wird
+    heartbeat_listen_socket = create_heartbeat_listen_socket(HEARTBEAT_LISTEN_PORT, timeout=HEARTBEAT_INTERVAL)
     while is_running:
-        heartbeat_listen_socket = create_heartbeat_listen_socket(HEARTBEAT_LISTEN_PORT, timeout=3)
-        if not is_leader:
-            missed_heartbeats = 0
-            for _ in range(HEARTBEAT_ATTEMPTS):
-                try:
-                    data, address = heartbeat_listen_socket.recvfrom(BUFFER_SIZE)
-                    if data:
-                        f += 1
-                        missed_heartbeats = 0
-                        message = decode_message(data)
-                        reset_server_list(message['server_list'])
-                        reset_client_list(message['client_list'])
-                        set_leader_info(message['sender'])
-                        if f % HEARTBEAT_PRINT_INTERVAL == 0:
-                            print(f'Heartbeat empfangen {f} Mal')
-                except TimeoutError:
-                    missed_heartbeats += 1
-                    if missed_heartbeats == HEARTBEAT_MISSES_MAX:
-                        print(f'{missed_heartbeats} Heartbeats vom Führer verpasst! Starte Wahl!')
-                        try:
-                            remove_from_server_list(leader_info)
-                        except:
-                            pass
-                        neighbour = get_neighbour(servers, server_info, 'left')
-                        start_leader_election(server_info, neighbour)
-                        time.sleep(3)
-                        break
-        heartbeat_listen_socket.close()
-
-def send_message_to_server(message_content, target_address):
-    try:
-        send_tcp_message(target_address, encode_message('server', server_info, message_content))
-    except (ConnectionRefusedError, TimeoutError):
-        print('\rFehler beim Senden der Nachricht, Server ist nicht erreichbar')
-
-def leader_election():
-    while True:
-        data, address = election_socket.recvfrom(BUFFER_SIZE)
-        if data:
-            neighbour = get_neighbour(servers, server_info, 'left')
-            neighbour = (neighbour['server_address'][0], SERVER_ELECTION_PORT)
-            election_message = json.loads(data.decode())
-            mid = election_message['mid'].get('server_id')
-
-            if mid > server_id:
-                election_socket.sendto(json.dumps(election_message).encode(), neighbour)
-            elif mid == server_id and is_participant:
-                new_election_message = {"mid": server_info, "isLeader": True}
-                election_socket.sendto(json.dumps(new_election_message).encode(), neighbour)
-            elif mid < server_id and not is_participant:
-                new_election_message = {"mid": server_info, "isLeader": False}
-                election_socket.sendto(json.dumps(new_election_message).encode(), neighbour)
-            set_participant(True)
-
-            if election_message['isLeader']:
-                set_leader_info(election_message['mid'])
-                if server_id != mid:
-                    set_as_leader(False)
-                    election_socket.sendto(json.dumps(election_message).encode(), neighbour)
-                else:
-                    set_as_leader(True)
-                set_participant(False)
-
-def get_neighbour(ring, current_node, direction):
-    current_index = next((index for (index, d) in enumerate(ring) if d["server_id"] == current_node["server_id"]), None)
-    if current_index != -1:
-        if direction == 'left':
-            if current_index + 1 == len(ring):
-                return ring[0]
-            else:
-                return ring[current_index + 1]
+        try:
+            data, address = heartbeat_listen_socket.recvfrom(MAX_DATAGRAM_SIZE)
+        except TimeoutError:
+            pass
         else:
-            if current_index == 0:
-                return ring[len(ring) - 1]
-            else:
-                return ring[current_index - 1]
+            handle_datagram(receive_heartbeat, data, address)
+        check_leader_liveness()
+    heartbeat_listen_socket.close()
+
+def receive_heartbeat(data, address):
+    data = heartbeat_assembler.feed(data, address)
+    if data and not is_leader:
+        handle_heartbeat(data)
+
+def handle_heartbeat(data):
+    global last_heartbeat_time, heartbeat_count, leader_detector
+    previous_heartbeat_time = last_heartbeat_time
+    last_heartbeat_time = time.monotonic()
+    heartbeat_count += 1
+    message = decode_message(data)
+    if leader_info is None or leader_detector is None or leader_info['server_id'] != message['sender']['server_id']:
+        leader_detector = PhiAccrualDetector(HEARTBEAT_INTERVAL)
     else:
-        return None
+        heartbeat_interval.observe(last_heartbeat_time - previous_heartbeat_time)
+    leader_detector.heartbeat(last_heartbeat_time)
+    set_leader_info(message['sender'])
+    apply_membership_deltas(message)
+    check_message_log(message)
+    check_own_membership(message)
+    admission.remote_load = message.get('load', 0.0)
+    report_load(message['sender'])
+    if heartbeat_count % HEARTBEAT_PRINT_INTERVAL == 0:
+        logger.debug('Heartbeat empfangen %s Mal', heartbeat_count)
 
-def start_leader_election(server_info, neighbour_info):
-    election_message = {"mid": server_info, "isLeader": False}
-    neighbour = (neighbour_info['server_address'][0], SERVER_ELECTION_PORT)
-    election_socket.sendto(json.dumps(election_message).encode(), neighbour)
-    set_participant(True)
-    print(str(server_info) + " ist der Führer")
+# Übernimmt die Änderungen aus einem Heartbeat oder fordert bei einer Lücke einen Snapshot an
+def apply_membership_deltas(message):
+    version = membership_log.version
+    if membership_source != message['sender']['server_id'] or not message['base_version'] <= version <= message['version']:
+        request_membership_snapshot(message['sender'])
+        return
+    for change_version, op, kind, node in message['deltas']:
+        if change_version > version:
+            registry.apply(op, kind, node)
+    membership_log.set_version(message['version'])
 
-def message_all_servers(message):
-    print(f'Server: {servers}')
-    for server in servers:
+def request_membership_snapshot(leader):
+    global last_snapshot_request
+    # Höchstens eine offene Anfrage pro Heartbeat-Timeout
+    if time.monotonic() - last_snapshot_request < HEARTBEAT_TIMEOUT:
+        return
+    last_snapshot_request = time.monotonic()
+    logger.info('Lücke in der Mitgliedschaft erkannt, fordere Snapshot an')
+    send_message_to_server('#Snapshot#', tuple(leader['server_address']))
+
+def apply_membership_snapshot(message):
+    global membership_source, last_snapshot_request
+    registry.reset(message['server_list'], message['client_list'], message['version'], message.get('rooms'))
+    membership_source = message['sender']['server_id']
+    last_snapshot_request = 0
+
+# Fordert fehlende Chat-Nachrichten beim Führer an, falls der Heartbeat eine höhere Sequenznummer meldet
+def check_message_log(message):
+    global last_replay_request
+    contiguous_seq = message_log.contiguous_seq
+    if message.get('seq', 0) <= contiguous_seq or time.monotonic() - last_replay_request < MESSAGE_REPLAY_INTERVAL:
+        return
+    last_replay_request = time.monotonic()
+    logger.info('Chat-Nachrichten nach %s fehlen, fordere Wiederholung an', contiguous_seq)
+    send_message_to_server('#Replay#', tuple(message['sender']['server_address']), {'last_seq': contiguous_seq})
+
+# Der Führer entfernt Server, die er nicht erreicht; ein Server, der noch läuft, meldet sich wieder an
+def check_own_membership(message):
+    global last_rejoin_request
+    if membership_source != message['sender']['server_id'] or registry.contains('server', server_id):
+        return
+    if time.monotonic() - last_rejoin_request < HEARTBEAT_TIMEOUT:
+        return
+    last_rejoin_request = time.monotonic()
+    logger.info('Nicht mehr in der Serverliste des Führers, melde mich erneut an')
+    send_message_to_server('#Joining#', tuple(message['sender']['server_address']))
+
+# Follower melden dem Führer, sobald sie überlastet sind oder es nicht mehr sind; er verweist neue Clients dann an andere Server
+def report_load(leader):
+    global last_load_report
+    report = (leader['server_id'], admission.overloaded(remote=False))
+    if report == last_load_report:
+        return
+    last_load_report = report
+    send_message_to_server('#Load#', tuple(leader['server_address']), {'overloaded': report[1]})
+
+# Wird regelmäßig aufgerufen; startet eine Wahl, sobald der Führer als ausgefallen gilt
+def check_leader_liveness():
+    global leader_detector, last_failover_time
+    if is_leader:
+        return
+    now = time.monotonic()
+    if leader_detector is not None:
+        phi = leader_detector.phi(now)
+        if phi < LEADER_PHI_THRESHOLD:
+            return
+        reason = f'phi = {phi:.1f}'
+    elif now - max(last_heartbeat_time, last_failover_time) > HEARTBEAT_TIMEOUT:
+        reason = f'seit {HEARTBEAT_TIMEOUT} s kein Heartbeat'
+    else:
+        return
+    # Erst die Heartbeats des neuen Führers füttern wieder einen Detektor
+    leader_detector = None
+    last_failover_time = now
+    handle_leader_failure(reason)
+
+def handle_leader_failure(reason):
+    logger.warning('Führer ausgefallen (%s)! Starte Wahl!', reason)
+    if leader_info is not None:
+        registry.leave('server', leader_info['server_id'])
+    start_election()
+
+def start_election():
+    global election_started_at
+    elections_started.inc()
+    election_started_at = time.monotonic()
+    election.start()
+
+def send_message_to_server(message_content, target_address, extra=None):
+    try:
+        send_tcp_message(target_address, encode_message('server', server_info, message_content, extra=extra))
+    except OSError:
+        logger.warning('Fehler beim Senden der Nachricht, Server %s ist nicht erreichbar', target_address)
+
+def leader_election():
+    # Kurzer Timeout, damit Wiederholungen und Fristen des Wahlverfahrens rechtzeitig geprüft werden
+    election_socket.settimeout(ELECTION_TICK)
+    while is_running:
         try:
-            send_tcp_message(tuple(server['server_address']), message)
-        except (ConnectionRefusedError, TimeoutError):
-            print(f'Kann nicht an {server} senden')
-            clients.remove(server)
+            data, address = election_socket.recvfrom(MAX_DATAGRAM_SIZE)
+        except TimeoutError:
+            pass
+        else:
+            if data:
+                response = handle_datagram(handle_election_message, data, address)
+                if response:
+                    election_socket.sendto(response, address)
+        election.tick()
 
-def reset_server_list(server_list):
-    global servers
-    servers = server_list
+# Auf dem Wahl-Socket treffen auch direkte Anfragen der Servererkennung an zuletzt bekannte Server ein;
+# liefert dafür die Antwort
+def handle_election_message(data, address):
+    message = decode_message(data)
+    if 'sending_id' in message:
+        return handle_broadcast(data, address)
+    election.handle(message)
+    return None
 
-def set_participant(p):
-    global is_participant
-    is_participant = p
+def handle_leader_elected(leader):
+    global election_started_at
+    if election_started_at is not None:
+        election_duration.observe(time.monotonic() - election_started_at)
+        election_started_at = None
+    set_leader_info(leader)
+    set_as_leader(leader['server_id'] == server_id)
+    if CLIENT_PLACEMENT == 'hash':
+        resend_unsequenced_relays()
 
-def remove_from_server_list(server_info):
-    global servers
-    servers.remove(server_info)
+def election_address(info):
+    return tuple(info['server_address'])
 
-def reset_client_list(client_list):
-    global clients
-    clients = client_list
+def send_election_message(election_message, neighbour):
+    data = get_codec(SERVER_CODEC).encode(election_message)
+    if election_transport is None:
+        election_socket.sendto(data, neighbour)
+    else:
+        # UDP-Transporte von asyncio sind nicht threadsicher (die Servererkennung läuft in einem Executor)
+        event_loop.call_soon_threadsafe(election_transport.sendto, data, neighbour)
 
-def append_to_server_list(server_info):
-    global servers
-    servers.append(server_info)
+# Repliziert über die Warteschlangen der Fan-out-Engine: der Aufrufer hält sequence_lock nur für das Einreihen,
+# und für Server gilt dieselbe Grenze für langsame Empfänger wie für Clients. Ein verworfener Frame fällt dem
+# Follower als Lücke auf (check_message_log), ein nicht erreichbarer Server landet in remove_node_with_address.
+def message_all_servers(message):
+    addresses = [tuple(server['server_address']) for server in registry.server_list() if server['server_id'] != server_id]
+    logger.debug('Server: %s', addresses)
+    if addresses:
+        fanout.publish(addresses, message)
 
-def append_to_client_list(client_info):
-    global clients
-    clients.append(client_info)
+# Nur der Führer versioniert das Verlassen; ein Follower entfernt den Client bei sich und meldet es dem Führer,
+# sonst führt ihn dessen Stand weiter und verteilt ihn erneut an alle Server
+def remove_client_with_address(address):
+    if fanout is not None:
+        fanout.forget(address)
+    client = registry.leave_address('client', address, record=is_leader)
+    if client is not None and not is_leader and leader_info is not None:
+        send_message_to_server('#ClientLeft#', tuple(leader_info['server_address']), {'client_id': client['client_id']})
 
-def get_server_ip():
-    global server_info
-    return server_info['server_address'][0]
+# Verbindungsfehler von Fan-out und (im Modus asyncio) Verbindungspool landen hier: der Führer entfernt einen
+# nicht erreichbaren Server, im Modus 'hash' übernehmen die übrigen Server seine Clients
+def remove_node_with_address(address):
+    server = registry.by_address('server', address)
+    if server is None:
+        remove_client_with_address(address)
+    elif is_leader:
+        logger.warning('Kann nicht an %s senden', server.info)
+        registry.leave('server', server.node_id)
+        skip_log_sync(server.node_id)
 
 def tcp_listener():
     server_socket.settimeout(2)
     while is_running:
         try:
             client, address = server_socket.accept()
-            message = decode_message(client.recv(BUFFER_SIZE))
-            print(message)
-            if message['content'] == '#Joining#':
-                match message['node_type']:
-                    case 'client':
-                        if not next((index for (index, d) in enumerate(clients) if d == message['sender']), False):
-                            append_to_client_list(message['sender'])
-                        message_all_clients(encode_message('server', server_info, message))
-                        print('Aktualisierte Client-Liste: \r')
-                        print(clients)
-                    case 'server':
-                        pass
-                        servers.append(message['sender'])
-                        print('Aktualisierte Server-Liste\r')
-                        print(servers)
-            elif message['content'] == '#Leaving#':
-                message_all_clients(encode_message('server', server_info, message))
-            else:
-                message_all_clients(encode_message('server', server_info, message))
         except TimeoutError:
             continue
+        start_thread(connection_handler, True, (client,))
 
-    print('TCP Listener schließt')
+    logger.info('TCP Listener schließt')
     server_socket.close()
 
-def message_all_clients(message):
-    print(f'Clients: {clients}')
-    for client in clients:
+# Liest nacheinander alle Nachrichten einer langlebigen Verbindung
+def connection_handler(connection):
+    connection.settimeout(None)
+    session = ClientSession(connection)
+    try:
+        with connection:
+            for data in FrameReader(connection):
+                if not is_running:
+                    break
+                for payload in split_batch(data):
+                    handle_payload(payload, session)
+    except (OSError, ValueError, struct.error):
+        pass
+    finally:
+        close_session(session)
+
+# Verbindung, die ein Client beim Beitritt aufgebaut hat: der Server schickt ihm seine Nachrichten über dieselbe
+# Verbindung, statt selbst eine Verbindung zur Adresse des Clients aufzubauen
+class ClientSession:
+    def __init__(self, sock):
+        self.channel = sock
+        self.address = None
+        self.client_id = None
+
+def attach_session(session, client):
+    address = tuple(client['client_address'])
+    session.client_id = client['client_id']
+    if session.address != address:
+        session.address = address
+        connection_pool.attach(address, session.channel)
+
+# Der Client ist gegangen oder hat den Server gewechselt
+def close_session(session):
+    if session.client_id is not None:
+        admission.forget(session.client_id)
+    if session.address is not None and connection_pool.detach(session.address, session.channel):
+        remove_client_with_address(session.address)
+
+# Einen Client mit Sitzung bedient der Server, bei dem die Sitzung besteht, alle anderen Clients der zuständige Server
+def serves_client(member):
+    if member.info.get('session'):
+        return connection_pool.has(member.address)
+    return owns_client(member.node_id)
+
+def handle_message(message, session=None):
+    messages_received[message['node_type']].inc()
+    logger.debug('%s', message)
+    trace_of(message, 'server.receive')
+    if session is not None and message.get('session'):
+        if CLIENT_PLACEMENT == 'leader' and not is_leader:
+            # Die Servererkennung hat noch auf uns gezeigt; der Client sucht erneut nach dem Führer
+            session.channel.close()
+            return
+        attach_session(session, message['sender'])
+    if session is not None and session.address is not None and 'client_seq' in message and not admit_client_message(message, session):
+        return
+    if message['node_type'] == 'server' and 'seq' in message:
+        # Vom Führer replizierte Chat-Nachricht, im Modus 'hash' an die eigenen Clients verteilen
+        with sequence_lock:
+            if message_log.conflicts_with(message['seq'], message['content']):
+                seq_conflicts.inc()
+                logger.warning('Sequenznummer %s ist bereits mit einer anderen Nachricht belegt', message['seq'])
+            added = message_log.add(message['seq'], message['content'])
+            unsequenced_relays.pop(relay_key(message['content']), None)
+            if added:
+                journal_message(message['seq'], message['content'])
+            if added and CLIENT_PLACEMENT == 'hash':
+                message_all_clients(build_message('server', server_info, message['content']) | {'seq': message['seq']}, message_room(message['content']))
+    elif message['content'] in ('#Joining#', '#Leaving#') and message['node_type'] == 'client' and message_room(message) != DEFAULT_ROOM:
+        change_room(message)
+    elif message['content'] == '#Joining#':
+        match message['node_type']:
+            case 'client':
+                client_id = message['sender']['client_id']
+                with sequence_lock:
+                    # Nur der Führer versioniert Mitgliedschaftsänderungen, die übrigen Server erhalten sie per Heartbeat
+                    registry.join('client', message['sender'], record=is_leader)
+                    # Ein Client, der sich erneut anmeldet, bringt seine Räume mit (z.B. nach einem Neustart des Clusters)
+                    for room in message.get('rooms', ()):
+                        registry.subscribe(room, client_id, record=is_leader)
+                    member = registry.get('client', client_id)
+                    serves = member is not None and serves_client(member)
+                    if serves:
+                        registry.set_codec('client', client_id, negotiate_codec(message.get('codecs')))
+                if serves and 'last_seq' in message:
+                    # Die eigene Beitrittsnachricht erst nach den Wiederholungen, sonst fordert der Client sie doppelt an
+                    replay_messages_soon(message['sender'], message['last_seq'], message.get('since_seq'),
+                                         lambda: dispatch_client_message(message))
+                else:
+                    dispatch_client_message(message)
+                logger.info('Client %s beigetreten, %s Clients', client_id, registry.count('client'))
+                logger.debug('Aktualisierte Client-Liste: %s', registry.client_list())
+            case 'server':
+                pass
+                registry.join('server', message['sender'])
+                logger.info('Aktualisierte Server-Liste: %s', registry.server_list())
+    elif message['content'] == '#Snapshot#':
+        reply = encode_snapshot_message('server', server_info, *registry.snapshot())
+        try:
+            send_tcp_message(tuple(message['sender']['server_address']), reply)
+        except OSError:
+            logger.warning('Kann Snapshot nicht an %s senden', message['sender'])
+    elif message['content'] == '#SnapshotResponse#':
+        apply_membership_snapshot(message)
+    elif message['content'] == '#Replay#':
+        run_history_task(message['last_seq'], send_history, (message,))
+    elif message['content'] == '#ReplayDone#':
+        with sequence_lock:
+            message_log.skip_to(message['last_seq'])
+            log_sync_pending.discard(message['sender']['server_id'])
+            if not log_sync_pending:
+                finish_log_sync()
+    elif message['content'] == '#ClientLeft#':
+        member = registry.get('client', message['client_id'])
+        # Hat sich der Client inzwischen bei uns angemeldet, ist die Meldung überholt
+        if is_leader and member is not None and not connection_pool.has(member.address):
+            registry.leave('client', member.node_id)
+    elif message['content'] == '#Load#':
+        server_loads[message['sender']['server_id']] = message['overloaded']
+        if message['overloaded']:
+            logger.warning('Server %s meldet Überlast', message['sender']['server_id'])
+    elif message['content'] == '#Resume#':
+        # Ein Client hat den Führer gewechselt oder eine Lücke bemerkt
+        replay_messages_soon(message['sender'], message['last_seq'], message.get('since_seq'))
+    else:
+        dispatch_client_message(message)
+
+# Lässt eine Chat-Nachricht, die ein Client über seine Sitzung schickt, nur im Rahmen seines Token-Buckets und des
+# Budgets für wartende Bytes zu. Mit #Backpressure# erfährt der Client, wie lange er pausieren soll; eine abgewiesene
+# Nachricht (client_seq) hält er vor und sendet sie danach erneut.
+def admit_client_message(message, session):
+    admitted, retry_after = admission.admit(message['sender']['client_id'], message['client_seq'])
+    if retry_after is not None and connection_pool.has(session.address):
+        extra = {'retry_after': round(retry_after, 3)}
+        if not admitted:
+            extra['client_seq'] = message['client_seq']
+        member = registry.get('client', message['sender']['client_id'])
+        codec_name = member.codec if member is not None and member.codec else 'json'
+        try:
+            connection_pool.send(session.address, encode_message('server', server_info, '#Backpressure#', codec_name, extra))
+        except OSError:
+            logger.warning('Kann #Backpressure# nicht an %s senden', session.address)
+    return admitted
+
+def message_room(message):
+    room = message.get('room')
+    return room if isinstance(room, str) else DEFAULT_ROOM
+
+# #Joining# bzw. #Leaving# mit 'room' betritt bzw. verlässt einen Raum und wird an dessen Mitglieder verteilt.
+# Der Server des Clients übernimmt die Änderung sofort, damit ihn die eigene Beitrittsnachricht erreicht;
+# versioniert und an die Follower verteilt wird sie vom Führer.
+def change_room(message):
+    room = message_room(message)
+    client_id = message['sender']['client_id']
+    with sequence_lock:
+        if message['content'] == '#Joining#':
+            changed = registry.subscribe(room, client_id, record=is_leader)
+        else:
+            changed = registry.unsubscribe(room, client_id, record=is_leader)
+    if changed or not is_leader:
+        logger.debug('Client %s: %s %s', client_id, message['content'], room)
+        dispatch_client_message(message)
+
+# Im Modus 'hash' vergibt nur der Führer Sequenznummern, die anderen Server leiten Nachrichten ihrer Clients weiter
+def dispatch_client_message(message):
+    if CLIENT_PLACEMENT == 'hash' and not is_leader and leader_info is not None:
+        # Die Sitzung besteht hier, nicht auf der Verbindung zwischen den Servern
+        relayed = {key: value for key, value in message.items() if key != 'session'}
+        if 'client_seq' in relayed:
+            with sequence_lock:
+                unsequenced_relays[relay_key(relayed)] = relayed
+                if len(unsequenced_relays) > MESSAGE_LOG_SIZE:
+                    del unsequenced_relays[next(iter(unsequenced_relays))]
+        try:
+            send_tcp_message(tuple(leader_info['server_address']), get_codec(SERVER_CODEC).encode(relayed))
+        except OSError:
+            logger.warning('Kann Nachricht nicht an den Führer weiterleiten')
+        return
+    with sequence_lock:
+        publish_message(message)
+
+def relay_key(message):
+    return message['sender'].get('client_id'), message.get('client_seq')
+
+# Nach einer Wahl: was der alte Führer nicht mehr repliziert hat, geht an den neuen (der Duplikate verwirft)
+def resend_unsequenced_relays():
+    with sequence_lock:
+        relays = [relayed for (client_id, client_seq), relayed in unsequenced_relays.items()
+                  if not message_log.sequenced(client_id, client_seq)]
+        unsequenced_relays.clear()
+    if relays:
+        logger.info('Sende %s nicht replizierte Nachrichten an den neuen Führer', len(relays))
+    for relayed in relays:
+        dispatch_client_message(relayed)
+
+def client_owner(client_id):
+    partitioner.update(registry.server_ids())
+    return partitioner.owner(client_id)
+
+def owns_client(client_id):
+    return CLIENT_PLACEMENT != 'hash' or client_owner(client_id) == server_id
+
+def encode_sequenced_message(message, seq, codec_name=None):
+    return get_codec(codec_name or SERVER_CODEC).encode(build_message('server', server_info, message) | {'seq': seq})
+
+# Vergibt die globale Sequenznummer, repliziert die Nachricht an die Follower und verteilt sie an die Clients.
+# Muss unter sequence_lock aufgerufen werden.
+def publish_message(message):
+    if log_sync_pending:
+        deferred_messages.append(message)
+        return
+    seq = message_log.append(message)
+    if seq is None:
+        # Vom Client nach einem Verbindungsabbruch wiederholt, wurde bereits verteilt
+        return
+    trace = trace_of(message, 'server.sequenced')
+    journal_message(seq, message)
+    message_all_servers(encode_sequenced_message(message, seq))
+    if trace is not None and tracer is not None:
+        tracer.span('journal + replicate', trace['stamps'][-1][1], timestamp(), trace['id'], 'Server', seq=seq)
+    message_all_clients(build_message('server', server_info, message) | {'seq': seq}, message_room(message))
+
+# Sendet einem Client die vorgehaltenen Nachrichten seiner Räume nach since_seq (ohne Angabe last_seq).
+# last_seq ist die höchste Nummer, die der Client kennt. Läuft ohne sequence_lock: Nachrichten, die währenddessen
+# verteilt werden, ordnet der Client anhand der Sequenznummern ein.
+def replay_messages(client, last_seq, since_seq=None):
+    if last_seq > message_log.last_seq and is_leader:
+        # Der Client kennt höhere Nummern als wir (Führungswechsel): daran anschließen statt Nummern doppelt zu vergeben
+        message_log.skip_to(last_seq)
+    member = registry.get('client', client['client_id'])
+    if member is None or not serves_client(member):
+        return
+    entries = [(seq, entry) for seq, entry in message_history(last_seq if since_seq is None else since_seq)
+               if message_room(entry) == DEFAULT_ROOM or message_room(entry) in member.rooms]
+    if entries:
+        logger.info('Wiederhole %s Nachrichten für %s', len(entries), client['client_id'])
+        messages_sent['client'].inc(len(entries))
+    for seq, entry in entries:
+        fanout.publish([member.address], encode_sequenced_message(entry, seq, member.codec or 'json'))
+
+def replay_messages_soon(client, last_seq, since_seq=None, done=None):
+    run_history_task(last_seq if since_seq is None else since_seq, replay_messages, (client, last_seq, since_seq), done)
+
+# Ein Follower (oder der neue Führer beim Abgleich, siehe start_log_sync) fordert die Nachrichten nach last_seq an
+def send_history(message):
+    for seq, entry in message_history(message['last_seq']):
         try:
-            send_tcp_message(tuple(client['client_address']), message)
-        except (ConnectionRefusedError, TimeoutError):
-            print(f'Kann nicht an {client} senden')
-            clients.remove(client)
+            send_tcp_message(tuple(message['sender']['server_address']), encode_sequenced_message(entry, seq))
+        except OSError:
+            logger.warning('Kann Chat-Nachrichten nicht an %s senden', message['sender'])
+            return
+    if message.get('sync'):
+        # Der neue Führer schließt an die höchste Nummer an, die wir kennen
+        send_message_to_server('#ReplayDone#', tuple(message['sender']['server_address']), {'last_seq': message_log.last_seq})
+
+# Nachrichten nach seq; was nicht mehr im Speicher liegt, wird aus dem Journal gelesen (höchstens ein Fenster
+# des Nachrichtenlogs pro Anfrage, der Client fordert den Rest bei der nächsten Lücke an)
+def message_history(seq):
+    if not history_on_disk(seq):
+        return message_log.since(seq)
+    return [(entry_seq, decode_message(payload)) for entry_seq, payload in message_journal.read(seq, message_log.size)]
+
+def history_on_disk(seq):
+    return message_journal is not None and seq < message_log.last_seq - message_log.size
+
+# Muss die Historie aus dem Journal gelesen werden, läuft das im asyncio-Modus in einem Executor,
+# damit die Ereignisschleife derweil weiterarbeitet; done folgt danach auf der Ereignisschleife
+def run_history_task(seq, function, args, done=None):
+    if event_loop is not None and history_on_disk(seq):
+        future = event_loop.run_in_executor(None, function, *args)
+        if done is not None:
+            future.add_done_callback(lambda _: done())
+        return
+    function(*args)
+    if done is not None:
+        done()
+
+def journal_message(seq, message):
+    if message_journal is not None:
+        message_journal.append(seq, get_codec(SERVER_CODEC).encode(message))
+
+def journal_stat(attribute):
+    return getattr(message_journal, attribute) if message_journal is not None else 0
+
+def open_journal():
+    global message_journal
+    message_journal = Journal(os.path.join(JOURNAL_DIR, 'messages'), sync_delay=JOURNAL_SYNC)
+    recover_from_journal()
+
+# Stellt nach einem Neustart das Fenster des Nachrichtenlogs und damit die Sequenznummern wieder her
+def recover_from_journal():
+    last_seq = message_journal.last_index
+    for seq, payload in message_journal.read(max(0, last_seq - message_log.size)):
+        message_log.add(seq, decode_message(payload))
+    logger.info('Journal: Nachrichten bis %s wiederhergestellt', message_log.last_seq)
+
+# Übergibt die Nachricht nur an die Warteschlangen der Empfänger, das Senden übernimmt die Fan-out-Engine.
+# Nachrichten in einem Raum kosten nur so viel wie der Raum Mitglieder hat.
+# Die Worker erhalten die Nachricht einmal und verteilen sie selbst an ihre Sitzungen.
+def message_all_clients(message, room=DEFAULT_ROOM):
+    # Der Zeitstempel muss vor dem Kodieren stehen, damit ihn die Empfänger erhalten
+    trace = trace_of(message['content'], 'server.fanout')
+    candidates = registry.member_list('client') if room == DEFAULT_ROOM else registry.room_members(room)
+    members = [member for member in candidates if serves_client(member) and not hosted_by_worker(member)]
+    if worker_hub is not None:
+        worker_hub.publish(get_codec(SERVER_CODEC).encode(message), room, SERVER_CODEC)
+    messages_sent['client'].inc(len(members))
+    # Jede Nachricht wird pro Codec nur einmal kodiert; Clients ohne ausgehandelten Codec erhalten JSON
+    recipients = collections.defaultdict(list)
+    for member in members:
+        recipients[member.codec or 'json'].append(member.address)
+    for codec_name, addresses in recipients.items():
+        fanout.publish(addresses, get_codec(codec_name).encode(message))
+    if trace is not None and tracer is not None:
+        tracer.span('message_all_clients', trace['stamps'][-1][1], timestamp(), trace['id'], 'Server', seq=message.get('seq'), recipients=len(members))
+
+def hosted_by_worker(member):
+    if worker_hub is None:
+        return False
+    connection = connection_pool.connections.get(tuple(member.address))
+    return connection is not None and isinstance(connection.transport, WorkerTransport)
+
+# Neuer Führer: fragt bei allen Followern die Nachrichten nach dem eigenen lückenlosen Stand ab und vergibt
+# erst danach (oder nach LOG_SYNC_TIMEOUT) wieder Nummern, damit keine Nummer für zwei Nachrichten steht
+def start_log_sync():
+    global log_sync_deadline
+    followers = [server for server in registry.server_list() if server['server_id'] != server_id]
+    if not followers:
+        return
+    with sequence_lock:
+        log_sync_pending.update(server['server_id'] for server in followers)
+        log_sync_deadline = time.monotonic() + LOG_SYNC_TIMEOUT
+        since_seq = message_log.contiguous_seq
+    for server in followers:
+        try:
+            send_tcp_message(tuple(server['server_address']), encode_message('server', server_info, '#Replay#', extra={'last_seq': since_seq, 'sync': True}))
+        except OSError:
+            logger.warning('Kann Nachrichtenlog nicht mit %s abgleichen', server)
+            skip_log_sync(server['server_id'])
+
+# Ein nicht erreichbarer Server hält den Abgleich nicht auf
+def skip_log_sync(node_id):
+    with sequence_lock:
+        if node_id in log_sync_pending:
+            log_sync_pending.discard(node_id)
+            if not log_sync_pending:
+                finish_log_sync()
+
+# Muss unter sequence_lock aufgerufen werden
+def finish_log_sync():
+    global log_sync_deadline
+    log_sync_pending.clear()
+    log_sync_deadline = None
+    messages = deferred_messages[:]
+    deferred_messages.clear()
+    for message in messages:
+        publish_message(message)
+
+# Wird mit jedem Heartbeat des Führers aufgerufen; Follower, die nicht antworten, halten die Vergabe nicht länger auf
+def check_log_sync():
+    if log_sync_deadline is None or time.monotonic() < log_sync_deadline:
+        return
+    with sequence_lock:
+        if log_sync_pending:
+            logger.warning('Kein Abgleich des Nachrichtenlogs mit %s Servern', len(log_sync_pending))
+        finish_log_sync()
 
 def set_as_leader(is_leader_flag):
-    global is_leader
+    global is_leader, log_sync_deadline
+    if is_leader_flag and not is_leader:
+        start_log_sync()
+        heartbeat_versions.clear()
+        # Die Follower melden ihre Last dem neuen Führer erneut
+        server_loads.clear()
+        admission.remote_load = 0.0
+    was_leader = is_leader
     is_leader = is_leader_flag
+    if was_leader and not is_leader:
+        with sequence_lock:
+            log_sync_pending.clear()
+            log_sync_deadline = None
+            messages = deferred_messages[:]
+            deferred_messages.clear()
+        if CLIENT_PLACEMENT == 'hash':
+            # Die zurückgehaltenen Nachrichten gehen an den neuen Führer; im Modus 'leader' senden die Clients sie erneut
+            for message in messages:
+                dispatch_client_message(message)
+    if was_leader and not is_leader and CLIENT_PLACEMENT == 'leader':
+        # Ein anderer Server hat die Führung übernommen; die Clients finden ihn über die Servererkennung
+        logger.info('Nicht mehr Führer, trenne die Sitzungen der Clients')
+        connection_pool.close_sessions()
 
+# Ein Neustart fragt diese Server zuerst direkt an. Geschrieben wird nur, wenn sich Führer oder Server ändern,
+# nicht bei jedem Heartbeat.
 def set_leader_info(leader_info_param):
-    global leader_info
+    global leader_info, remembered_servers
     leader_info = leader_info_param
+    servers = (leader_info['server_id'], registry.server_ids())
+    if servers != remembered_servers:
+        remembered_servers = servers
+        discovery_cache.remember(leader_info['server_address'], [server['server_address'] for server in registry.server_list()])
+
+# asyncio-Modus: alle UDP-Endpunkte und der TCP-Listener laufen als Protokolle auf einer Ereignisschleife
+class BroadcastProtocol(asyncio.DatagramProtocol):
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        response = handle_datagram(handle_broadcast, data, address)
+        if response:
+            self.transport.sendto(response, address)
+
+class HeartbeatProtocol(asyncio.DatagramProtocol):
+    def datagram_received(self, data, address):
+        handle_datagram(receive_heartbeat, data, address)
+
+class ElectionProtocol(asyncio.DatagramProtocol):
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        response = handle_datagram(handle_election_message, data, address)
+        if response:
+            self.transport.sendto(response, address)
+
+# Jede angenommene Verbindung wird unabhängig von den anderen bedient.
+# asyncio liest direkt in den FrameBuffer, Teilstücke werden dort wieder zusammengesetzt.
+# Das Protokoll dient zugleich als Sitzung (siehe ClientSession).
+class ConnectionProtocol(asyncio.BufferedProtocol):
+    def connection_made(self, transport):
+        self.transport = transport
+        self.channel = transport
+        self.address = None
+        self.client_id = None
+        self.frame_buffer = FrameBuffer()
+
+    def connection_lost(self, exc):
+        close_session(self)
+
+    def get_buffer(self, sizehint):
+        return self.frame_buffer.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.frame_buffer.advance(nbytes)
+        try:
+            for frame in self.frame_buffer.frames():
+                for payload in split_batch(frame):
+                    handle_payload(payload, self)
+        except (ValueError, struct.error):
+            self.transport.close()
+
+async def heartbeat_sender_task(transport):
+    i = 0
+    heartbeat_target = (BROADCAST_IP, HEARTBEAT_LISTEN_PORT)
+    while is_running:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        if is_leader:
+            check_log_sync()
+            if i % HEARTBEAT_PRINT_INTERVAL == 0:
+                logger.debug('Heartbeat gesendet an %s %s Mal', heartbeat_target, i)
+            for datagram in split_datagram(build_heartbeat_message()):
+                transport.sendto(datagram, heartbeat_target)
+            i += 1
+
+async def election_tick_task():
+    while is_running:
+        await asyncio.sleep(ELECTION_TICK)
+        election.tick()
+
+async def heartbeat_monitor_task():
+    while is_running:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        check_leader_liveness()
+
+# Startet die übrigen Prozesse des Servers auf demselben Port. Was sie empfangen, wird wie auf einer eigenen
+# Verbindung behandelt; ihre Sitzungen stehen mit einem WorkerTransport im Verbindungspool.
+async def start_workers(loop):
+    global worker_hub
+    worker_hub = WorkerHub(loop, worker_socket_path(server_address[1]), ClientSession,
+                           handle_payload, close_session)
+    await worker_hub.start()
+    arguments = ['--local-ip', server_address[0], '--port', str(server_address[1]),
+                 '--slow-consumer-policy', SLOW_CONSUMER_POLICY, '--slow-consumer-buffer', str(SLOW_CONSUMER_BUFFER),
+                 '--batch-window', str(BATCH_WINDOW), '--batch-messages', str(BATCH_MESSAGES), '--compression-threshold', str(COMPRESSION_MIN_BYTES),
+                 '--log-level', LOG_LEVEL, '--log-rate', str(LOG_MAX_RATE)]
+    for index in range(1, WORKERS):
+        worker_hub.spawn(index, arguments)
+    logger.info('%s Worker-Prozesse teilen sich Port %s', WORKERS - 1, server_address[1])
+    return loop.create_task(worker_hub.supervise())
+
+async def async_main():
+    global event_loop, election_transport, connection_pool, fanout
+    loop = asyncio.get_running_loop()
+    event_loop = loop
+    # Nicht erreichbare Clients werden entfernt, sobald ihre Verbindung fehlschlägt
+    connection_pool = AsyncConnectionPool(loop, timeout=1, on_failure=remove_node_with_address)
+    fanout = AsyncFanoutEngine(connection_pool, policy=SLOW_CONSUMER_POLICY, buffer_bytes=SLOW_CONSUMER_BUFFER, on_failure=remove_node_with_address,
+                               batch_delay=BATCH_WINDOW, batch_messages=BATCH_MESSAGES, on_sent=fanout_latency.observe)
+
+    logger.info('Server läuft bei %s und hört auf Port %s (asyncio)', server_address, BROADCAST_PORT)
+    await loop.create_datagram_endpoint(BroadcastProtocol, sock=create_broadcast_listen_socket())
+    await loop.create_server(ConnectionProtocol, sock=server_socket)
+    worker_tasks = [await start_workers(loop)] if WORKERS > 1 else []
+    election_transport, _ = await loop.create_datagram_endpoint(ElectionProtocol, sock=election_socket)
+    election_task = loop.create_task(election_tick_task())
+
+    await loop.run_in_executor(None, discover_servers)
+
+    await loop.create_datagram_endpoint(HeartbeatProtocol, sock=create_heartbeat_listen_socket(HEARTBEAT_LISTEN_PORT))
+    heartbeat_transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, sock=create_heartbeat_send_socket())
+    await asyncio.gather(heartbeat_sender_task(heartbeat_transport), heartbeat_monitor_task(), election_task, *worker_tasks)
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=SERVER_MODES, default='threads')
+    parser.add_argument('--local-ip', default=LOCAL_IP, help='Eigene IP-Adresse, z.B. 127.0.0.1 für Tests auf einem Rechner')
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help='TCP-Port des Servers (0 = beliebig)')
+    parser.add_argument('--broadcast-ip', default=BROADCAST_IP)
+    parser.add_argument('--broadcast-port', type=int, default=BROADCAST_PORT)
+    parser.add_argument('--heartbeat-port', type=int, default=HEARTBEAT_LISTEN_PORT)
+    parser.add_argument('--discovery-attempts', type=int, default=SERVER_DISCOVERY_ATTEMPTS)
+    parser.add_argument('--discovery-timeout', type=float, default=SERVER_DISCOVERY_TIMEOUT, help='Wartezeit pro Versuch der Servererkennung in Sekunden')
+    parser.add_argument('--discovery-group', default=DISCOVERY_GROUP, help='Multicast-Gruppe der Servererkennung, leer = nur Broadcast')
+    parser.add_argument('--discovery-cache-dir', default=DISCOVERY_CACHE_DIR, help='Verzeichnis für den zuletzt bekannten Führer, leer = aus')
+    parser.add_argument('--heartbeat-interval', type=float, default=HEARTBEAT_INTERVAL)
+    parser.add_argument('--phi-threshold', type=float, default=LEADER_PHI_THRESHOLD)
+    parser.add_argument('--election', choices=list(ELECTION_ALGORITHMS), default=ELECTION_ALGORITHM)
+    parser.add_argument('--codec', choices=list(CODECS), default=SERVER_CODEC)
+    parser.add_argument('--compression-threshold', type=int, default=COMPRESSION_MIN_BYTES, help='Komprimierende Codecs packen Nachrichten ab so vielen Bytes')
+    parser.add_argument('--client-placement', choices=CLIENT_PLACEMENTS, default=CLIENT_PLACEMENT)
+    parser.add_argument('--slow-consumer-policy', choices=SLOW_CONSUMER_POLICIES, default=SLOW_CONSUMER_POLICY)
+    parser.add_argument('--slow-consumer-buffer', type=int, default=SLOW_CONSUMER_BUFFER)
+    parser.add_argument('--batch-window', type=float, default=BATCH_WINDOW, help='Sammelfenster in Sekunden, 0 = jede Nachricht sofort senden')
+    parser.add_argument('--batch-messages', type=int, default=BATCH_MESSAGES, help='Höchstzahl der Nachrichten pro Sammel-Frame')
+    parser.add_argument('--log-level', choices=list(LOG_LEVELS), default=LOG_LEVEL)
+    parser.add_argument('--log-rate', type=float, default=LOG_MAX_RATE, help='Meldungen pro Sekunde und Aufrufstelle, 0 = unbegrenzt')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT, help='HTTP-Endpunkt für Metriken auf 127.0.0.1')
+    parser.add_argument('--journal-dir', default=JOURNAL_DIR, help='Chat-Nachrichten in diesem Verzeichnis journalisieren')
+    parser.add_argument('--journal-sync', type=float, default=JOURNAL_SYNC, help='Fenster des Gruppen-Commits in Sekunden, 0 = fsync nach jedem Eintrag')
+    parser.add_argument('--client-rate', type=float, default=CLIENT_RATE, help='Chat-Nachrichten pro Sekunde und Client, 0 = unbegrenzt')
+    parser.add_argument('--client-burst', type=int, default=CLIENT_BURST)
+    parser.add_argument('--workers', type=int, default=WORKERS, help='Prozesse, die sich den TCP-Port für Clients teilen (nur asyncio)')
+    parser.add_argument('--trace-file', default=TRACE_FILE, help='Spans verfolgter Nachrichten im Chrome-Trace-Format hier anhängen')
+    parser.add_argument('--inflight-budget', type=int, default=INFLIGHT_BUDGET, help='Höchstens so viele Bytes warten auf die Verteilung an Clients')
+    args = parser.parse_args()
+    if args.workers > 1 and args.mode != 'asyncio':
+        parser.error('--workers setzt --mode asyncio voraus')
+    LOCAL_IP = args.local_ip
+    SERVER_PORT = args.port
+    BROADCAST_IP = args.broadcast_ip
+    BROADCAST_PORT = args.broadcast_port
+    HEARTBEAT_LISTEN_PORT = args.heartbeat_port
+    SERVER_DISCOVERY_ATTEMPTS = args.discovery_attempts
+    SERVER_DISCOVERY_TIMEOUT = args.discovery_timeout
+    DISCOVERY_GROUP = args.discovery_group or None
+    DISCOVERY_CACHE_DIR = args.discovery_cache_dir or None
+    HEARTBEAT_INTERVAL = args.heartbeat_interval
+    LEADER_PHI_THRESHOLD = args.phi_threshold
+    ELECTION_ALGORITHM = args.election
+    SERVER_CODEC = args.codec
+    COMPRESSION_MIN_BYTES = args.compression_threshold
+    CLIENT_PLACEMENT = args.client_placement
+    SLOW_CONSUMER_POLICY = args.slow_consumer_policy
+    SLOW_CONSUMER_BUFFER = args.slow_consumer_buffer
+    BATCH_WINDOW = args.batch_window
+    BATCH_MESSAGES = args.batch_messages
+    LOG_LEVEL = args.log_level
+    LOG_MAX_RATE = args.log_rate
+    METRICS_PORT = args.metrics_port
+    JOURNAL_DIR = args.journal_dir
+    JOURNAL_SYNC = args.journal_sync
+    CLIENT_RATE = args.client_rate
+    CLIENT_BURST = args.client_burst
+    INFLIGHT_BUDGET = args.inflight_budget
+    WORKERS = args.workers
+    TRACE_FILE = args.trace_file
+    main(args.mode)
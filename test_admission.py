@@ -0,0 +1,51 @@
+import pytest
+
+from admission import AdmissionControl, TokenBucket
+
+
+def test_token_bucket_allows_burst_then_refills():
+    bucket = TokenBucket(rate=10, burst=3, now=0.0)
+    assert [bucket.take(0.0) for _ in range(4)] == [True, True, True, False]
+    assert bucket.delay() == pytest.approx(0.1)
+    assert not bucket.take(0.05)
+    assert bucket.take(0.1)
+    # Nach langer Pause höchstens burst Tokens
+    assert [bucket.take(100.0) for _ in range(4)] == [True, True, True, False]
+
+def test_rate_limit_rejects_with_delay():
+    admission = AdmissionControl(lambda: 0, rate=1, burst=1)
+    assert admission.admit('c1', 1) == (True, None)
+    admitted, delay = admission.admit('c1', 2)
+    assert not admitted and 0 < delay <= 1
+    assert admission.rejected['rate'] == 1
+    # Andere Clients haben einen eigenen Token-Bucket
+    assert admission.admit('c2', 1) == (True, None)
+
+def test_later_messages_wait_for_the_rejected_one():
+    admission = AdmissionControl(lambda: 0, rate=1, burst=1)
+    admission.admit('c1', 1)
+    admission.admit('c1', 2)
+    # Während der Pause wird eine spätere Nachricht ohne erneutes Signal abgewiesen
+    assert admission.admit('c1', 3) == (False, None)
+
+def test_budget_rejects_everyone():
+    queued = [0]
+    admission = AdmissionControl(lambda: queued[0], rate=0, budget=100)
+    assert admission.admit('c1', 1) == (True, None)
+    queued[0] = 100
+    admission.load_checked = None
+    admitted, delay = admission.admit('c2', 1)
+    assert not admitted and delay == admission.delay
+    assert admission.rejected['budget'] == 1
+
+def test_overload_signals_backpressure_once_per_pause():
+    admission = AdmissionControl(lambda: 60, rate=0, budget=100, threshold=0.5)
+    assert admission.overloaded()
+    assert admission.admit('c1', 1) == (True, admission.delay)
+    assert admission.admit('c1', 2) == (True, None)
+
+def test_remote_load_counts_for_followers():
+    admission = AdmissionControl(lambda: 0, rate=0, budget=100)
+    admission.remote_load = 0.8
+    assert admission.overloaded()
+    assert not admission.overloaded(remote=False)
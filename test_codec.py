@@ -0,0 +1,69 @@
+import uuid
+
+import pytest
+
+from codec import BINARY_MAGIC, COMPRESSED_MAGIC, CODECS, HEADER, TYPE_JSON, CompressedCodec, decode_auto, get_codec, negotiate_codec
+
+SERVER = {'server_id': str(uuid.uuid4()), 'server_address': ['192.168.178.20', 40000]}
+CLIENT = {'client_id': str(uuid.uuid4()), 'client_address': ['192.168.178.21', 50000]}
+SESSION = CLIENT | {'session': True}
+CHAT = {'node_type': 'client', 'sender': SESSION, 'content': 'Hallo zusammen', 'client_seq': 3, 'room': 'lobby'}
+
+MESSAGES = {
+    'chat': CHAT,
+    'weitergeleitet': {'node_type': 'server', 'sender': SERVER, 'content': CHAT, 'seq': 7},
+    'heartbeat': {'node_type': 'server', 'sender': SERVER, 'content': 'for heartbeat', 'version': 4, 'base_version': 1,
+                  'deltas': [[2, 'join', 'client', SESSION], [3, 'subscribe', 'room', ['lobby', CLIENT['client_id']]],
+                             [4, 'leave', 'server', SERVER]], 'seq': 7, 'load': 0.25},
+    'snapshot': {'node_type': 'server', 'sender': SERVER, 'content': '#SnapshotResponse#', 'version': 9,
+                 'server_list': [SERVER], 'client_list': [CLIENT, SESSION], 'rooms': {'lobby': [CLIENT['client_id']]}},
+    'ring': {'mid': SERVER, 'isLeader': True},
+    'bully': {'election': 'bully', 'type': 'coordinator', 'term': 12, 'sender': SERVER},
+}
+
+
+@pytest.mark.parametrize('codec_name', list(CODECS))
+@pytest.mark.parametrize('message_name', list(MESSAGES))
+def test_round_trip(codec_name, message_name):
+    codec = get_codec(codec_name)
+    message = MESSAGES[message_name]
+    assert codec.decode(codec.encode(message)) == message
+    assert decode_auto(codec.encode(message)) == message
+
+@pytest.mark.parametrize('message_name', ['chat', 'heartbeat', 'snapshot', 'ring', 'bully'])
+def test_binary_layout_is_used(message_name):
+    data = get_codec('binary').encode(MESSAGES[message_name])
+    assert data[0] == BINARY_MAGIC
+    assert data[2] != TYPE_JSON
+
+@pytest.mark.parametrize('message', [
+    # IPv6 und Knoten ohne UUID passen nicht ins Binärformat
+    {'node_type': 'client', 'sender': {'client_id': str(uuid.uuid4()), 'client_address': ['::1', 50000]}, 'content': 'x'},
+    {'node_type': 'client', 'sender': {'client_id': 'kein-uuid', 'client_address': ['127.0.0.1', 50000]}, 'content': 'x'},
+    {'election': 'ring2', 'type': 'answer', 'term': 1, 'sender': SERVER},
+    {'sending_id': 'x', 'node_type': 'client', 'sender': {'client_id': 'x'}},
+])
+def test_binary_falls_back_to_json(message):
+    data = get_codec('binary').encode(message)
+    assert HEADER.unpack_from(data) == (BINARY_MAGIC, 1, TYPE_JSON)
+    assert decode_auto(data) == message
+
+def test_compression_only_above_threshold():
+    codec = CompressedCodec(get_codec('json'), threshold=512)
+    small = CHAT
+    large = CHAT | {'content': 'Hallo zusammen ' * 200}
+    assert codec.encode(small) == get_codec('json').encode(small)
+    data = codec.encode(large)
+    assert data[0] == COMPRESSED_MAGIC
+    assert len(data) < len(get_codec('json').encode(large))
+    assert decode_auto(data) == large
+
+def test_corrupt_compressed_payload_is_rejected():
+    data = CompressedCodec(get_codec('binary'), threshold=0).encode(CHAT | {'content': 'x' * 2000})
+    with pytest.raises(ValueError):
+        decode_auto(data[:len(data) // 2])
+
+def test_negotiate_codec():
+    assert negotiate_codec(['unbekannt', 'binary+zlib', 'json']) == 'binary+zlib'
+    assert negotiate_codec(['unbekannt']) == 'json'
+    assert negotiate_codec(None) == 'json'
@@ -0,0 +1,66 @@
+import os
+
+from journal import RECORD, Journal
+
+
+def open_journal(directory, **kwargs):
+    return Journal(str(directory), sync_delay=0, **kwargs)
+
+def segment_paths(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.seg'))
+
+def test_entries_survive_reopen(tmp_path):
+    journal = open_journal(tmp_path)
+    for seq in range(1, 11):
+        journal.append(seq, f'm{seq}'.encode())
+    journal.close()
+    journal = open_journal(tmp_path)
+    assert journal.last_index == 10
+    assert [(seq, bytes(payload)) for seq, payload in journal.read(7)] == [(8, b'm8'), (9, b'm9'), (10, b'm10')]
+
+def test_torn_tail_is_truncated(tmp_path):
+    journal = open_journal(tmp_path)
+    for seq in range(1, 4):
+        journal.append(seq, b'x' * 20)
+    journal.close()
+    path, = segment_paths(tmp_path)
+    intact = os.path.getsize(path)
+    # Absturz mitten im Schreiben des vierten Eintrags
+    with open(path, 'ab') as f:
+        f.write(RECORD.pack(20, 0, 0, 4) + b'x' * 5)
+    journal = open_journal(tmp_path)
+    assert os.path.getsize(path) == intact
+    assert [seq for seq, _ in journal.read()] == [1, 2, 3]
+    journal.append(4, b'y')
+    assert [seq for seq, _ in journal.read()] == [1, 2, 3, 4]
+
+def test_crc_mismatch_ends_the_segment(tmp_path):
+    journal = open_journal(tmp_path)
+    for seq in range(1, 4):
+        journal.append(seq, b'abcdef')
+    journal.close()
+    path, = segment_paths(tmp_path)
+    record_size = RECORD.size + 6
+    # Ein Byte in den Nutzdaten des zweiten Eintrags kippen
+    with open(path, 'r+b') as f:
+        f.seek(record_size + RECORD.size + 2)
+        f.write(b'X')
+    journal = open_journal(tmp_path)
+    assert [seq for seq, _ in journal.read()] == [1]
+    assert os.path.getsize(path) == record_size
+
+def test_read_respects_limit_across_segments(tmp_path):
+    journal = open_journal(tmp_path, segment_bytes=RECORD.size * 4)
+    # Follower füllen Lücken nachträglich, die Einträge liegen nicht geordnet in den Segmenten
+    for seq in [1, 2, 5, 6, 3, 4, 7, 8, 9, 10]:
+        journal.append(seq, str(seq).encode())
+    assert len(segment_paths(tmp_path)) > 1
+    assert [seq for seq, _ in journal.read(2, limit=4)] == [3, 4, 5, 6]
+    assert [seq for seq, _ in journal.read(8)] == [9, 10]
+
+def test_old_segments_are_deleted(tmp_path):
+    journal = open_journal(tmp_path, segment_bytes=1, max_segments=3)
+    for seq in range(1, 11):
+        journal.append(seq, b'z')
+    assert len(segment_paths(tmp_path)) == 3
+    assert [seq for seq, _ in journal.read()] == [8, 9, 10]
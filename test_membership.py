@@ -0,0 +1,74 @@
+import uuid
+
+from membership import MembershipLog, MembershipRegistry
+
+
+def server(port):
+    return {'server_id': str(uuid.uuid4()), 'server_address': ['127.0.0.1', port]}
+
+def client(port):
+    return {'client_id': str(uuid.uuid4()), 'client_address': ['127.0.0.1', port]}
+
+def test_deltas_between_versions():
+    log = MembershipLog()
+    for port in range(3):
+        log.record('join', 'client', client(port))
+    assert [change[0] for change in log.deltas_between(1, 3)] == [2, 3]
+    assert log.deltas_between(3, 3) == []
+
+def test_deltas_beyond_history_need_a_snapshot():
+    log = MembershipLog(history=2)
+    for port in range(4):
+        log.record('join', 'client', client(port))
+    assert log.deltas_between(0, 4) is None
+    assert [change[0] for change in log.deltas_between(2, 4)] == [3, 4]
+
+def test_registry_records_joins_and_leaves():
+    registry = MembershipRegistry()
+    member = client(1)
+    assert registry.join('client', member)
+    assert not registry.join('client', member)
+    registry.subscribe('lobby', member['client_id'])
+    assert registry.leave_address('client', ('127.0.0.1', 1)) == member
+    assert [change[1:3] for change in registry.log.deltas_between(0, registry.log.version)] == [
+        ['join', 'client'], ['subscribe', 'room'], ['leave', 'client']]
+    assert registry.room_count() == 0
+
+def test_follower_applies_leader_deltas():
+    leader = MembershipRegistry()
+    follower = MembershipRegistry()
+    servers = [server(port) for port in range(3)]
+    clients = [client(port) for port in range(3)]
+    for info in servers:
+        leader.join('server', info)
+    for info in clients:
+        leader.join('client', info)
+    leader.subscribe('lobby', clients[0]['client_id'])
+    leader.leave('server', servers[1]['server_id'])
+    leader.leave('client', clients[2]['client_id'])
+    for _, op, kind, node in leader.log.deltas_between(0, leader.log.version):
+        follower.apply(op, kind, node)
+    assert follower.server_ids() == leader.server_ids()
+    assert sorted(member['client_id'] for member in follower.client_list()) == sorted(member['client_id'] for member in leader.client_list())
+    assert follower.room_list() == leader.room_list()
+    # Übernommene Änderungen werden nicht selbst versioniert
+    assert follower.log.version == 0
+
+def test_snapshot_resets_follower():
+    leader = MembershipRegistry()
+    leader.join('server', server(1))
+    leader.join('client', client(2))
+    follower = MembershipRegistry()
+    follower.join('client', client(3))
+    version, server_list, client_list, room_list = leader.snapshot()
+    follower.reset(server_list, client_list, version, room_list)
+    assert follower.snapshot() == leader.snapshot()
+
+def test_ring_neighbours_follow_ids():
+    registry = MembershipRegistry()
+    servers = sorted((server(port) for port in range(3)), key=lambda info: info['server_id'])
+    for info in reversed(servers):
+        registry.join('server', info)
+    assert registry.neighbour(servers[0]['server_id']) == servers[1]
+    assert registry.neighbour(servers[2]['server_id']) == servers[0]
+    assert registry.neighbour(servers[0]['server_id'], 'right') == servers[2]
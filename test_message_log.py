@@ -0,0 +1,85 @@
+from message_log import MessageLog, ReorderBuffer
+
+
+def chat(client_id, client_seq, content='Hallo', room=None):
+    message = {'node_type': 'client', 'sender': {'client_id': client_id}, 'content': content, 'client_seq': client_seq}
+    if room is not None:
+        message['room'] = room
+    return message
+
+def test_reorder_holds_back_until_gap_is_filled():
+    buffer = ReorderBuffer()
+    assert buffer.receive(1, 'a') == (['a'], False)
+    assert buffer.receive(3, 'c') == ([], True)
+    assert buffer.receive(4, 'd') == ([], False)
+    assert buffer.receive(2, 'b') == (['b', 'c', 'd'], False)
+
+def test_reorder_drops_duplicates():
+    buffer = ReorderBuffer()
+    buffer.receive(1, 'a')
+    assert buffer.receive(1, 'a') == ([], False)
+    buffer.receive(3, 'c')
+    assert buffer.receive(3, 'c') == ([], False)
+
+def test_reorder_skips_a_gap():
+    buffer = ReorderBuffer()
+    buffer.receive(1, 'a')
+    buffer.receive(4, 'd')
+    buffer.receive(5, 'e')
+    assert buffer.skip() == ['d', 'e']
+    # Die übersprungenen Nachrichten kommen zu spät
+    assert buffer.receive(2, 'b') == ([], False)
+
+def test_reorder_follows_room_predecessors():
+    buffer = ReorderBuffer()
+    buffer.receive(1, 'a')
+    # Nummern 2 bis 4 gehören zu anderen Räumen
+    assert buffer.receive(5, 'e', prev=1) == (['e'], False)
+    assert buffer.receive(8, 'h', prev=7) == ([], True)
+
+def test_append_assigns_sequence_and_deduplicates():
+    log = MessageLog(size=8)
+    assert log.append(chat('c1', 1)) == 1
+    assert log.append(chat('c2', 1)) == 2
+    assert log.append(chat('c1', 1)) is None
+    # Nach einem Führungswechsel kann eine ältere Nachricht nach einer neueren eintreffen
+    assert log.append(chat('c1', 3)) == 3
+    assert log.append(chat('c1', 2)) == 4
+
+def test_append_links_room_predecessors():
+    log = MessageLog()
+    log.append(chat('c1', 1, room='a'))
+    log.append(chat('c1', 2, room='b'))
+    message = chat('c1', 3, room='a')
+    log.append(message)
+    assert message['prev'] == 1
+
+def test_follower_tracks_contiguous_sequence():
+    log = MessageLog(size=8)
+    assert log.add(1, chat('c1', 1))
+    assert log.add(3, chat('c1', 3))
+    assert (log.last_seq, log.contiguous_seq) == (3, 1)
+    assert not log.add(3, chat('c1', 3))
+    log.add(2, chat('c1', 2))
+    assert log.contiguous_seq == 3
+    assert [seq for seq, _ in log.since(1)] == [2, 3]
+
+def test_window_evicts_old_entries_but_remembers_them():
+    log = MessageLog(size=4)
+    for client_seq in range(1, 11):
+        log.append(chat('c1', client_seq))
+    assert [seq for seq, _ in log.since(0)] == [7, 8, 9, 10]
+    assert not log.add(2, chat('c2', 1))
+    assert log.append(chat('c1', 2)) is None
+
+def test_conflicting_entry_is_detected():
+    log = MessageLog()
+    log.add(5, chat('c1', 1, 'a'))
+    assert not log.conflicts_with(5, chat('c1', 1, 'a'))
+    assert log.conflicts_with(5, chat('c2', 1, 'b'))
+    assert not log.conflicts_with(6, chat('c2', 1, 'b'))
+
+def test_skip_to_continues_after_known_sequence():
+    log = MessageLog(size=8)
+    log.skip_to(20)
+    assert log.append(chat('c1', 1)) == 21
@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+
+# Verfolgung einzelner Chat-Nachrichten über alle Stationen: Der sendende Client markiert einen Anteil seiner
+# Nachrichten mit 'trace' (ID und Zeitstempel), jede Station hängt ihren Zeitstempel an. Die Empfänger schreiben
+# daraus Spans im Chrome-Trace-Format (chrome://tracing, ui.perfetto.dev), die Server zusätzlich ihre eigenen
+# Abschnitte. Die Zeitstempel stammen von der monotonen Uhr und sind nur zwischen Prozessen auf demselben Rechner
+# vergleichbar; über Rechner hinweg bleiben nur die Abschnitte innerhalb eines Prozesses aussagekräftig.
+
+# Anteil der Chat-Nachrichten, die ein Client verfolgt (0 = aus)
+TRACE_SAMPLE_RATE = 0.0
+
+
+# Mikrosekunden der monotonen Uhr, wie sie das Chrome-Trace-Format erwartet
+def timestamp():
+    return time.monotonic_ns() // 1000
+
+def new_trace(stage):
+    return {'id': uuid.uuid4().hex[:16], 'stamps': [[stage, timestamp()]]}
+
+# Liefert den Trace der Nachricht oder None; mit stage wird dessen Zeitstempel angehängt
+def trace_of(message, stage=None):
+    trace = message.get('trace') if isinstance(message, dict) else None
+    if not isinstance(trace, dict):
+        return None
+    if stage is not None:
+        trace['stamps'].append([stage, timestamp()])
+    return trace
+
+# Index des letzten Zeitstempels einer Station, damit ein Empfänger nur seinen eigenen Weg schreibt
+def last_stamp(trace, stage):
+    indices = [index for index, (name, _) in enumerate(trace['stamps']) if name == stage]
+    return indices[-1] if indices else 0
+
+
+# Schreibt Ereignisse im JSON-Array-Format des Chrome-Trace-Formats. Mehrere Prozesse können dieselbe Datei
+# verwenden: jedes Ereignis wird mit einem einzigen write() angehängt; die schließende Klammer darf fehlen.
+class TraceCollector:
+    def __init__(self, path, process_name):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.spans = 0
+        try:
+            self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+            os.write(self.fd, b'[\n')
+        except FileExistsError:
+            self.fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+        self.write([{'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0, 'args': {'name': process_name}}])
+
+    # Jede verfolgte Nachricht erhält pro Prozess und Empfänger eine eigene Zeile, damit sich Spans nicht überlappen.
+    # Der Name der Zeile wird jedes Mal mitgeschrieben, statt sich die bereits benannten Zeilen zu merken.
+    def row(self, trace_id, label, events):
+        tid = zlib.crc32(f'{trace_id} {label}'.encode())
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': f'{trace_id} {label}'.strip()}})
+        return tid
+
+    def span(self, name, start, end, trace_id, label='', **args):
+        events = []
+        tid = self.row(trace_id, label, events)
+        events.append({'name': name, 'cat': 'chat', 'ph': 'X', 'ts': start, 'dur': max(end - start, 0),
+                       'pid': self.pid, 'tid': tid, 'args': {'trace_id': trace_id, **args}})
+        self.write(events)
+
+    # Ein Span für jeden Abschnitt zwischen zwei Zeitstempeln ab dem Zeitstempel start
+    def hops(self, trace, start=0, label='', **args):
+        events = []
+        tid = self.row(trace['id'], label, events)
+        stamps = trace['stamps']
+        for (name, begin), (next_name, end) in zip(stamps[start:], stamps[start + 1:]):
+            events.append({'name': f'{name} → {next_name}', 'cat': 'chat', 'ph': 'X', 'ts': begin, 'dur': max(end - begin, 0),
+                           'pid': self.pid, 'tid': tid, 'args': {'trace_id': trace['id'], **args}})
+        self.write(events)
+
+    def write(self, events):
+        data = ''.join(json.dumps(event, ensure_ascii=False, separators=(',', ':')) + ',\n' for event in events).encode()
+        with self.lock:
+            os.write(self.fd, data)
+            self.spans += sum(event['ph'] == 'X' for event in events)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def load_events(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read().strip()
+    if not text.endswith(']'):
+        text = text.rstrip(',') + ']'
+    return json.loads(text)
+
+# Dauer der Spans pro Name in Millisekunden: (Anzahl, p50, p99, Maximum), nach p99 absteigend
+def summarize(path):
+    durations = {}
+    for event in load_events(path):
+        if event.get('ph') == 'X':
+            durations.setdefault(event['name'], []).append(event['dur'] / 1000)
+    summary = {}
+    for name, values in durations.items():
+        values.sort()
+        summary[name] = (len(values), values[len(values) // 2], values[min(len(values) - 1, int(len(values) * 0.99))], values[-1])
+    return dict(sorted(summary.items(), key=lambda item: -item[1][2]))
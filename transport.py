@@ -0,0 +1,482 @@
+import asyncio
+import itertools
+import select
+import socket
+import struct
+import threading
+import time
+
+# Jede Nachricht auf einer TCP-Verbindung wird mit einem 4-Byte-Längenheader versehen
+FRAME_HEADER = struct.Struct('!I')
+# Schutz vor fehlerhaften Längenangaben, keine Begrenzung für normale Nachrichten
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+READ_BUFFER_SIZE = 64 * 1024
+
+# Größte Nutzlast eines UDP-Datagramms und Größe der Fragmente für längere Nachrichten
+MAX_DATAGRAM_SIZE = 65507
+DATAGRAM_FRAGMENT_SIZE = 1400
+# Fragmentierte Datagramme beginnen mit einem Byte, das in JSON nicht vorkommt
+FRAGMENT_HEADER = struct.Struct('!BIHH')
+FRAGMENT_MARKER = 0xF7
+FRAGMENT_TIMEOUT = 5
+# Grenzen für das Zusammensetzen: Fragmente pro Nachricht (knapp 1,4 MB) und gleichzeitig unvollständige Nachrichten
+MAX_FRAGMENTS = 1024
+MAX_PARTIAL_DATAGRAMS = 64
+
+CONNECT_TIMEOUT = 1
+
+# Ein Sammel-Frame enthält mehrere Frames hintereinander; das erste Byte kommt weder in JSON noch im Binärformat vor
+BATCH_MARKER = 0xB7
+# Höchstzahl der Puffer pro sendmsg-Aufruf (IOV_MAX)
+SENDMSG_MAX_BUFFERS = 1024
+
+
+# Hilfsfunktionen für das Framing
+def encode_frame(payload):
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+# Fasst mehrere Nachrichten zu einer Nutzlast zusammen; eine einzelne Nachricht bleibt unverändert
+def encode_batch(payloads):
+    if len(payloads) == 1:
+        return payloads[0]
+    parts = [bytes((BATCH_MARKER,))]
+    for payload in payloads:
+        parts.append(FRAME_HEADER.pack(len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+# Liefert die einzelnen Nachrichten eines Frames, egal ob Sammel-Frame oder nicht
+def split_batch(payload):
+    if not payload or payload[0] != BATCH_MARKER:
+        yield payload
+        return
+    offset = 1
+    while offset < len(payload):
+        (length,) = FRAME_HEADER.unpack_from(payload, offset)
+        offset += FRAME_HEADER.size
+        yield payload[offset:offset + length]
+        offset += length
+
+# Empfangspuffer, in den direkt hineingelesen wird (recv_into bzw. asyncio.BufferedProtocol).
+# Vollständige Frames werden ohne weiteres Umkopieren des Puffers herausgelöst, Teilstücke bleiben liegen.
+class FrameBuffer:
+    def __init__(self, size=READ_BUFFER_SIZE, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.max_frame_size = max_frame_size
+
+    def get_buffer(self):
+        if self.end == len(self.buffer):
+            self.reserve(len(self.buffer) - self.start + 1)
+        return self.view[self.end:]
+
+    def advance(self, size):
+        self.end += size
+
+    # Sorgt dafür, dass ab start mindestens size Bytes Platz sind
+    def reserve(self, size):
+        if self.start + size <= len(self.buffer):
+            return
+        pending = self.end - self.start
+        if size > len(self.buffer):
+            self.view.release()
+            new_buffer = bytearray(max(size, 2 * len(self.buffer)))
+            new_buffer[:pending] = self.buffer[self.start:self.end]
+            self.buffer = new_buffer
+            self.view = memoryview(self.buffer)
+        else:
+            self.view[:pending] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+    def next_frame(self):
+        available = self.end - self.start
+        if available < FRAME_HEADER.size:
+            return None
+        (length,) = FRAME_HEADER.unpack_from(self.buffer, self.start)
+        if length > self.max_frame_size:
+            raise ValueError(f'Frame zu groß: {length} Bytes')
+        total = FRAME_HEADER.size + length
+        if available < total:
+            self.reserve(total)
+            return None
+        payload = self.view[self.start + FRAME_HEADER.size:self.start + total].tobytes()
+        self.start += total
+        if self.start == self.end:
+            self.start = self.end = 0
+        return payload
+
+    def frames(self):
+        frame = self.next_frame()
+        while frame is not None:
+            yield frame
+            frame = self.next_frame()
+
+
+# Liest beliebig viele, beliebig große Frames nacheinander von einem blockierenden Socket
+class FrameReader:
+    def __init__(self, sock):
+        self.sock = sock
+        self.frame_buffer = FrameBuffer()
+
+    def __iter__(self):
+        while True:
+            yield from self.frame_buffer.frames()
+            size = self.sock.recv_into(self.frame_buffer.get_buffer())
+            if size == 0:
+                return
+            self.frame_buffer.advance(size)
+
+# Zerlegt eine Nachricht, die nicht in ein Datagramm passt, in nummerierte Fragmente
+message_ids = itertools.count()
+
+def split_datagram(payload, fragment_size=DATAGRAM_FRAGMENT_SIZE):
+    if len(payload) <= fragment_size:
+        return [payload]
+    message_id = next(message_ids) & 0xFFFFFFFF
+    count = (len(payload) + fragment_size - 1) // fragment_size
+    return [FRAGMENT_HEADER.pack(FRAGMENT_MARKER, message_id, index, count) + payload[index * fragment_size:(index + 1) * fragment_size]
+            for index in range(count)]
+
+# Setzt fragmentierte Datagramme wieder zusammen; unvollständige Nachrichten verfallen nach FRAGMENT_TIMEOUT.
+# Fragmente mit unmöglichem Index oder zu großer Anzahl werden verworfen, ebenso neue Nachrichten, solange
+# bereits max_partial unvollständige warten.
+class DatagramAssembler:
+    def __init__(self, timeout=FRAGMENT_TIMEOUT, max_fragments=MAX_FRAGMENTS, max_partial=MAX_PARTIAL_DATAGRAMS):
+        self.timeout = timeout
+        self.max_fragments = max_fragments
+        self.max_partial = max_partial
+        self.partial = {}
+
+    def feed(self, data, address):
+        if not data or data[0] != FRAGMENT_MARKER:
+            return data
+        if len(data) < FRAGMENT_HEADER.size:
+            return None
+        marker, message_id, index, count = FRAGMENT_HEADER.unpack_from(data)
+        if not index < count <= self.max_fragments:
+            return None
+        now = time.monotonic()
+        self.expire(now)
+        # Die Anzahl gehört zum Schlüssel: alle Fragmente einer Nachricht liegen dann unter count
+        key = (address, message_id, count)
+        if key not in self.partial and len(self.partial) >= self.max_partial:
+            return None
+        started, fragments = self.partial.setdefault(key, (now, {}))
+        fragments[index] = data[FRAGMENT_HEADER.size:]
+        if len(fragments) < count:
+            return None
+        del self.partial[key]
+        return b''.join(fragments[i] for i in range(count))
+
+    def expire(self, now):
+        for key, (started, _) in list(self.partial.items()):
+            if now - started > self.timeout:
+                del self.partial[key]
+
+def open_connection(address, timeout=CONNECT_TIMEOUT):
+    s = socket.create_connection(tuple(address), timeout=timeout)
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    s.settimeout(timeout)
+    return s
+
+# Schreibt mehrere Puffer mit möglichst wenigen Systemaufrufen, ohne sie vorher zusammenzukopieren
+def send_buffers(sock, buffers):
+    if len(buffers) == 1 or not hasattr(sock, 'sendmsg'):
+        sock.sendall(buffers[0] if len(buffers) == 1 else b''.join(buffers))
+        return
+    buffers = [memoryview(buffer) for buffer in buffers]
+    index = 0
+    while index < len(buffers):
+        sent = sock.sendmsg(buffers[index:index + SENDMSG_MAX_BUFFERS])
+        while sent:
+            if sent >= len(buffers[index]):
+                sent -= len(buffers[index])
+                index += 1
+            else:
+                buffers[index] = buffers[index][sent:]
+                sent = 0
+
+# Zeitgrenze nur für das Schreiben; ein anderer Thread kann auf demselben Socket weiter blockierend lesen
+def set_send_timeout(sock, timeout):
+    seconds = int(timeout)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack('ll', seconds, int((timeout - seconds) * 1000000)))
+
+def peer_closed(sock):
+    # Prüft ohne zu blockieren, ob die Gegenseite die Verbindung bereits geschlossen hat
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        data = sock.recv(1, socket.MSG_PEEK)
+    except (ValueError, OSError):
+        return True
+    return data == b''
+
+
+# Langlebige Verbindung zu einem anderen Knoten. Eine Sitzung ist eine Verbindung, die der Client aufgebaut hat;
+# auf ihr liest gleichzeitig ein anderer Thread die Nachrichten des Clients.
+class Connection:
+    def __init__(self, sock, address, session=False):
+        self.sock = sock
+        self.address = tuple(address)
+        self.session = session
+        self.lock = threading.Lock()
+        # Mindestens ein Schreibvorgang ist gelungen; erst dann lohnt bei einem Fehler ein neuer Versuch
+        self.used = False
+
+    def send(self, payload):
+        with self.lock:
+            self.sock.sendall(encode_frame(payload))
+
+    # Bereits fertig gerahmte Frames, z.B. ein an viele Empfänger geteilter Puffer
+    def send_frames(self, frames):
+        with self.lock:
+            send_buffers(self.sock, frames)
+            self.used = True
+
+    def close(self):
+        try:
+            if self.session:
+                # Weckt den Thread, der auf der Sitzung liest
+                self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+# Hält pro Zieladresse genau eine offene Verbindung und verwendet sie für alle Nachrichten wieder
+class ConnectionPool:
+    def __init__(self, timeout=CONNECT_TIMEOUT):
+        self.timeout = timeout
+        self.connections = {}
+        self.lock = threading.Lock()
+        # Fehlgeschlagene Verbindungsaufbauten und Schreibvorgänge
+        self.failures = 0
+
+    def get(self, address):
+        address = tuple(address)
+        with self.lock:
+            connection = self.connections.get(address)
+        # Der Blick auf den Socket läuft außerhalb der Sperre, damit Sender an andere Ziele nicht warten.
+        # Sitzungen prüft der lesende Thread; ein Blick mit MSG_PEEK könnte hier blockieren.
+        if connection is not None and not connection.session and peer_closed(connection.sock):
+            self.detach(address, connection.sock)
+            connection = None
+        if connection is not None:
+            return connection
+
+        # Verbindungsaufbau außerhalb der Sperre, damit andere Ziele nicht warten müssen
+        new_connection = Connection(open_connection(address, self.timeout), address)
+        with self.lock:
+            connection = self.connections.setdefault(address, new_connection)
+        if connection is not new_connection:
+            new_connection.close()
+        return connection
+
+    def send(self, address, payload):
+        self.send_frames(address, [encode_frame(payload)])
+
+    def send_frames(self, address, frames):
+        try:
+            connection = self.get(address)
+            try:
+                connection.send_frames(frames)
+            except OSError as e:
+                # Die Gegenseite hat eine schon benutzte Verbindung geschlossen, seit sie zuletzt geprüft wurde:
+                # einmal neu verbinden. Eine Zeitüberschreitung spricht für einen langsamen Empfänger, nicht dafür.
+                if connection.session or not connection.used or isinstance(e, TimeoutError):
+                    raise
+                self.detach(address, connection.sock)
+                self.get(address).send_frames(frames)
+        except OSError:
+            # Tote Gegenstelle wird beim Schreiben erkannt und aus dem Pool entfernt
+            with self.lock:
+                self.failures += 1
+            self.discard(address)
+            raise
+
+    # Übernimmt eine vom Client aufgebaute Verbindung, über die er künftig seine Nachrichten erhält
+    def attach(self, address, sock):
+        address = tuple(address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        set_send_timeout(sock, self.timeout)
+        with self.lock:
+            previous = self.connections.get(address)
+            if previous is not None and previous.sock is sock:
+                return
+            self.connections[address] = Connection(sock, address, session=True)
+        if previous is not None:
+            previous.close()
+
+    # Entfernt die Sitzung, falls unter der Adresse noch diese Verbindung eingetragen ist
+    def detach(self, address, sock):
+        with self.lock:
+            connection = self.connections.get(tuple(address))
+            if connection is None or connection.sock is not sock:
+                return False
+            del self.connections[tuple(address)]
+        connection.close()
+        return True
+
+    def has(self, address):
+        return tuple(address) in self.connections
+
+    # Trennt alle Sitzungen, damit die Clients sich einen anderen Server suchen
+    # Die Einträge bleiben stehen: der Thread, der auf der Sitzung liest, entfernt sie mit detach() und
+    # meldet damit auch den Client ab
+    def close_sessions(self):
+        with self.lock:
+            sessions = [connection for connection in self.connections.values() if connection.session]
+        for connection in sessions:
+            connection.close()
+
+    def discard(self, address):
+        with self.lock:
+            connection = self.connections.pop(tuple(address), None)
+        if connection is not None:
+            connection.close()
+
+    def close_all(self):
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections.clear()
+        for connection in connections:
+            connection.close()
+
+
+# Ausgehende Verbindung im asyncio-Modus; Frames werden gepuffert, bis die Verbindung steht
+class AsyncConnection(asyncio.Protocol):
+    def __init__(self, pool, address):
+        self.pool = pool
+        self.address = address
+        self.transport = None
+        self.session = False
+        self.pending = []
+        self.pending_size = 0
+
+    def write(self, frame):
+        if self.transport is None:
+            self.pending.append(frame)
+            self.pending_size += len(frame)
+        else:
+            self.transport.write(frame)
+
+    def buffered_bytes(self):
+        if self.transport is None:
+            return self.pending_size
+        return self.transport.get_write_buffer_size()
+
+    async def connect(self):
+        try:
+            await asyncio.wait_for(self.pool.loop.create_connection(lambda: self, *self.address), self.pool.timeout)
+        except (OSError, asyncio.TimeoutError):
+            self.pool.fail(self.address, self)
+
+    def connection_made(self, transport):
+        transport.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.transport = transport
+        transport.writelines(self.pending)
+        self.pending = []
+        self.pending_size = 0
+
+    def connection_lost(self, exc):
+        self.pool.fail(self.address, self)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+# Gegenstück zu ConnectionPool für die asyncio-Ereignisschleife: send() blockiert nie
+class AsyncConnectionPool:
+    def __init__(self, loop, timeout=CONNECT_TIMEOUT, on_failure=None):
+        self.loop = loop
+        self.timeout = timeout
+        self.on_failure = on_failure
+        self.connections = {}
+        self.thread_id = threading.get_ident()
+        self.failures = 0
+
+    def send(self, address, payload):
+        self.send_frame(address, encode_frame(payload))
+
+    def send_frame(self, address, frame):
+        # Aufrufe aus anderen Threads (z.B. der Servererkennung) werden an die Schleife übergeben
+        if threading.get_ident() != self.thread_id:
+            self.loop.call_soon_threadsafe(self.send_frame, address, frame)
+            return
+        address = tuple(address)
+        connection = self.connections.get(address)
+        if connection is None:
+            connection = AsyncConnection(self, address)
+            self.connections[address] = connection
+            self.loop.create_task(connection.connect())
+        connection.write(frame)
+
+    def buffered_bytes(self, address):
+        connection = self.connections.get(tuple(address))
+        if connection is None:
+            return 0
+        return connection.buffered_bytes()
+
+    def fail(self, address, connection):
+        if self.connections.get(address) is not connection:
+            return
+        del self.connections[address]
+        self.failures += 1
+        connection.close()
+        if self.on_failure is not None:
+            self.on_failure(address)
+
+    def attach(self, address, transport):
+        address = tuple(address)
+        sock = transport.get_extra_info('socket')
+        # Sitzungen, die ein anderer Prozess des Servers hält, haben hier keinen eigenen Socket (siehe workers.py)
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        previous = self.connections.get(address)
+        if previous is not None and previous.transport is transport:
+            return
+        connection = AsyncConnection(self, address)
+        connection.transport = transport
+        connection.session = True
+        self.connections[address] = connection
+        if previous is not None:
+            previous.close()
+
+    def detach(self, address, transport):
+        connection = self.connections.get(tuple(address))
+        if connection is None or connection.transport is not transport:
+            return False
+        del self.connections[tuple(address)]
+        connection.close()
+        return True
+
+    def has(self, address):
+        return tuple(address) in self.connections
+
+    def close_sessions(self):
+        if threading.get_ident() != self.thread_id:
+            self.loop.call_soon_threadsafe(self.close_sessions)
+            return
+        # Wie bei ConnectionPool entfernt erst connection_lost() der Sitzung den Eintrag mit detach()
+        sessions = [connection for connection in self.connections.values() if connection.session]
+        for connection in sessions:
+            connection.close()
+
+    def discard(self, address):
+        connection = self.connections.pop(tuple(address), None)
+        if connection is not None:
+            connection.close()
+
+    def close_all(self):
+        for connection in list(self.connections.values()):
+            connection.close()
+        self.connections.clear()
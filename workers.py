@@ -0,0 +1,380 @@
+import argparse
+import asyncio
+import atexit
+import collections
+import itertools
+import json
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+
+from codec import COMPRESSED_MAGIC, COMPRESSION_THRESHOLD, configure_compression, decode_auto, get_codec, negotiate_codec
+from fanout import BATCH_DELAY, BATCH_MAX_MESSAGES, SLOW_CONSUMER_BUFFER_BYTES, SLOW_CONSUMER_POLICIES, AsyncFanoutEngine
+from log import LOG_LEVELS, LOG_RATE, configure_logging, logger
+from message_log import DEFAULT_ROOM
+from transport import FrameBuffer, AsyncConnectionPool, encode_frame, split_batch
+
+# Mehrere Prozesse bilden einen Server: der erste (Führungsprozess) nimmt an Wahl und Heartbeat teil und vergibt die
+# Sequenznummern, die übrigen (Worker) teilen sich mit ihm den TCP-Port über SO_REUSEPORT und bedienen nur die
+# Sitzungen, die der Kernel ihnen zuteilt. Jeder Worker ist über einen Unix-Socket mit dem Führungsprozess verbunden:
+# er leitet alle empfangenen Nachrichten weiter und erhält jede Chat-Nachricht einmal, um sie selbst an seine
+# Clients zu verteilen. Kodieren und Senden laufen so auf mehreren Kernen.
+
+# Der Unix-Socket zwischen Führungsprozess und Workern liegt in einem privaten Verzeichnis (nur für den Eigentümer
+# zugänglich), das der Führungsprozess unterhalb von WORKER_SOCKET_DIR anlegt (None = Verzeichnis für temporäre Dateien)
+WORKER_SOCKET_DIR = None
+# Abstand, in dem ein Worker wartende Bytes und verteilte Nachrichten meldet, und Prüfintervall für abgestürzte Worker
+WORKER_REPORT_INTERVAL = 0.05
+WORKER_RESTART_INTERVAL = 1
+
+# Jeder Eintrag auf dem Unix-Socket ist ein Frame aus Länge des Kopfes, Kopf (JSON) und Nutzdaten
+RECORD_HEADER = struct.Struct('!I')
+# Nur Nachrichten, die einen dieser Inhalte tragen können, dekodiert der Worker selbst (siehe Worker.receive)
+TRACKED_CONTENTS = (b'#Joining#', b'#Leaving#')
+
+# Nur im Worker gesetzt, siehe __main__
+WORKER_INDEX = 0
+LOCAL_IP = '127.0.0.1'
+SERVER_PORT = 0
+LINK_PATH = None
+SLOW_CONSUMER_POLICY = 'drop'
+SLOW_CONSUMER_BUFFER = SLOW_CONSUMER_BUFFER_BYTES
+BATCH_WINDOW = BATCH_DELAY
+BATCH_MESSAGES = BATCH_MAX_MESSAGES
+COMPRESSION_MIN_BYTES = COMPRESSION_THRESHOLD
+LOG_LEVEL = 'info'
+LOG_MAX_RATE = LOG_RATE
+
+
+def worker_socket_path(port, directory=WORKER_SOCKET_DIR):
+    return os.path.join(tempfile.mkdtemp(prefix='chat_workers_', dir=directory), f'{port}.sock')
+
+# Alle Prozesse eines Servers binden denselben Port; der Kernel verteilt neue Verbindungen auf sie
+def create_shared_tcp_socket(address):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.bind(tuple(address))
+    s.listen()
+    return s
+
+def encode_record(header, body=b''):
+    header = json.dumps(header, separators=(',', ':')).encode()
+    return encode_frame(RECORD_HEADER.pack(len(header)) + header + body)
+
+def decode_record(frame):
+    (length,) = RECORD_HEADER.unpack_from(frame)
+    start = RECORD_HEADER.size
+    return json.loads(frame[start:start + length]), frame[start + length:]
+
+
+# Gemeinsame Grundlage beider Enden des Unix-Sockets
+class RecordProtocol(asyncio.BufferedProtocol):
+    def connection_made(self, transport):
+        self.transport = transport
+        self.frame_buffer = FrameBuffer()
+
+    def get_buffer(self, sizehint):
+        return self.frame_buffer.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.frame_buffer.advance(nbytes)
+        try:
+            for frame in self.frame_buffer.frames():
+                self.record_received(*decode_record(frame))
+        except ValueError:
+            self.transport.close()
+
+    def send(self, header, body=b''):
+        if not self.transport.is_closing():
+            self.transport.write(encode_record(header, body))
+
+
+# Führungsprozess: steht im Verbindungspool für die Verbindung eines Workers zu einem Client.
+# Einzelne Frames (Nachholen, #Backpressure#) und das Trennen reicht der Worker an die Verbindung weiter.
+class WorkerTransport:
+    def __init__(self, link, connection_id):
+        self.link = link
+        self.connection_id = connection_id
+
+    def write(self, frame):
+        self.link.send({'op': 'send', 'connection': self.connection_id}, frame)
+
+    def writelines(self, frames):
+        self.write(b''.join(frames))
+
+    # Langsame Clients erkennt der Worker an seinem eigenen Sendepuffer
+    def get_write_buffer_size(self):
+        return 0
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+    def is_closing(self):
+        return self.link.transport.is_closing()
+
+    def close(self):
+        self.link.send({'op': 'close', 'connection': self.connection_id})
+
+
+# Führungsprozess: Verbindung zu einem Worker. Jede Verbindung des Workers erhält hier eine eigene Sitzung.
+class WorkerLink(RecordProtocol):
+    def __init__(self, hub):
+        self.hub = hub
+        self.sessions = {}
+        self.queued = 0
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.hub.links.append(self)
+
+    def connection_lost(self, exc):
+        self.hub.links.remove(self)
+        # Die Clients des Workers bauen ihre Sitzung bei einem anderen Prozess neu auf
+        for session in self.sessions.values():
+            self.hub.on_closed(session)
+        self.sessions.clear()
+
+    def record_received(self, header, body):
+        match header['op']:
+            case 'message':
+                session = self.sessions.get(header['connection'])
+                if session is None:
+                    session = self.sessions[header['connection']] = self.hub.session_factory(WorkerTransport(self, header['connection']))
+                self.hub.on_message(body, session)
+            case 'closed':
+                session = self.sessions.pop(header['connection'], None)
+                if session is not None:
+                    self.hub.on_closed(session)
+            case 'report':
+                self.queued = header['queued']
+                self.hub.sent += header['sent']
+
+
+# Führungsprozess: startet die Worker, überwacht sie und verteilt Chat-Nachrichten an sie.
+# on_message(Nutzdaten, Sitzung) und on_closed(Sitzung) entsprechen dem Empfang auf einer eigenen Verbindung.
+class WorkerHub:
+    def __init__(self, loop, path, session_factory, on_message, on_closed):
+        self.loop = loop
+        self.path = path
+        self.session_factory = session_factory
+        self.on_message = on_message
+        self.on_closed = on_closed
+        self.thread_id = threading.get_ident()
+        self.links = []
+        self.processes = {}
+        # An Clients der Worker verteilte Nachrichten
+        self.sent = 0
+
+    async def start(self):
+        await self.loop.create_unix_server(lambda: WorkerLink(self), self.path)
+        atexit.register(self.stop)
+
+    def spawn(self, index, arguments):
+        command = [sys.executable, os.path.abspath(__file__), '--index', str(index), '--link', self.path] + arguments
+        self.processes[index] = (subprocess.Popen(command), arguments)
+
+    # Startet abgestürzte Worker neu; ihre Clients haben sich bis dahin bei einem anderen Prozess angemeldet
+    async def supervise(self):
+        while True:
+            await asyncio.sleep(WORKER_RESTART_INTERVAL)
+            for index, (process, arguments) in list(self.processes.items()):
+                if process.poll() is not None:
+                    logger.warning('Worker %s beendet (Code %s), starte neu', index, process.returncode)
+                    self.spawn(index, arguments)
+
+    def publish(self, payload, room, codec_name):
+        if threading.get_ident() != self.thread_id:
+            self.loop.call_soon_threadsafe(self.publish, payload, room, codec_name)
+            return
+        record = encode_record({'op': 'publish', 'room': room, 'codec': codec_name}, payload)
+        for link in self.links:
+            if not link.transport.is_closing():
+                link.transport.write(record)
+
+    def queued_bytes(self):
+        return sum(link.queued for link in self.links)
+
+    def stop(self):
+        for process, _ in self.processes.values():
+            process.terminate()
+        shutil.rmtree(os.path.dirname(self.path), ignore_errors=True)
+
+
+# Worker: eine vom Kernel zugeteilte Verbindung, meist die Sitzung eines Clients, sonst die eines anderen Servers
+class WorkerConnection(asyncio.BufferedProtocol):
+    def __init__(self, worker, connection_id):
+        self.worker = worker
+        self.connection_id = connection_id
+        self.address = None
+        self.codec = 'json'
+        self.rooms = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.frame_buffer = FrameBuffer()
+        self.worker.connections[self.connection_id] = self
+
+    def connection_lost(self, exc):
+        self.worker.close(self)
+
+    def get_buffer(self, sizehint):
+        return self.frame_buffer.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.frame_buffer.advance(nbytes)
+        try:
+            for frame in self.frame_buffer.frames():
+                for payload in split_batch(frame):
+                    self.worker.receive(self, payload)
+        except ValueError:
+            self.transport.close()
+
+
+# Worker: Verbindung zum Führungsprozess; endet sie, beendet sich der Worker und seine Clients suchen neu
+class PrimaryLink(RecordProtocol):
+    def __init__(self, worker):
+        self.worker = worker
+
+    def connection_lost(self, exc):
+        self.worker.stopped.set_result(None)
+
+    def record_received(self, header, body):
+        match header['op']:
+            case 'publish':
+                self.worker.publish(body, header['room'], header['codec'])
+            case 'send':
+                connection = self.worker.connections.get(header['connection'])
+                if connection is not None and not connection.transport.is_closing():
+                    connection.transport.write(body)
+            case 'close':
+                connection = self.worker.connections.get(header['connection'])
+                if connection is not None:
+                    connection.transport.close()
+
+
+# Worker: führt Sitzungen und Räume seiner Clients nach den Nachrichten, die er weiterleitet, und verteilt jede
+# Chat-Nachricht des Führungsprozesses selbst an sie
+class Worker:
+    def __init__(self, loop):
+        self.loop = loop
+        self.pool = AsyncConnectionPool(loop, timeout=1)
+        self.fanout = AsyncFanoutEngine(self.pool, policy=SLOW_CONSUMER_POLICY, buffer_bytes=SLOW_CONSUMER_BUFFER,
+                                        batch_delay=BATCH_WINDOW, batch_messages=BATCH_MESSAGES)
+        self.connections = {}
+        self.sessions = {}
+        self.connection_ids = itertools.count()
+        self.link = None
+        self.stopped = loop.create_future()
+        self.sent = 0
+
+    async def run(self):
+        _, self.link = await self.loop.create_unix_connection(lambda: PrimaryLink(self), LINK_PATH)
+        await self.loop.create_server(lambda: WorkerConnection(self, next(self.connection_ids)),
+                                      sock=create_shared_tcp_socket((LOCAL_IP, SERVER_PORT)))
+        logger.info('Worker %s bedient Clients auf %s:%s', WORKER_INDEX, LOCAL_IP, SERVER_PORT)
+        report_task = self.loop.create_task(self.report())
+        await self.stopped
+        report_task.cancel()
+        logger.info('Worker %s: Verbindung zum Führungsprozess beendet', WORKER_INDEX)
+
+    # Der Führungsprozess dekodiert jede Nachricht ohnehin. Der Worker leitet die Nutzdaten unverändert weiter und
+    # dekodiert nur, was nach Beitritt oder Austritt aussieht: beide Codecs enthalten den Inhalt als Klartext.
+    # Komprimierte Nutzdaten lassen sich so nicht prüfen und werden immer dekodiert.
+    def receive(self, connection, payload):
+        if payload[:1] == bytes([COMPRESSED_MAGIC]) or any(content in payload for content in TRACKED_CONTENTS):
+            message = decode_auto(payload)
+            if message.get('node_type') == 'client' and message.get('content') in ('#Joining#', '#Leaving#'):
+                self.track(connection, message)
+        self.link.send({'op': 'message', 'connection': connection.connection_id}, payload)
+
+    # Der Führungsprozess übernimmt dieselben Änderungen; hier genügt, was für die Verteilung nötig ist
+    def track(self, connection, message):
+        room = message.get('room')
+        if message.get('session') and message['content'] == '#Joining#':
+            address = tuple(message['sender']['client_address'])
+            connection.codec = negotiate_codec(message.get('codecs'))
+            connection.rooms = set(message.get('rooms', ()))
+            if connection.address != address:
+                connection.address = address
+                self.pool.attach(address, connection.transport)
+            self.sessions[connection.connection_id] = connection
+        elif connection.address is not None and isinstance(room, str) and room != DEFAULT_ROOM:
+            if message['content'] == '#Joining#':
+                connection.rooms.add(room)
+            else:
+                connection.rooms.discard(room)
+
+    def close(self, connection):
+        self.connections.pop(connection.connection_id, None)
+        self.sessions.pop(connection.connection_id, None)
+        if connection.address is not None:
+            self.pool.detach(connection.address, connection.transport)
+        if not self.link.transport.is_closing():
+            self.link.send({'op': 'closed', 'connection': connection.connection_id})
+
+    # Wie message_all_clients im Führungsprozess: pro Codec einmal kodieren, die Nutzdaten im Codec des
+    # Führungsprozesses werden unverändert weitergegeben
+    def publish(self, payload, room, codec_name):
+        recipients = collections.defaultdict(list)
+        for connection in self.sessions.values():
+            if room == DEFAULT_ROOM or room in connection.rooms:
+                recipients[connection.codec].append(connection.address)
+        message = None
+        for client_codec, addresses in recipients.items():
+            if client_codec != codec_name and message is None:
+                message = decode_auto(payload)
+            self.fanout.publish(addresses, payload if client_codec == codec_name else get_codec(client_codec).encode(message))
+            self.sent += len(addresses)
+
+    # Wartende Bytes fließen in die Zulassung des Führungsprozesses ein, verteilte Nachrichten in seine Metriken
+    async def report(self):
+        reported = (None, 0)
+        while True:
+            await asyncio.sleep(WORKER_REPORT_INTERVAL)
+            state = (self.fanout.queued_bytes(), self.sent)
+            if state != reported:
+                self.link.send({'op': 'report', 'queued': state[0], 'sent': state[1] - reported[1]})
+                reported = state
+
+
+async def worker_main():
+    await Worker(asyncio.get_running_loop()).run()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index', type=int, default=WORKER_INDEX)
+    parser.add_argument('--link', required=True, help='Unix-Socket des Führungsprozesses')
+    parser.add_argument('--local-ip', default=LOCAL_IP)
+    parser.add_argument('--port', type=int, required=True, help='Gemeinsamer TCP-Port des Servers')
+    parser.add_argument('--slow-consumer-policy', choices=SLOW_CONSUMER_POLICIES, default=SLOW_CONSUMER_POLICY)
+    parser.add_argument('--slow-consumer-buffer', type=int, default=SLOW_CONSUMER_BUFFER)
+    parser.add_argument('--batch-window', type=float, default=BATCH_WINDOW)
+    parser.add_argument('--batch-messages', type=int, default=BATCH_MESSAGES)
+    parser.add_argument('--compression-threshold', type=int, default=COMPRESSION_MIN_BYTES)
+    parser.add_argument('--log-level', choices=list(LOG_LEVELS), default=LOG_LEVEL)
+    parser.add_argument('--log-rate', type=float, default=LOG_MAX_RATE)
+    args = parser.parse_args()
+    WORKER_INDEX = args.index
+    LINK_PATH = args.link
+    LOCAL_IP = args.local_ip
+    SERVER_PORT = args.port
+    SLOW_CONSUMER_POLICY = args.slow_consumer_policy
+    SLOW_CONSUMER_BUFFER = args.slow_consumer_buffer
+    BATCH_WINDOW = args.batch_window
+    BATCH_MESSAGES = args.batch_messages
+    COMPRESSION_MIN_BYTES = args.compression_threshold
+    LOG_LEVEL = args.log_level
+    LOG_MAX_RATE = args.log_rate
+    configure_logging(LOG_LEVEL, LOG_MAX_RATE)
+    configure_compression(COMPRESSION_MIN_BYTES)
+    try:
+        asyncio.run(worker_main())
+    except (ConnectionRefusedError, FileNotFoundError):
+        logger.error('Führungsprozess unter %s nicht erreichbar', LINK_PATH)
+        sys.exit(1)